@@ -1,33 +1,1129 @@
 import os
+import re
+import sys
+import html
+import math
+import time
+
+# Medido desde aqui: a importação do app entra nas métricas de inicialização
+_INICIO_IMPORTACAO = time.perf_counter()
+
+import gc
+import mmap
+import random
+import string
+import unicodedata
+import io
+import csv
+import atexit
+import bisect
+import uuid
+import sqlite3
 import hashlib
+import logging
+import logging.handlers
+import queue
+import threading
+from collections import OrderedDict, deque
+from contextlib import contextmanager, ExitStack
 from datetime import datetime
-import google.generativeai as genai
-from flask import Flask, render_template, request, session, redirect, url_for, jsonify, Response
+from flask import (Flask, render_template, request, session, redirect, url_for, jsonify, Response, g,
+                   has_app_context, stream_with_context)
 import json
 
+try:
+    import fcntl
+except ImportError:  # Windows: a trava vale só entre as threads do mesmo processo
+    fcntl = None
+
 # ============================================================================
 # CONFIGURAÇÕES INICIAIS DO SERVIDOR FLASK
 # ============================================================================
 
 app = Flask(__name__, template_folder='templates', static_folder='static')
-app.secret_key = os.urandom(24)
 
 # ============================================================================
 # CONFIGURAÇÕES DA API DO GOOGLE GEMINI (IA)
 # ============================================================================
 
 GOOGLE_API_KEY = ""
-genai.configure(api_key=GOOGLE_API_KEY)
-modelo_gemini = genai.GenerativeModel('gemini-2.5-flash')
+NOME_MODELO_GEMINI = 'gemini-2.5-flash'
+# "rest" deixa as chamadas cooperativas quando o servidor roda com gevent (ver wsgi.py).
+# O cliente (google.generativeai) só é importado e configurado na primeira conversa
+# ou no pré-aquecimento: a importação sozinha leva quase um segundo
+GEMINI_TRANSPORTE = os.environ.get('UNIHELP_GEMINI_TRANSPORTE') or None
+
+# Limite de chamadas simultâneas ao modelo por processo; quem passar do limite
+# espera até ESPERA_VAGA_MODELO_SEGUNDOS por uma vaga (em rodízio entre os alunos)
+MAX_CHAMADAS_MODELO_SIMULTANEAS = int(os.environ.get('UNIHELP_MAX_CHAMADAS_MODELO', 64))
+ESPERA_VAGA_MODELO_SEGUNDOS = 30
+
+# Prazo total de cada resposta do modelo, contando as retentativas em erros
+# temporários (429, 5xx, timeout), que esperam com backoff exponencial e jitter
+MODELO_PRAZO_SEGUNDOS = float(os.environ.get('UNIHELP_MODELO_PRAZO', 60))
+MODELO_MAX_TENTATIVAS = 4
+MODELO_ESPERA_BASE_SEGUNDOS = 0.5
+MODELO_ESPERA_MAX_SEGUNDOS = 8
+
+# Cota da API por minuto (do projeto inteiro, dividida entre os workers); 0 desliga
+MODELO_REQUISICOES_POR_MINUTO = int(os.environ.get('UNIHELP_MODELO_RPM', 1000))
+MODELO_TOKENS_POR_MINUTO = int(os.environ.get('UNIHELP_MODELO_TPM', 1000000))
+PROCESSOS_SERVIDOR = max(1, int(os.environ.get('UNIHELP_WORKERS') or 1))
+
+# Objetos de chat mantidos por conversa (ver GerenciadorSessoesChat)
+CHAT_SESSOES_MAX = 1000
+CHAT_SESSOES_OCIOSIDADE_SEGUNDOS = 30 * 60
+
+# Janela de contexto da conversa, em tokens estimados (sem o prompt de sistema):
+# passando de HISTORICO_ORCAMENTO_TOKENS, os turnos mais antigos viram um resumo
+# curto até a conversa voltar a HISTORICO_FRACAO_APOS_RESUMO do orçamento
+HISTORICO_ORCAMENTO_TOKENS = int(os.environ.get('UNIHELP_HISTORICO_TOKENS', 4000))
+HISTORICO_FRACAO_APOS_RESUMO = 0.5
+HISTORICO_MIN_MENSAGENS_RECENTES = 2
+RESUMO_MAX_TOKENS = 500
+RESUMO_MAX_CARACTERES_MENSAGEM = 200
 
 # ============================================================================
 # DEFINIÇÃO DOS ARQUIVOS DE DADOS
 # ============================================================================
 
 NOME_ARQUIVO_CONTEXTO = "banco_dados.txt"
+# Mudanças no arquivo da base entram sem reiniciar: no máximo a cada N segundos
+# um stat verifica se ele mudou e, se sim, uma nova versão é montada e trocada
+BASE_VERIFICAR_SEGUNDOS = float(os.environ.get('UNIHELP_BASE_VERIFICAR', 2.0))
 NOME_ARQUIVO_USUARIOS = "usuarios.txt"
 NOME_ARQUIVO_DADOS_ALUNOS = "dados_alunos.txt"
 NOME_ARQUIVO_HISTORICO = "historico_conversas.txt"
+NOME_ARQUIVO_ATUALIZACOES_ALUNOS = "dados_alunos_atualizacoes.log"
+NOME_ARQUIVO_CHAVE_SECRETA = ".chave_secreta"
+
+# Log de conversas: o arquivo de texto acima só é lido para a migração inicial
+NOME_DIRETORIO_HISTORICO = "historico_conversas"
+HISTORICO_SEGMENTO_MAX_BYTES = 16 * 1024 * 1024
+HISTORICO_COMPACTAR_APOS_SEGMENTOS = 8
+HISTORICO_MAX_POR_ALUNO = 1000
+# A migração do arquivo antigo anexa as conversas em lotes deste tamanho, para
+# que os segmentos sejam rotacionados normalmente
+HISTORICO_MIGRACAO_LOTE_BYTES = 1024 * 1024
+# Página /historico: conversas por página (as mais antigas vêm sob demanda) e
+# quantos alunos mantêm em memória o índice de busca do próprio histórico
+HISTORICO_PAGINA_TAMANHO = 10
+HISTORICO_BUSCA_MAX_ALUNOS = 256
+
+# Escritas nos arquivos de dados passam por um journal com group commit.
+# Fsync: "lote" (a cada lote), "intervalo" (no máximo a cada N segundos) ou "nunca"
+NOME_ARQUIVO_JOURNAL = "escritas.journal"
+ESCRITA_FSYNC = os.environ.get('UNIHELP_ESCRITA_FSYNC', 'lote')
+ESCRITA_FSYNC_INTERVALO_SEGUNDOS = float(os.environ.get('UNIHELP_ESCRITA_FSYNC_INTERVALO', 1.0))
+ESCRITA_JANELA_SEGUNDOS = float(os.environ.get('UNIHELP_ESCRITA_JANELA_MS', 0)) / 1000
+ESCRITA_LOTE_MAX = 256
+ESCRITA_JOURNAL_MAX_BYTES = 4 * 1024 * 1024
+
+# Onde ficam usuários, dados dos alunos e histórico: "texto" (arquivos acima)
+# ou "sqlite" (um banco único; importe os arquivos com importar_sqlite.py)
+ARMAZENAMENTO_BACKEND = os.environ.get('UNIHELP_ARMAZENAMENTO', 'texto')
+ARMAZENAMENTO_ARQUIVO_SQLITE = os.environ.get('UNIHELP_ARMAZENAMENTO_SQLITE', 'unihelp.db')
+ARMAZENAMENTO_POOL_CONEXOES = int(os.environ.get('UNIHELP_ARMAZENAMENTO_POOL', 8))
+
+# Importação em lote (CSV da secretaria): linhas aplicadas por vez e quantos
+# erros de validação entram no relatório (todos são contados)
+IMPORTACAO_LOTE_LINHAS = 500
+IMPORTACAO_MAX_ERROS_LISTADOS = 50
+
+# ============================================================================
+# CONFIGURAÇÕES DO ARMAZENAMENTO DE CONVERSAS
+# ============================================================================
+
+# "memoria" (LRU no próprio processo) ou "sqlite" (compartilhado entre workers)
+CONVERSAS_BACKEND = os.environ.get('UNIHELP_CONVERSAS_BACKEND', 'memoria')
+CONVERSAS_ARQUIVO_SQLITE = os.environ.get('UNIHELP_CONVERSAS_SQLITE', 'conversas.db')
+CONVERSAS_TTL_SEGUNDOS = int(os.environ.get('UNIHELP_CONVERSAS_TTL', 6 * 60 * 60))
+CONVERSAS_MAX_CONVERSAS = int(os.environ.get('UNIHELP_CONVERSAS_MAX', 2000))
+CONVERSAS_MAX_BYTES = int(os.environ.get('UNIHELP_CONVERSAS_MAX_MB', 256)) * 1024 * 1024
+
+
+def _carregar_chave_secreta():
+    """Usa uma chave fixa para que reinícios e workers diferentes aceitem o mesmo cookie"""
+    chave = os.environ.get('UNIHELP_SECRET_KEY')
+    if chave:
+        return chave
+
+    if os.path.exists(NOME_ARQUIVO_CHAVE_SECRETA):
+        with open(NOME_ARQUIVO_CHAVE_SECRETA, 'r', encoding='utf-8') as f:
+            chave = f.read().strip()
+        if chave:
+            return chave
+
+    chave = os.urandom(32).hex()
+    descritor = os.open(NOME_ARQUIVO_CHAVE_SECRETA, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(descritor, 'w', encoding='utf-8') as f:
+        f.write(chave)
+    return chave
+
+
+# ============================================================================
+# MÉTRICAS (PROMETHEUS) E LOGS ESTRUTURADOS
+# ============================================================================
+# As etapas do caminho quente (prompt, modelo, formatação, gravação, leituras
+# de arquivo) são cronometradas em histogramas expostos em /metrics no
+# formato texto do Prometheus. Os valores são por processo: com vários
+# workers, cada um responde pelo seu. Os eventos vão como JSON, uma linha por
+# evento, escritos por uma thread própria para não disputar o stdout com as
+# requisições.
+
+METRICAS_TOKEN = os.environ.get('UNIHELP_METRICAS_TOKEN')
+# Rotas /admin/*: desligadas (404) enquanto o token não for definido
+ADMIN_TOKEN = os.environ.get('UNIHELP_ADMIN_TOKEN')
+LOG_NIVEL = os.environ.get('UNIHELP_LOG_NIVEL', 'INFO').upper()
+
+BUCKETS_SEGUNDOS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+BUCKETS_TOKENS = (50, 100, 250, 500, 1000, 2500, 5000, 10000, 25000, 50000)
+
+
+class Metricas:
+    def __init__(self):
+        self._trava = threading.Lock()
+        # nome -> (tipo, ajuda, buckets)
+        self._definicoes = {}
+        # nome -> {rótulos (tupla ordenada): valor ou [contagens, soma, total]}
+        self._valores = {}
+        self._coletores = []
+
+    def contador(self, nome, ajuda):
+        self._definicoes[nome] = ('counter', ajuda, None)
+        self._valores.setdefault(nome, {})
+
+    def histograma(self, nome, ajuda, buckets=BUCKETS_SEGUNDOS):
+        self._definicoes[nome] = ('histogram', ajuda, tuple(buckets))
+        self._valores.setdefault(nome, {})
+
+    def registrar_coletor(self, funcao):
+        """`funcao()` retorna [(nome, tipo, ajuda, rótulos, valor), ...] lidos na hora da exportação"""
+        self._coletores.append(funcao)
+
+    def incrementar(self, nome, valor=1, **rotulos):
+        chave = tuple(sorted(rotulos.items()))
+        with self._trava:
+            serie = self._valores[nome]
+            serie[chave] = serie.get(chave, 0) + valor
+
+    def observar(self, nome, valor, **rotulos):
+        buckets = self._definicoes[nome][2]
+        chave = tuple(sorted(rotulos.items()))
+        with self._trava:
+            serie = self._valores[nome]
+            atual = serie.get(chave)
+            if atual is None:
+                atual = serie[chave] = [[0] * len(buckets), 0.0, 0]
+            for i, limite in enumerate(buckets):
+                if valor <= limite:
+                    atual[0][i] += 1
+            atual[1] += valor
+            atual[2] += 1
+
+    @staticmethod
+    def _rotulos(pares):
+        if not pares:
+            return ''
+        valores = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in pares)
+        return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(pares, valores)) + '}'
+
+    def exportar(self):
+        linhas = []
+        with self._trava:
+            for nome, (tipo, ajuda, buckets) in self._definicoes.items():
+                linhas.append(f"# HELP {nome} {ajuda}")
+                linhas.append(f"# TYPE {nome} {tipo}")
+                for chave, valor in self._valores[nome].items():
+                    if tipo == 'counter':
+                        linhas.append(f"{nome}{self._rotulos(chave)} {valor}")
+                        continue
+                    contagens, soma, total = valor
+                    for limite, contagem in zip(buckets, contagens):
+                        linhas.append(f"{nome}_bucket{self._rotulos(chave + (('le', limite),))} {contagem}")
+                    linhas.append(f"{nome}_bucket{self._rotulos(chave + (('le', '+Inf'),))} {total}")
+                    linhas.append(f"{nome}_sum{self._rotulos(chave)} {soma}")
+                    linhas.append(f"{nome}_count{self._rotulos(chave)} {total}")
+
+        # O formato exige as amostras de cada métrica juntas, logo abaixo do HELP/TYPE
+        familias = OrderedDict()
+        for coletor in self._coletores:
+            try:
+                amostras = coletor()
+            except Exception:
+                continue
+            for nome, tipo, ajuda, rotulos, valor in amostras:
+                familia = familias.setdefault(nome, [f"# HELP {nome} {ajuda}", f"# TYPE {nome} {tipo}"])
+                familia.append(f"{nome}{self._rotulos(tuple(sorted(rotulos.items())))} {valor}")
+        for familia in familias.values():
+            linhas.extend(familia)
+
+        return '\n'.join(linhas) + '\n'
+
+
+metricas = Metricas()
+metricas.contador('unihelp_requisicoes_total', "Requisições HTTP por rota e status")
+metricas.histograma('unihelp_requisicao_segundos', "Duração das requisições HTTP por rota (até o início da resposta)")
+metricas.histograma('unihelp_etapa_segundos', "Duração das etapas de um turno de chat")
+metricas.histograma('unihelp_leitura_arquivo_segundos', "Duração das leituras de arquivo de dados")
+metricas.histograma('unihelp_prompt_tokens_estimados', "Tamanho estimado das mensagens enviadas ao modelo",
+                    BUCKETS_TOKENS)
+metricas.histograma('unihelp_resposta_tokens_estimados', "Tamanho estimado das respostas do modelo", BUCKETS_TOKENS)
+metricas.contador('unihelp_prompt_caracteres_total', "Caracteres enviados ao modelo")
+metricas.contador('unihelp_resposta_caracteres_total', "Caracteres recebidos do modelo")
+metricas.contador('unihelp_modelo_erros_total', "Chamadas ao modelo que terminaram em erro, por tipo")
+metricas.contador('unihelp_respostas_diretas_total', "Perguntas respondidas pelas tabelas, sem o modelo, por intenção")
+metricas.contador('unihelp_historico_resumos_total', "Vezes em que turnos antigos da conversa viraram resumo")
+metricas.contador('unihelp_importacao_linhas_total', "Linhas das planilhas importadas em lote, por resultado")
+metricas.contador('unihelp_modelo_retentativas_total', "Novas tentativas após erros temporários do modelo")
+metricas.contador('unihelp_modelo_coalescidas_total',
+                  "Primeiras perguntas cacheáveis atendidas pela resposta de uma igual que estava em andamento")
+
+
+@contextmanager
+def medir_etapa(etapa):
+    """Cronometra uma etapa; dentro de uma requisição, o tempo também entra no log do turno"""
+    inicio = time.perf_counter()
+    try:
+        yield
+    finally:
+        registrar_etapa(etapa, time.perf_counter() - inicio)
+
+
+def registrar_etapa(etapa, duracao):
+    """Uma amostra da etapa, para quem mede o tempo por conta própria (ex.: somando pedaços)"""
+    metricas.observar('unihelp_etapa_segundos', duracao, etapa=etapa)
+    if has_app_context():
+        etapas = g.setdefault('etapas_ms', {})
+        etapas[etapa] = etapas.get(etapa, 0) + duracao * 1000
+
+
+@contextmanager
+def medir_leitura(arquivo):
+    inicio = time.perf_counter()
+    try:
+        yield
+    finally:
+        duracao = time.perf_counter() - inicio
+        metricas.observar('unihelp_leitura_arquivo_segundos', duracao, arquivo=arquivo)
+        if has_app_context():
+            etapas = g.setdefault('etapas_ms', {})
+            chave = f'leitura_{arquivo}'
+            etapas[chave] = etapas.get(chave, 0) + duracao * 1000
+
+
+class FormatadorJSON(logging.Formatter):
+    def format(self, registro):
+        evento = {
+            'ts': datetime.fromtimestamp(registro.created).isoformat(timespec='milliseconds'),
+            'nivel': registro.levelname.lower(),
+            'evento': registro.getMessage(),
+        }
+        evento.update(getattr(registro, 'campos', {}))
+        if registro.exc_info:
+            evento['excecao'] = self.formatException(registro.exc_info)
+        return json.dumps(evento, ensure_ascii=False, default=str)
+
+
+def _configurar_log():
+    """Logger 'unihelp' com uma thread própria escrevendo no stderr (chamado de novo depois de um fork)"""
+    saida = logging.StreamHandler(sys.stderr)
+    saida.setFormatter(FormatadorJSON())
+    fila = queue.SimpleQueue()
+    ouvinte = logging.handlers.QueueListener(fila, saida)
+    ouvinte.start()
+    atexit.register(ouvinte.stop)
+
+    log = logging.getLogger('unihelp')
+    log.setLevel(LOG_NIVEL)
+    for handler in list(log.handlers):
+        log.removeHandler(handler)
+    log.addHandler(logging.handlers.QueueHandler(fila))
+    log.propagate = False
+    return log
+
+
+log = _configurar_log()
+
+
+def registrar_evento(evento, nivel=logging.INFO, **campos):
+    """Uma linha JSON por evento: {"ts", "nivel", "evento", ...campos}"""
+    log.log(nivel, evento, extra={'campos': campos})
+
+
+# ============================================================================
+# ARMAZENAMENTO DE CONVERSAS NO SERVIDOR
+# ============================================================================
+# O cookie de sessão guarda apenas o id da conversa; o histórico de mensagens
+# (incluindo o prompt de sistema) fica em um destes armazenamentos.
+
+def _tamanho_historico(historico):
+    return sum(len(msg['content']) + len(msg.get('html', '')) + len(msg.get('resumo', '')) for msg in historico)
+
+
+class ArmazenamentoConversasMemoria:
+    """Conversas em memória com despejo LRU, expiração por TTL e limite de tamanho"""
+
+    def __init__(self, ttl_segundos, max_conversas, max_bytes):
+        self.ttl_segundos = ttl_segundos
+        self.max_conversas = max_conversas
+        self.max_bytes = max_bytes
+        self._conversas = OrderedDict()
+        self._bytes_total = 0
+        self._trava = threading.Lock()
+
+    def obter(self, id_conversa):
+        with self._trava:
+            item = self._conversas.get(id_conversa)
+            if item is None:
+                return None
+
+            historico, tamanho, atualizado_em = item
+            if time.time() - atualizado_em > self.ttl_segundos:
+                self._remover_item(id_conversa)
+                return None
+
+            self._conversas.move_to_end(id_conversa)
+            return list(historico)
+
+    def salvar(self, id_conversa, historico):
+        historico = list(historico)
+        tamanho = _tamanho_historico(historico)
+
+        with self._trava:
+            self._remover_item(id_conversa)
+            self._conversas[id_conversa] = (historico, tamanho, time.time())
+            self._bytes_total += tamanho
+            self._despejar()
+
+    def remover(self, id_conversa):
+        with self._trava:
+            self._remover_item(id_conversa)
+
+    def _remover_item(self, id_conversa):
+        item = self._conversas.pop(id_conversa, None)
+        if item is not None:
+            self._bytes_total -= item[1]
+
+    def _despejar(self):
+        agora = time.time()
+
+        # Conversas expiradas saem primeiro, a partir da menos usada
+        for id_conversa in list(self._conversas):
+            if agora - self._conversas[id_conversa][2] <= self.ttl_segundos:
+                break
+            self._remover_item(id_conversa)
+
+        while self._conversas and (len(self._conversas) > self.max_conversas or
+                                   self._bytes_total > self.max_bytes):
+            id_mais_antigo = next(iter(self._conversas))
+            self._remover_item(id_mais_antigo)
+
+
+class ArmazenamentoConversasSQLite:
+    """
+    Conversas em um arquivo SQLite, compartilhado entre workers e reinícios,
+    com os mesmos limites do armazenamento em memória (TTL, quantidade e bytes)
+    """
+
+    def __init__(self, caminho, ttl_segundos, max_conversas, max_bytes):
+        self.caminho = caminho
+        self.ttl_segundos = ttl_segundos
+        self.max_conversas = max_conversas
+        self.max_bytes = max_bytes
+        self._trava = threading.Lock()
+        self._conexao = sqlite3.connect(caminho, check_same_thread=False, timeout=10)
+        self._conexao.execute("PRAGMA journal_mode=WAL")
+        self._conexao.execute(
+            "CREATE TABLE IF NOT EXISTS conversas ("
+            "id TEXT PRIMARY KEY, historico TEXT NOT NULL, atualizado_em REAL NOT NULL, "
+            "tamanho INTEGER NOT NULL DEFAULT 0)"
+        )
+        colunas = [linha[1] for linha in self._conexao.execute("PRAGMA table_info(conversas)")]
+        if 'tamanho' not in colunas:
+            # Arquivo criado antes do limite de bytes: as conversas antigas contam como 0 até serem salvas de novo
+            self._conexao.execute("ALTER TABLE conversas ADD COLUMN tamanho INTEGER NOT NULL DEFAULT 0")
+        self._conexao.execute(
+            "CREATE INDEX IF NOT EXISTS idx_conversas_atualizado ON conversas (atualizado_em)"
+        )
+        self._conexao.commit()
+
+    def obter(self, id_conversa):
+        with self._trava:
+            linha = self._conexao.execute(
+                "SELECT historico, atualizado_em FROM conversas WHERE id = ?", (id_conversa,)
+            ).fetchone()
+
+            if linha is None:
+                return None
+
+            if time.time() - linha[1] > self.ttl_segundos:
+                self._conexao.execute("DELETE FROM conversas WHERE id = ?", (id_conversa,))
+                self._conexao.commit()
+                return None
+
+            return json.loads(linha[0])
+
+    def salvar(self, id_conversa, historico):
+        agora = time.time()
+
+        with self._trava:
+            self._conexao.execute(
+                "INSERT OR REPLACE INTO conversas (id, historico, atualizado_em, tamanho) VALUES (?, ?, ?, ?)",
+                (id_conversa, json.dumps(historico, ensure_ascii=False), agora, _tamanho_historico(historico))
+            )
+            self._conexao.execute(
+                "DELETE FROM conversas WHERE atualizado_em < ?", (agora - self.ttl_segundos,)
+            )
+            self._conexao.execute(
+                "DELETE FROM conversas WHERE id NOT IN "
+                "(SELECT id FROM conversas ORDER BY atualizado_em DESC LIMIT ?)",
+                (self.max_conversas,)
+            )
+            # Acima do limite de bytes, saem as menos recentes (até a própria, se sozinha passar do limite)
+            self._conexao.execute(
+                "DELETE FROM conversas WHERE id IN (SELECT id FROM ("
+                "SELECT id, SUM(tamanho) OVER (ORDER BY atualizado_em DESC, id) AS acumulado FROM conversas"
+                ") WHERE acumulado > ?)",
+                (self.max_bytes,)
+            )
+            self._conexao.commit()
+
+    def remover(self, id_conversa):
+        with self._trava:
+            self._conexao.execute("DELETE FROM conversas WHERE id = ?", (id_conversa,))
+            self._conexao.commit()
+
+    def reabrir(self):
+        """Conexão nova depois de um fork: a herdada do processo mestre não pode ser usada"""
+        with self._trava:
+            self._conexao = sqlite3.connect(self.caminho, check_same_thread=False, timeout=10)
+            self._conexao.execute("PRAGMA journal_mode=WAL")
+
+
+def criar_armazenamento_conversas(backend=CONVERSAS_BACKEND):
+    if backend == 'sqlite':
+        return ArmazenamentoConversasSQLite(CONVERSAS_ARQUIVO_SQLITE, CONVERSAS_TTL_SEGUNDOS,
+                                            CONVERSAS_MAX_CONVERSAS, CONVERSAS_MAX_BYTES)
+    if backend == 'memoria':
+        return ArmazenamentoConversasMemoria(CONVERSAS_TTL_SEGUNDOS, CONVERSAS_MAX_CONVERSAS,
+                                             CONVERSAS_MAX_BYTES)
+    raise ValueError(f"Backend de conversas desconhecido: {backend}")
+
+
+_armazenamento_conversas = {'atual': None}
+_trava_armazenamento_conversas = threading.Lock()
+
+
+def armazenamento_conversas():
+    """O armazenamento das conversas em andamento, criado na primeira necessidade"""
+    armazenamento = _armazenamento_conversas['atual']
+    if armazenamento is None:
+        with _trava_armazenamento_conversas:
+            if _armazenamento_conversas['atual'] is None:
+                _armazenamento_conversas['atual'] = criar_armazenamento_conversas()
+            armazenamento = _armazenamento_conversas['atual']
+    return armazenamento
+
+
+# ============================================================================
+# ESCRITA NOS ARQUIVOS DE DADOS (JOURNAL + GROUP COMMIT)
+# ============================================================================
+# Todas as gravações em usuários, dados dos alunos e log de conversas passam
+# por aqui. Pedidos de requisições simultâneas entram em uma fila; quem pega a
+# vez grava a fila inteira como um lote: primeiro no journal (com fsync
+# conforme a política), depois um único append por arquivo. Uma trava de
+# arquivo (flock) no journal serializa os lotes entre workers. Se o processo
+# cair no meio, os lotes confirmados no journal são reaplicados na próxima
+# inicialização; o journal é zerado em checkpoints.
+
+class EscritorArquivos:
+    def __init__(self, caminho_journal, politica_fsync='lote', intervalo_fsync=1.0,
+                 janela_segundos=0, lote_max=256, journal_max_bytes=4 * 1024 * 1024):
+        if politica_fsync not in ('lote', 'intervalo', 'nunca'):
+            raise ValueError(f"Política de fsync desconhecida: {politica_fsync}")
+
+        self.caminho_journal = caminho_journal
+        self.politica_fsync = politica_fsync
+        self.intervalo_fsync = intervalo_fsync
+        self.janela_segundos = janela_segundos
+        self.lote_max = lote_max
+        self.journal_max_bytes = journal_max_bytes
+        self._fila = []
+        self._trava_fila = threading.Lock()
+        self._trava_lote = threading.Lock()
+        self._cabecalhos = {}
+        self._ultimo_fsync = 0
+        self._lotes = 0
+        self._registros = 0
+        self._fsyncs = 0
+
+        self._journal = open(caminho_journal, 'a+b')
+        with self._trava_lote, self._trava_arquivo():
+            self._recuperar()
+
+    @contextmanager
+    def _trava_arquivo(self):
+        if fcntl is None:
+            yield
+            return
+        fcntl.flock(self._journal.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(self._journal.fileno(), fcntl.LOCK_UN)
+
+    def registrar_cabecalho(self, caminho, cabecalho):
+        """Texto gravado antes do primeiro registro quando o arquivo ainda não existe"""
+        self._cabecalhos[caminho] = cabecalho.encode('utf-8')
+
+    # ---- Escrita ----------------------------------------------------------
+
+    def escrever(self, caminho, dados):
+        """
+        Anexa `dados` ao arquivo e só retorna depois que o lote foi gravado.
+        `dados` pode ser bytes ou uma função sem argumentos chamada já sob a
+        trava de arquivo, que retorna os bytes ou None para desistir (útil
+        para conferir duplicidade sem corrida). Retorna True se gravou.
+        """
+        pedido = {'caminho': caminho, 'dados': dados, 'feito': False, 'gravado': False, 'erro': None}
+        with self._trava_fila:
+            self._fila.append(pedido)
+
+        while not pedido['feito']:
+            with self._trava_lote:
+                if not pedido['feito']:
+                    if self.janela_segundos:
+                        time.sleep(self.janela_segundos)
+                    self._gravar_lote()
+
+        if pedido['erro'] is not None:
+            raise pedido['erro']
+        return pedido['gravado']
+
+    def _gravar_lote(self):
+        with self._trava_fila:
+            lote, self._fila = self._fila[:self.lote_max], self._fila[self.lote_max:]
+        if not lote:
+            return
+
+        try:
+            with self._trava_arquivo():
+                por_arquivo = {}
+                for pedido in lote:
+                    dados = pedido['dados']
+                    if callable(dados):
+                        try:
+                            dados = dados()
+                        except Exception as e:
+                            pedido['erro'] = e
+                            continue
+                    if dados:
+                        por_arquivo.setdefault(pedido['caminho'], []).append(dados)
+                        pedido['gravado'] = True
+
+                entradas = []
+                for caminho, partes in por_arquivo.items():
+                    offset = os.path.getsize(caminho) if os.path.exists(caminho) else 0
+                    if offset == 0 and caminho in self._cabecalhos:
+                        partes.insert(0, self._cabecalhos[caminho])
+                    entradas.append((caminho, offset, b''.join(partes)))
+
+                if entradas:
+                    self._anotar_no_journal(entradas)
+                    for caminho, _, dados in entradas:
+                        with open(caminho, 'ab') as f:
+                            f.write(dados)
+                    self._lotes += 1
+                    self._registros += sum(len(p) for p in por_arquivo.values())
+
+                    if self._journal_tamanho() > self.journal_max_bytes:
+                        self._checkpoint()
+
+        except Exception as e:
+            for pedido in lote:
+                if pedido['erro'] is None and pedido['gravado']:
+                    pedido['erro'] = e
+                    pedido['gravado'] = False
+        finally:
+            for pedido in lote:
+                pedido['feito'] = True
+
+    def _anotar_no_journal(self, entradas):
+        linhas = [json.dumps({'caminho': c, 'offset': o, 'dados': d.decode('utf-8')}, ensure_ascii=False)
+                  for c, o, d in entradas]
+        linhas.append(json.dumps({'commit': len(entradas)}))
+        self._journal.write(('\n'.join(linhas) + '\n').encode('utf-8'))
+        self._journal.flush()
+
+        agora = time.time()
+        if self.politica_fsync == 'lote' or (
+                self.politica_fsync == 'intervalo' and agora - self._ultimo_fsync >= self.intervalo_fsync):
+            os.fsync(self._journal.fileno())
+            self._ultimo_fsync = agora
+            self._fsyncs += 1
+
+    def _journal_tamanho(self):
+        return os.fstat(self._journal.fileno()).st_size
+
+    # ---- Checkpoint e recuperação -----------------------------------------
+
+    def _ler_journal(self):
+        """Lotes completos (com a linha de commit) do journal, em ordem"""
+        self._journal.seek(0)
+        lotes, atual = [], []
+        for linha in self._journal:
+            if not linha.endswith(b'\n'):
+                break  # lote interrompido no meio: os arquivos ainda não foram tocados
+            try:
+                registro = json.loads(linha)
+            except ValueError:
+                break
+            if 'commit' in registro:
+                lotes.append(atual)
+                atual = []
+            else:
+                atual.append(registro)
+        return lotes
+
+    def _checkpoint(self):
+        """Garante no disco os arquivos citados no journal e zera o journal"""
+        if self.politica_fsync != 'nunca':
+            for caminho in {e['caminho'] for lote in self._ler_journal() for e in lote}:
+                if os.path.exists(caminho):
+                    with open(caminho, 'ab') as f:
+                        os.fsync(f.fileno())
+        self._journal.truncate(0)
+        self._journal.flush()
+        if self.politica_fsync != 'nunca':
+            os.fsync(self._journal.fileno())
+
+    def _recuperar(self):
+        """Reaplica lotes confirmados que não chegaram inteiros aos arquivos"""
+        reaplicados = 0
+        for lote in self._ler_journal():
+            for entrada in lote:
+                dados = entrada['dados'].encode('utf-8')
+                caminho, offset = entrada['caminho'], entrada['offset']
+                tamanho = os.path.getsize(caminho) if os.path.exists(caminho) else 0
+                if tamanho < offset:
+                    registrar_evento('journal_entrada_ignorada', logging.WARNING, arquivo=caminho,
+                                     motivo='arquivo menor que o esperado', offset=offset, tamanho=tamanho)
+                    continue
+
+                with open(caminho, 'rb') as f:
+                    f.seek(offset)
+                    existente = f.read(len(dados))
+
+                if existente == dados:
+                    continue
+                if tamanho == offset + len(existente) and dados.startswith(existente):
+                    with open(caminho, 'ab') as f:
+                        f.write(dados[len(existente):])
+                    reaplicados += 1
+                else:
+                    registrar_evento('journal_entrada_ignorada', logging.WARNING, arquivo=caminho,
+                                     motivo='arquivo alterado depois do lote', offset=offset)
+
+        if reaplicados:
+            registrar_evento('journal_recuperado', logging.WARNING, reaplicados=reaplicados)
+        self._checkpoint()
+
+    # ---- Operações exclusivas ---------------------------------------------
+
+    @contextmanager
+    def exclusivo(self):
+        """
+        Bloqueia todas as escritas (de todos os workers) para reescrever
+        arquivos inteiros. Não chame escrever() dentro do bloco.
+        """
+        with self._trava_lote, self._trava_arquivo():
+            self._checkpoint()
+            yield
+
+    def reabrir(self):
+        """
+        Depois de um fork: o flock vale por descritor aberto, então um journal
+        herdado do mestre seria a mesma trava em todos os workers.
+        """
+        self._journal = open(self.caminho_journal, 'a+b')
+
+    def fechar(self):
+        with self._trava_lote, self._trava_arquivo():
+            self._checkpoint()
+
+    def estatisticas(self):
+        with self._trava_lote:
+            return {
+                'lotes': self._lotes,
+                'registros': self._registros,
+                'registros_por_lote': self._registros / self._lotes if self._lotes else 0.0,
+                'fsyncs': self._fsyncs
+            }
+
+
+_escritor_arquivos = {'atual': None}
+_trava_escritor_arquivos = threading.Lock()
+
+
+def escritor_arquivos():
+    """O journal de escrita, aberto (e recuperado) na primeira necessidade dos repositórios de texto"""
+    escritor = _escritor_arquivos['atual']
+    if escritor is None:
+        with _trava_escritor_arquivos:
+            if _escritor_arquivos['atual'] is None:
+                escritor = EscritorArquivos(NOME_ARQUIVO_JOURNAL, ESCRITA_FSYNC, ESCRITA_FSYNC_INTERVALO_SEGUNDOS,
+                                            ESCRITA_JANELA_SEGUNDOS, ESCRITA_LOTE_MAX, ESCRITA_JOURNAL_MAX_BYTES)
+                atexit.register(escritor.fechar)
+                _escritor_arquivos['atual'] = escritor
+            escritor = _escritor_arquivos['atual']
+    return escritor
+
+
+# ============================================================================
+# LOG DE CONVERSAS (SEGMENTOS APPEND-ONLY COM ÍNDICE POR RA)
+# ============================================================================
+# Cada conversa é uma linha JSON anexada ao segmento ativo. Um índice em
+# memória guarda, por RA, a posição (segmento, offset, tamanho) de cada
+# registro, então as últimas N conversas de um aluno são lidas com seek
+# direto, sem percorrer o tráfego dos outros alunos. O índice é salvo em
+# disco e, na inicialização, só o final dos segmentos precisa ser relido.
+
+class LogConversas:
+    PREFIXO_SEGMENTO = 'segmento_'
+    SUFIXO_SEGMENTO = '.log'
+    NOME_INDICE = 'indice.json'
+
+    def __init__(self, diretorio, segmento_max_bytes, compactar_apos_segmentos, max_por_aluno, escritor):
+        self.diretorio = diretorio
+        self.escritor = escritor
+        self.segmento_max_bytes = segmento_max_bytes
+        self.compactar_apos_segmentos = compactar_apos_segmentos
+        self.max_por_aluno = max_por_aluno
+        self._trava = threading.RLock()
+        # nome do segmento -> {'tamanho', 'inode', 'registros': [[ra, offset, tamanho], ...]}
+        self._segmentos = {}
+        # ra -> [(nome do segmento, offset, tamanho), ...] em ordem cronológica
+        self._indice_ra = {}
+        self._geracao = 0
+
+        os.makedirs(diretorio, exist_ok=True)
+        self._carregar_indice()
+        self._reconstruir_indice_ra()
+        self._sincronizar()
+
+    # ---- Índice -----------------------------------------------------------
+
+    def _caminho(self, nome):
+        return os.path.join(self.diretorio, nome)
+
+    def _listar_segmentos(self):
+        return sorted(n for n in os.listdir(self.diretorio)
+                      if n.startswith(self.PREFIXO_SEGMENTO) and n.endswith(self.SUFIXO_SEGMENTO))
+
+    def _carregar_indice(self):
+        try:
+            with open(self._caminho(self.NOME_INDICE), 'r', encoding='utf-8') as f:
+                self._segmentos = json.load(f).get('segmentos', {})
+        except (FileNotFoundError, ValueError):
+            self._segmentos = {}
+
+    def salvar_indice(self):
+        with self._trava:
+            caminho = self._caminho(self.NOME_INDICE)
+            temporario = caminho + '.tmp'
+            with open(temporario, 'w', encoding='utf-8') as f:
+                json.dump({'versao': 1, 'segmentos': self._segmentos}, f)
+            os.replace(temporario, caminho)
+
+    def _reconstruir_indice_ra(self):
+        indice = {}
+        for nome in sorted(self._segmentos):
+            for ra, offset, tamanho in self._segmentos[nome]['registros']:
+                indice.setdefault(ra, []).append((nome, offset, tamanho))
+        self._indice_ra = indice
+        self._geracao += 1
+
+    def _escanear(self, nome, inicio):
+        """Lê as linhas completas do segmento a partir de `inicio`"""
+        registros = []
+        offset = inicio
+
+        with open(self._caminho(nome), 'rb') as f:
+            f.seek(inicio)
+            for linha in f:
+                if not linha.endswith(b'\n'):
+                    break  # registro ainda sendo escrito por outro processo
+                try:
+                    ra = json.loads(linha)['ra']
+                    registros.append([ra, offset, len(linha)])
+                except (ValueError, KeyError):
+                    pass
+                offset += len(linha)
+
+        return registros, offset
+
+    def _sincronizar(self):
+        """Atualiza o índice com o que foi escrito (inclusive por outros workers)"""
+        nomes = self._listar_segmentos()
+        mudou_estrutura = False
+
+        for nome in list(self._segmentos):
+            if nome not in nomes:
+                del self._segmentos[nome]
+                mudou_estrutura = True
+
+        for nome in nomes:
+            info = os.stat(self._caminho(nome))
+            atual = self._segmentos.get(nome)
+
+            if atual is None or atual['inode'] != info.st_ino or atual['tamanho'] > info.st_size:
+                registros, fim = self._escanear(nome, 0)
+                self._segmentos[nome] = {'tamanho': fim, 'inode': info.st_ino, 'registros': registros}
+                mudou_estrutura = True
+
+            elif atual['tamanho'] < info.st_size:
+                registros, fim = self._escanear(nome, atual['tamanho'])
+                atual['tamanho'] = fim
+                atual['registros'].extend(registros)
+                if not mudou_estrutura:
+                    for ra, offset, tamanho in registros:
+                        self._indice_ra.setdefault(ra, []).append((nome, offset, tamanho))
+
+        if mudou_estrutura:
+            self._reconstruir_indice_ra()
+
+    # ---- Escrita ----------------------------------------------------------
+
+    def _segmento_ativo(self):
+        nomes = self._listar_segmentos()
+        if nomes and self._segmentos.get(nomes[-1], {}).get('tamanho', 0) < self.segmento_max_bytes:
+            return nomes[-1], False
+
+        numero = int(nomes[-1][len(self.PREFIXO_SEGMENTO):-len(self.SUFIXO_SEGMENTO)]) + 1 if nomes else 1
+        return f"{self.PREFIXO_SEGMENTO}{numero:06d}{self.SUFIXO_SEGMENTO}", bool(nomes)
+
+    def anexar(self, registros):
+        """Anexa uma lista de registros (dicts com 'ra') em uma única escrita"""
+        dados = b''.join(json.dumps(r, ensure_ascii=False).encode('utf-8') + b'\n' for r in registros)
+
+        with self._trava:
+            self._sincronizar()
+            nome, rotacionou = self._segmento_ativo()
+
+        # Fora da trava do log, para que conversas simultâneas entrem no mesmo lote
+        self.escritor.escrever(self._caminho(nome), dados)
+
+        with self._trava:
+            self._sincronizar()
+            fechados = len(self._listar_segmentos()) - 1
+
+        if rotacionou:
+            if fechados >= self.compactar_apos_segmentos:
+                self.compactar()
+            self.salvar_indice()
+
+    def compactar(self):
+        """Reescreve os segmentos fechados mantendo só as últimas conversas de cada aluno"""
+        with self.escritor.exclusivo(), self._trava:
+            self._sincronizar()
+            nomes = self._listar_segmentos()
+            fechados = nomes[:-1]
+            if not fechados:
+                return 0
+
+            manter = set()
+            for entradas in self._indice_ra.values():
+                for nome, offset, _ in entradas[-self.max_por_aluno:]:
+                    manter.add((nome, offset))
+
+            destino = self._caminho(fechados[0])
+            temporario = destino + '.tmp'
+            removidos = 0
+
+            with open(temporario, 'wb') as saida:
+                for nome in fechados:
+                    offset = 0
+                    with open(self._caminho(nome), 'rb') as entrada:
+                        for linha in entrada:
+                            if (nome, offset) in manter:
+                                saida.write(linha)
+                            else:
+                                removidos += 1
+                            offset += len(linha)
+                saida.flush()
+                os.fsync(saida.fileno())
+
+            os.replace(temporario, destino)
+            for nome in fechados[1:]:
+                os.remove(self._caminho(nome))
+
+            self._sincronizar()
+            self.salvar_indice()
+            return removidos
+
+    # ---- Leitura ----------------------------------------------------------
+
+    def _ler_entradas(self, entradas):
+        registros = []
+        arquivos = {}
+        try:
+            with medir_leitura('historico'):
+                for nome, offset, tamanho in entradas:
+                    if nome not in arquivos:
+                        arquivos[nome] = open(self._caminho(nome), 'rb')
+                    f = arquivos[nome]
+                    f.seek(offset)
+                    registros.append(json.loads(f.read(tamanho)))
+        finally:
+            for f in arquivos.values():
+                f.close()
+
+        return registros
+
+    # ---- Paginação --------------------------------------------------------
+    # O cursor de um registro é "segmento:offset". Os segmentos são numerados
+    # em ordem, então os cursores de um aluno crescem com o tempo. A compactação
+    # reescreve os segmentos fechados e invalida os cursores antigos; geracao()
+    # muda quando isso acontece.
+
+    @staticmethod
+    def _posicao(cursor):
+        nome, _, offset = cursor.rpartition(':')
+        if not nome.startswith(LogConversas.PREFIXO_SEGMENTO):
+            raise ValueError(f"Cursor inválido: {cursor!r}")
+        return nome, int(offset)
+
+    def _ler_com_cursor(self, entradas):
+        registros = self._ler_entradas(entradas)
+        for (nome, offset, _), registro in zip(entradas, registros):
+            registro['cursor'] = f"{nome}:{offset}"
+        return registros
+
+    def pagina(self, ra, limite, antes=None):
+        """
+        Até `limite` registros do aluno anteriores ao cursor `antes` (do mais
+        antigo ao mais novo) e o cursor da página seguinte, ou None se acabou
+        """
+        with self._trava:
+            self._sincronizar()
+            entradas = self._indice_ra.get(ra, [])
+            fim = len(entradas) if antes is None else bisect.bisect_left(entradas, self._posicao(antes))
+            inicio = max(0, fim - limite)
+            selecionadas = entradas[inicio:fim]
+
+        registros = self._ler_com_cursor(selecionadas)
+        return registros, (registros[0]['cursor'] if registros and inicio > 0 else None)
+
+    def registros_apos(self, ra, depois=None):
+        """Registros do aluno posteriores ao cursor `depois` (todos se None), do mais antigo ao mais novo"""
+        with self._trava:
+            self._sincronizar()
+            entradas = self._indice_ra.get(ra, [])
+            if depois is not None:
+                nome, offset = self._posicao(depois)
+                entradas = entradas[bisect.bisect_left(entradas, (nome, offset + 1)):]
+            entradas = list(entradas)
+
+        return self._ler_com_cursor(entradas)
+
+    def ler(self, ra, cursores):
+        """Registros do aluno com os cursores dados, na mesma ordem (os que não existem mais ficam de fora)"""
+        with self._trava:
+            self._sincronizar()
+            todas = self._indice_ra.get(ra, [])
+            entradas = []
+            for cursor in cursores:
+                posicao = self._posicao(cursor)
+                i = bisect.bisect_left(todas, posicao)
+                if i < len(todas) and todas[i][:2] == posicao:
+                    entradas.append(todas[i])
+
+        return self._ler_com_cursor(entradas)
+
+    def geracao(self):
+        with self._trava:
+            self._sincronizar()
+            return self._geracao
+
+    def total_registros(self):
+        with self._trava:
+            return sum(len(s['registros']) for s in self._segmentos.values())
+
+    def todos(self):
+        """Percorre todos os registros, segmento a segmento, em ordem cronológica"""
+        with self._trava:
+            self._sincronizar()
+            segmentos = [(nome, self._segmentos[nome]['tamanho']) for nome in sorted(self._segmentos)]
+
+        for nome, tamanho in segmentos:
+            with open(self._caminho(nome), 'rb') as f:
+                for linha in f.read(tamanho).splitlines():
+                    try:
+                        yield json.loads(linha)
+                    except ValueError:
+                        continue
+
+    # ---- Migração ---------------------------------------------------------
+
+    def migrar_texto(self, caminho):
+        """Importa o histórico no formato antigo ([RA:x|DATA:y] ... [FIM_CONVERSA])"""
+        total = 0
+        for lote in _em_lotes(_ler_historico_texto(caminho), HISTORICO_MIGRACAO_LOTE_BYTES):
+            self.anexar(lote)
+            total += len(lote)
+        if total:
+            self.salvar_indice()
+        return total
+
+
+def _analisar_bloco_historico(bloco):
+    linhas = bloco.strip().split('\n')
+    linhas = [l for l in linhas if not l.startswith('#') and l.strip()]
+    if len(linhas) < 3 or not linhas[0].startswith('[RA:'):
+        return None
+
+    cabecalho = linhas[0]
+    ra = cabecalho[len('[RA:'):].split('|')[0]
+    data = cabecalho.split('DATA:')[1].strip(']') if 'DATA:' in cabecalho else 'N/A'
+
+    pergunta = linhas[1].replace('PERGUNTA: ', '').strip()
+    resposta = '\n'.join([l.replace('RESPOSTA: ', '', 1) if l.startswith('RESPOSTA:') else l
+                          for l in linhas[2:] if not l.startswith('[')]).strip()
+
+    return {'ra': ra, 'data': data, 'pergunta': pergunta, 'resposta': resposta}
+
+
+def _ler_historico_texto(caminho):
+    """Percorre o arquivo antigo linha a linha, uma conversa por vez"""
+    bloco = []
+    with open(caminho, 'r', encoding='utf-8') as f:
+        for linha in f:
+            while '[FIM_CONVERSA]' in linha:
+                final, linha = linha.split('[FIM_CONVERSA]', 1)
+                bloco.append(final)
+                registro = _analisar_bloco_historico(''.join(bloco))
+                bloco = []
+                if registro:
+                    yield registro
+            bloco.append(linha)
+
+    registro = _analisar_bloco_historico(''.join(bloco))
+    if registro:
+        yield registro
+
+
+def _em_lotes(registros, max_bytes):
+    """Agrupa os registros em listas de até ~max_bytes (tamanho estimado pelo texto)"""
+    lote, tamanho = [], 0
+    for registro in registros:
+        lote.append(registro)
+        tamanho += sum(len(valor) for valor in registro.values())
+        if tamanho >= max_bytes:
+            yield lote
+            lote, tamanho = [], 0
+    if lote:
+        yield lote
 
 
 # ============================================================================
@@ -37,132 +1133,1024 @@ NOME_ARQUIVO_HISTORICO = "historico_conversas.txt"
 def salvar_conversa(ra, pergunta, resposta):
     """Salva uma conversa no histórico do aluno"""
     try:
-        if not os.path.exists(NOME_ARQUIVO_HISTORICO):
-            with open(NOME_ARQUIVO_HISTORICO, 'w', encoding='utf-8') as f:
-                f.write("# ============================================\n")
-                f.write("# HISTÓRICO DE CONVERSAS - UNIHELP\n")
-                f.write("# ============================================\n\n")
+        timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        with medir_etapa('salvar_conversa'):
+            log_conversas().anexar([{'ra': ra, 'data': timestamp, 'pergunta': pergunta, 'resposta': resposta}])
 
-        with open(NOME_ARQUIVO_HISTORICO, 'a', encoding='utf-8') as f:
-            timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-            f.write(f"[RA:{ra}|DATA:{timestamp}]\n")
-            f.write(f"PERGUNTA: {pergunta}\n")
-            f.write(f"RESPOSTA: {resposta}\n")
-            f.write("[FIM_CONVERSA]\n\n")
+    except Exception as e:
+        registrar_evento('erro_salvar_conversa', logging.ERROR, ra=ra, erro=str(e))
 
-        print(f"✅ Conversa salva no histórico (RA: {ra})")
 
-    except Exception as e:
-        print(f"❌ ERRO ao salvar conversa: {e}")
+def pagina_historico(ra, antes=None, busca=''):
+    """
+    Uma página do histórico do aluno (mais recentes primeiro) e o cursor da
+    próxima, ou None se acabou. Com `busca`, só as conversas que contêm todos
+    os termos. Cursor inválido levanta ValueError.
+    """
+    if busca.strip():
+        registros, proximo = indice_busca_historico().buscar(ra, busca, HISTORICO_PAGINA_TAMANHO, antes)
+    else:
+        registros, proximo = log_conversas().pagina(ra, HISTORICO_PAGINA_TAMANHO, antes)
+        registros = registros[::-1]
 
+    conversas = [{'data': r['data'], 'pergunta': r['pergunta'], 'resposta': r['resposta']} for r in registros]
+    return conversas, proximo
 
-def carregar_historico_aluno(ra, limite=20):
-    """Carrega as últimas conversas do aluno"""
-    try:
-        if not os.path.exists(NOME_ARQUIVO_HISTORICO):
-            return []
 
-        with open(NOME_ARQUIVO_HISTORICO, 'r', encoding='utf-8') as f:
-            conteudo = f.read()
+# ============================================================================
+# BUSCA NO HISTÓRICO DO ALUNO (ÍNDICE INVERTIDO POR RA)
+# ============================================================================
+# O índice (termo -> conversas) de um aluno é montado na primeira busca, com
+# uma leitura só das conversas dele, e nas seguintes recebe apenas as
+# conversas novas. Os alunos que buscaram por último ficam em memória (LRU).
+
+def _texto_para_busca(registro):
+    resposta = html.unescape(re.sub(r'<[^>]+>', ' ', registro['resposta']))
+    return f"{registro['pergunta']} {resposta}"
+
+
+class IndiceBuscaHistorico:
+    def __init__(self, historico, max_alunos):
+        self.historico = historico
+        self.max_alunos = max_alunos
+        # ra -> {'geracao', 'cursores': [...], 'posicoes': {cursor: i}, 'termos': {termo: [i, ...]}}
+        self._alunos = OrderedDict()
+        self._trava = threading.Lock()
+
+    def _atualizado(self, ra):
+        geracao = self.historico.geracao()
+        item = self._alunos.get(ra)
+        if item is None or item['geracao'] != geracao:
+            item = {'geracao': geracao, 'cursores': [], 'posicoes': {}, 'termos': {}}
+
+        ultimo = item['cursores'][-1] if item['cursores'] else None
+        for registro in self.historico.registros_apos(ra, ultimo):
+            posicao = len(item['cursores'])
+            item['cursores'].append(registro['cursor'])
+            item['posicoes'][registro['cursor']] = posicao
+            for termo in set(tokenizar(_texto_para_busca(registro))):
+                item['termos'].setdefault(termo, []).append(posicao)
+
+        self._alunos[ra] = item
+        self._alunos.move_to_end(ra)
+        while len(self._alunos) > self.max_alunos:
+            self._alunos.popitem(last=False)
+        return item
+
+    def buscar(self, ra, consulta, limite, antes=None):
+        """Conversas do aluno com todos os termos da consulta (mais recentes primeiro) e o cursor da próxima página"""
+        termos = set(tokenizar(consulta))
+        if not termos:
+            return [], None
+
+        with self._trava:
+            item = self._atualizado(ra)
+            fim = len(item['cursores'])
+            if antes is not None:
+                if antes not in item['posicoes']:
+                    raise ValueError(f"Cursor inválido: {antes!r}")
+                fim = item['posicoes'][antes]
+
+            listas = sorted((item['termos'].get(termo, []) for termo in termos), key=len)
+            comuns = set(listas[0]).intersection(*listas[1:])
+            encontradas = sorted((p for p in comuns if p < fim), reverse=True)
+            cursores = [item['cursores'][p] for p in encontradas[:limite + 1]]
+
+        registros = self.historico.ler(ra, cursores[:limite])
+        return registros, (cursores[limite - 1] if len(cursores) > limite else None)
 
-        conversas = []
-        blocos = conteudo.split('[FIM_CONVERSA]')
 
-        for bloco in blocos:
-            if f"[RA:{ra}|" in bloco:
-                linhas = bloco.strip().split('\n')
-                if len(linhas) >= 3:
-                    cabecalho = linhas[0]
-                    data = cabecalho.split('DATA:')[1].strip(']') if 'DATA:' in cabecalho else 'N/A'
+# ============================================================================
+# REPOSITÓRIO DE USUÁRIOS (ÍNDICES EM MEMÓRIA)
+# ============================================================================
+# O arquivo de usuários é lido uma vez para dicionários indexados por RA,
+# e-mail e CPF. Antes de cada consulta o tamanho/mtime do arquivo é conferido:
+# se cresceu, só as linhas novas são lidas; se foi reescrito, recarrega tudo.
+
+def _normalizar_email(email):
+    return email.strip().lower()
+
+
+def _normalizar_cpf(cpf):
+    return ''.join(c for c in cpf if c.isdigit())
+
+
+class RepositorioUsuarios:
+    CABECALHO = ("# ============================================\n"
+                 "# BANCO DE DADOS DE USUÁRIOS - UNIHELP\n"
+                 "# ============================================\n"
+                 "# Estrutura: RA|NOME|EMAIL|CPF|CURSO|SENHA_HASH|DATA_CADASTRO\n"
+                 "# " + "=" * 80 + "\n\n")
+
+    def __init__(self, caminho, escritor):
+        self.caminho = caminho
+        self.escritor = escritor
+        self.escritor.registrar_cabecalho(caminho, self.CABECALHO)
+        self._trava = threading.RLock()
+        self._reservados = set()  # RAs aceitos no lote que ainda está sendo gravado
+        self._por_ra = {}
+        self._por_email = {}
+        self._por_cpf = {}
+        self._tamanho = 0
+        self._mtime = None
+        self._inode = None
+        self._geracao = 0  # incrementada a cada recarga completa
+
+    def _indexar_linha(self, linha):
+        linha = linha.strip()
+        if linha.startswith('#') or not linha:
+            return
 
-                    pergunta = linhas[1].replace('PERGUNTA: ', '').strip()
-                    resposta = '\n'.join([l.replace('RESPOSTA: ', '', 1) if l.startswith('RESPOSTA:') else l
-                                          for l in linhas[2:] if l.strip() and not l.startswith('[')]).strip()
+        partes = linha.split('|')
+        if len(partes) < 6:
+            return
 
-                    conversas.append({
-                        'data': data,
-                        'pergunta': pergunta,
-                        'resposta': resposta
-                    })
+        usuario = {
+            'ra': partes[0],
+            'nome': partes[1],
+            'email': partes[2],
+            'cpf': partes[3],
+            'curso': partes[4],
+            'senha_hash': partes[5],
+            'data_cadastro': partes[6] if len(partes) > 6 else 'N/A'
+        }
 
-        return conversas[-limite:][::-1]
+        # Mantém o primeiro cadastro de cada RA, como a busca linear fazia
+        if usuario['ra'] in self._por_ra:
+            return
 
-    except Exception as e:
-        print(f"❌ ERRO ao carregar histórico: {e}")
-        return []
+        self._por_ra[usuario['ra']] = usuario
+        self._por_email.setdefault(_normalizar_email(usuario['email']), usuario)
+        self._por_cpf.setdefault(_normalizar_cpf(usuario['cpf']), usuario)
+
+    def _ler_a_partir_de(self, inicio):
+        with medir_leitura('usuarios'), open(self.caminho, 'rb') as f:
+            f.seek(inicio)
+            dados = f.read()
+
+        # O offset só avança até a última linha completa; uma linha final sem
+        # quebra é indexada agora e relida depois (RAs repetidos são ignorados)
+        fim = dados.rfind(b'\n') + 1
+        for linha in dados.decode('utf-8', errors='replace').split('\n'):
+            self._indexar_linha(linha)
+        return inicio + fim
+
+    def _atualizar(self):
+        try:
+            info = os.stat(self.caminho)
+        except FileNotFoundError:
+            self._por_ra, self._por_email, self._por_cpf = {}, {}, {}
+            self._tamanho, self._mtime, self._inode = 0, None, None
+            return
+
+        if info.st_ino == self._inode and info.st_mtime_ns == self._mtime and info.st_size == self._tamanho:
+            return
+
+        if info.st_ino != self._inode or info.st_size < self._tamanho:
+            self._por_ra, self._por_email, self._por_cpf = {}, {}, {}
+            self._tamanho = 0
+            self._geracao += 1
+
+        self._tamanho = self._ler_a_partir_de(self._tamanho)
+        self._mtime = info.st_mtime_ns
+        self._inode = info.st_ino
+
+    def _copia(self, usuario):
+        return dict(usuario) if usuario else None
+
+    def buscar_por_ra(self, ra):
+        with self._trava:
+            self._atualizar()
+            return self._copia(self._por_ra.get(ra))
+
+    def buscar_por_email(self, email):
+        with self._trava:
+            self._atualizar()
+            return self._copia(self._por_email.get(_normalizar_email(email)))
+
+    def buscar_por_cpf(self, cpf):
+        with self._trava:
+            self._atualizar()
+            return self._copia(self._por_cpf.get(_normalizar_cpf(cpf)))
+
+    def total(self):
+        with self._trava:
+            self._atualizar()
+            return len(self._por_ra)
+
+    def versao(self, ra):
+        with self._trava:
+            self._atualizar()
+            return self._geracao, ra in self._por_ra
+
+    def todos(self):
+        with self._trava:
+            self._atualizar()
+            return [self._copia(u) for u in self._por_ra.values()]
+
+    def adicionar(self, dados):
+        """
+        Único ponto de escrita. A conferência do RA roda dentro do lote do
+        escritor, sob a trava de arquivo, então dois workers não conseguem
+        cadastrar o mesmo RA.
+        """
+        ra = dados['ra']
+        linha = f"{ra}|{dados['nome_completo']}|{dados['email']}|{dados['cpf']}|{dados['curso']}|{dados['senha_hash']}|{dados['data_cadastro']}\n"
+        reservou = []
+
+        def conferir_e_gerar():
+            with self._trava:
+                self._atualizar()
+                if ra in self._por_ra or ra in self._reservados:
+                    return None
+                self._reservados.add(ra)
+                reservou.append(ra)
+                return linha.encode('utf-8')
+
+        try:
+            return self.escritor.escrever(self.caminho, conferir_e_gerar)
+        finally:
+            if reservou:
+                with self._trava:
+                    self._atualizar()
+                    self._reservados.discard(ra)
 
 
 # ============================================================================
-# FUNÇÕES AUXILIARES - GERENCIAMENTO DE DADOS
+# CACHE DE DADOS DOS ALUNOS (REGISTROS ESTRUTURADOS)
 # ============================================================================
+# O arquivo de dados dos alunos é indexado por offset ([RA:x] ... [FIM]) e
+# cada registro é convertido sob demanda em um dicionário com NOME, CURSO,
+# GRUPO, NOTAS e HISTORICO. Atualizações parciais (ex.: notas de um ciclo)
+# vão para um log de atualizações anexado, aplicado por cima do arquivo
+# principal, que só é reescrito quando o log é consolidado.
 
-def carregar_contexto():
-    try:
-        with open(NOME_ARQUIVO_CONTEXTO, 'r', encoding='utf-8') as f:
-            return f.read()
-    except FileNotFoundError:
-        print(f"AVISO: Arquivo '{NOME_ARQUIVO_CONTEXTO}' não encontrado.")
-        return "Nenhum contexto específico fornecido."
+_PADRAO_INICIO_REGISTRO = re.compile(rb'^\[RA:([^\]\r\n]+)\]', re.MULTILINE)
 
 
-def carregar_dados_aluno(ra):
+def _converter_nota(valor):
     try:
-        if not os.path.exists(NOME_ARQUIVO_DADOS_ALUNOS):
-            return ""
+        return float(valor.strip().replace(',', '.'))
+    except ValueError:
+        return None
 
-        with open(NOME_ARQUIVO_DADOS_ALUNOS, 'r', encoding='utf-8') as f:
-            conteudo = f.read()
 
-        inicio = conteudo.find(f"[RA:{ra}]")
-        if inicio == -1:
-            return ""
+def _formatar_nota(nota, casas):
+    return f"{nota:.{casas}f}" if isinstance(nota, float) else str(nota or '')
 
-        fim = conteudo.find("[FIM]", inicio)
-        if fim == -1:
+
+def analisar_registro_aluno(texto):
+    """Converte o bloco [RA:x] ... [FIM] em um dicionário estruturado"""
+    registro = {'ra': '', 'nome': '', 'curso': '', 'grupo': '', 'notas': [], 'historico': []}
+    secao = None
+
+    for linha in texto.split('\n'):
+        linha = linha.strip()
+        if not linha or linha.startswith('#') or linha == '[FIM]':
+            continue
+
+        if linha.startswith('[RA:'):
+            registro['ra'] = linha[4:].rstrip(']')
+        elif linha == 'NOTAS:':
+            secao = 'notas'
+        elif linha == 'HISTORICO:':
+            secao = 'historico'
+        elif secao is None and ':' in linha:
+            chave, valor = linha.split(':', 1)
+            if chave.strip().lower() in ('nome', 'curso', 'grupo'):
+                registro[chave.strip().lower()] = valor.strip()
+        elif secao == 'notas':
+            partes = [p.strip() for p in linha.split('|')]
+            if len(partes) >= 3:
+                registro['notas'].append({
+                    'ciclo': partes[0],
+                    'descricao': partes[1],
+                    'nota': _converter_nota(partes[2])
+                })
+        elif secao == 'historico':
+            partes = [p.strip() for p in linha.split('|')]
+            if len(partes) >= 4:
+                registro['historico'].append({
+                    'componente': partes[0],
+                    'semestre': partes[1],
+                    'nota': _converter_nota(partes[2]),
+                    'situacao': partes[3]
+                })
+
+    return registro
+
+
+def renderizar_registro_aluno(registro):
+    """Gera o bloco de texto no mesmo formato do arquivo de dados dos alunos"""
+    linhas = [
+        f"[RA:{registro['ra']}]",
+        f"NOME: {registro['nome']}",
+        f"CURSO: {registro['curso']}",
+        f"GRUPO: {registro['grupo'] or 'Não atribuído'}",
+        "",
+        "NOTAS:",
+    ]
+    linhas += [f"{n['ciclo']}|{n['descricao']}|{_formatar_nota(n['nota'], 2)}" for n in registro['notas']]
+    linhas += ["", "HISTORICO:"]
+    linhas += [f"{h['componente']}|{h['semestre']}|{_formatar_nota(h['nota'], 1)}|{h['situacao']}"
+               for h in registro['historico']]
+    linhas.append("[FIM]")
+    return '\n'.join(linhas)
+
+
+def registro_inicial_aluno(ra, nome, curso):
+    """Registro criado no cadastro: ciclo 1 zerado e componentes do primeiro semestre"""
+    notas = ["AFE - Avaliação Final de entrega", "VRAU - Verificação Regular", "PI - Projeto Integrador",
+             "Avaliação 360°"]
+    componentes = ["Cidadania ética e espiritualidade", "Introdução a engenharia de soluções",
+                   "Fundamentos matemáticos para computação", "Fundamentos de computação e infraestrutura",
+                   "Fundamentos de engenharia de dados"]
+    return {
+        'ra': ra, 'nome': nome, 'curso': curso, 'grupo': '',
+        'notas': [{'ciclo': 'Ciclo 1', 'descricao': d, 'nota': 0.0} for d in notas],
+        'historico': [{'componente': c, 'semestre': '1', 'nota': 0.0, 'situacao': 'Cursando'}
+                      for c in componentes]
+    }
+
+
+def aplicar_atualizacao_aluno(registro, atualizacao):
+    """Aplica uma atualização parcial: notas por (ciclo, descrição), histórico por componente"""
+    for campo in ('nome', 'curso', 'grupo'):
+        if atualizacao.get(campo):
+            registro[campo] = atualizacao[campo]
+
+    for nota in atualizacao.get('notas', []):
+        for existente in registro['notas']:
+            if existente['ciclo'] == nota['ciclo'] and existente['descricao'] == nota['descricao']:
+                existente['nota'] = nota['nota']
+                break
+        else:
+            registro['notas'].append(dict(nota))
+
+    for item in atualizacao.get('historico', []):
+        for existente in registro['historico']:
+            if existente['componente'] == item['componente']:
+                existente.update(item)
+                break
+        else:
+            registro['historico'].append(dict(item))
+
+
+class CacheDadosAlunos:
+    CABECALHO = ("# ============================================\n"
+                 "# DADOS PERSONALIZADOS DOS ALUNOS - UNIHELP\n"
+                 "# ============================================\n\n")
+
+    def __init__(self, caminho, caminho_atualizacoes, escritor):
+        self.caminho = caminho
+        self.caminho_atualizacoes = caminho_atualizacoes
+        self.escritor = escritor
+        self.escritor.registrar_cabecalho(caminho, self.CABECALHO)
+        self._trava = threading.RLock()
+        self._reservados = set()  # RAs com registro inicial no lote que ainda está sendo gravado
+        self._trava_consolidacao = threading.Lock()
+        # ra -> (offset inicial, offset final) no arquivo principal
+        self._offsets = {}
+        self._fim_indexado = 0
+        self._assinatura = None
+        # ra -> registro estruturado já analisado (já com as atualizações aplicadas)
+        self._registros = {}
+        # ra -> lista de atualizações do log, em ordem
+        self._atualizacoes = {}
+        # Versão de cada registro: (geração do índice, contador do RA)
+        self._geracao = 0
+        self._versoes = {}
+        self._offset_atualizacoes = 0
+        self._assinatura_atualizacoes = None
+
+    @staticmethod
+    def _assinatura_arquivo(caminho):
+        try:
+            info = os.stat(caminho)
+            return info.st_ino, info.st_size, info.st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def _indexar(self, inicio):
+        with medir_leitura('dados_alunos'), open(self.caminho, 'rb') as f:
+            f.seek(inicio)
+            dados = f.read()
+
+        posicao = 0
+        for encontrado in _PADRAO_INICIO_REGISTRO.finditer(dados):
+            if encontrado.start() < posicao:
+                continue
+            fim = dados.find(b'[FIM]', encontrado.start())
+            if fim == -1:
+                break  # registro ainda incompleto
+            fim += len(b'[FIM]')
+            ra = encontrado.group(1).decode('utf-8')
+            # Mantém o primeiro registro de cada RA, como o str.find fazia
+            if ra not in self._offsets:
+                self._offsets[ra] = (inicio + encontrado.start(), inicio + fim)
+                self._versoes[ra] = self._versoes.get(ra, 0) + 1
+            self._registros.pop(ra, None)
+            posicao = fim
+
+        self._fim_indexado = inicio + posicao
+
+    def _ler_atualizacoes(self):
+        with medir_leitura('dados_alunos_atualizacoes'), open(self.caminho_atualizacoes, 'rb') as f:
+            f.seek(self._offset_atualizacoes)
+            dados = f.read()
+
+        fim = dados.rfind(b'\n') + 1
+        for linha in dados[:fim].splitlines():
+            if not linha.strip():
+                continue
+            atualizacao = json.loads(linha)
+            self._atualizacoes.setdefault(atualizacao['ra'], []).append(atualizacao)
+            self._registros.pop(atualizacao['ra'], None)
+            self._versoes[atualizacao['ra']] = self._versoes.get(atualizacao['ra'], 0) + 1
+        self._offset_atualizacoes += fim
+
+    def _atualizar(self):
+        assinatura = self._assinatura_arquivo(self.caminho)
+        if assinatura != self._assinatura:
+            anterior = self._assinatura
+            if (assinatura is None or anterior is None or assinatura[0] != anterior[0] or
+                    assinatura[1] < anterior[1]):
+                self._offsets, self._registros, self._fim_indexado = {}, {}, 0
+                self._geracao += 1
+            if assinatura is not None:
+                self._indexar(self._fim_indexado)
+            self._assinatura = assinatura
+
+        assinatura = self._assinatura_arquivo(self.caminho_atualizacoes)
+        if assinatura != self._assinatura_atualizacoes:
+            anterior = self._assinatura_atualizacoes
+            if (assinatura is None or anterior is None or assinatura[0] != anterior[0] or
+                    assinatura[1] < anterior[1]):
+                for ra in self._atualizacoes:
+                    self._registros.pop(ra, None)
+                self._atualizacoes, self._offset_atualizacoes = {}, 0
+                self._geracao += 1
+            if assinatura is not None:
+                self._ler_atualizacoes()
+            self._assinatura_atualizacoes = assinatura
+
+    def _texto_bruto(self, ra):
+        inicio, fim = self._offsets[ra]
+        with medir_leitura('dados_alunos'), open(self.caminho, 'rb') as f:
+            f.seek(inicio)
+            return f.read(fim - inicio).decode('utf-8')
+
+    def _obter(self, ra):
+        registro = self._registros.get(ra)
+        if registro is not None:
+            return registro
+
+        if ra in self._offsets:
+            registro = analisar_registro_aluno(self._texto_bruto(ra))
+        elif ra in self._atualizacoes:
+            registro = {'ra': ra, 'nome': '', 'curso': '', 'grupo': '', 'notas': [], 'historico': []}
+        else:
+            return None
+
+        for atualizacao in self._atualizacoes.get(ra, []):
+            aplicar_atualizacao_aluno(registro, atualizacao)
+
+        self._registros[ra] = registro
+        return registro
+
+    def existe(self, ra):
+        with self._trava:
+            self._atualizar()
+            return ra in self._offsets or ra in self._atualizacoes
+
+    def versao(self, ra):
+        """Muda sempre que o registro deste RA pode ter mudado"""
+        with self._trava:
+            self._atualizar()
+            return self._geracao, self._versoes.get(ra, 0)
+
+    def obter(self, ra):
+        """Registro estruturado do aluno (cópia), ou None"""
+        with self._trava:
+            self._atualizar()
+            registro = self._obter(ra)
+            return json.loads(json.dumps(registro)) if registro else None
+
+    def texto(self, ra):
+        """Bloco de texto do aluno para o prompt; sem atualizações, é o trecho original do arquivo"""
+        with self._trava:
+            self._atualizar()
+            if ra in self._atualizacoes:
+                return renderizar_registro_aluno(self._obter(ra))
+            if ra in self._offsets:
+                return self._texto_bruto(ra)
             return ""
 
-        dados_aluno = conteudo[inicio:fim + 5]
-        return dados_aluno
+    def ras(self):
+        with self._trava:
+            self._atualizar()
+            return list(self._offsets) + [ra for ra in self._atualizacoes if ra not in self._offsets]
+
+    def adicionar_inicial(self, ra, nome, curso):
+        """Anexa o registro inicial do aluno se o RA ainda não tiver dados; retorna True se criou"""
+        bloco = '\n' + renderizar_registro_aluno(registro_inicial_aluno(ra, nome, curso)) + '\n\n'
+        reservou = []
+
+        def gerar():
+            # Conferido dentro do lote, sob a trava de arquivo; o RA fica
+            # reservado até ser indexado, para outro registro do mesmo lote não passar
+            with self._trava:
+                if self.existe(ra) or ra in self._reservados:
+                    return None
+                self._reservados.add(ra)
+                reservou.append(ra)
+                return bloco.encode('utf-8')
+
+        try:
+            return self.escritor.escrever(self.caminho, gerar)
+        finally:
+            if reservou:
+                with self._trava:
+                    self._atualizar()
+                    self._reservados.discard(ra)
+
+    def atualizar(self, atualizacoes):
+        """Anexa atualizações parciais ({'ra', 'notas'?, 'historico'?, 'grupo'?, ...}) sem reescrever o arquivo"""
+        dados = b''.join(json.dumps(a, ensure_ascii=False).encode('utf-8') + b'\n' for a in atualizacoes)
+
+        self.escritor.escrever(self.caminho_atualizacoes, dados)
+        with self._trava:
+            self._atualizar()
+
+    def consolidar(self):
+        """
+        Reescreve o arquivo principal com as atualizações aplicadas e tira do
+        log as que entraram nele. A cópia do arquivo é feita em blocos, sem
+        bloquear as escritas; a trava exclusiva do escritor só cobre o fim:
+        copiar o que foi anexado durante a cópia e trocar os arquivos.
+        """
+        with self._trava_consolidacao:
+            while True:
+                total = self._tentar_consolidar()
+                if total is not None:
+                    return total
+
+    def _tentar_consolidar(self):
+        """Número de alunos consolidados, ou None se outro processo trocou o arquivo no meio"""
+        with self._trava:
+            self._atualizar()
+            if not self._atualizacoes:
+                return 0
+            assinatura = self._assinatura
+            fim_copiado = self._fim_indexado
+            offset_atualizacoes = self._offset_atualizacoes
+            trocas = sorted((self._offsets[ra] + (renderizar_registro_aluno(self._obter(ra)).encode('utf-8'),)
+                             for ra in self._atualizacoes if ra in self._offsets), key=lambda troca: troca[0])
+            novos = [b'\n' + renderizar_registro_aluno(self._obter(ra)).encode('utf-8') + b'\n\n'
+                     for ra in self._atualizacoes if ra not in self._offsets]
+
+        temporario = f"{self.caminho}.{os.getpid()}.tmp"
+        try:
+            with open(temporario, 'wb') as destino:
+                if assinatura is None:
+                    destino.write(self.CABECALHO.encode('utf-8'))
+                else:
+                    with open(self.caminho, 'rb') as origem:
+                        for inicio, fim, bloco in trocas:
+                            _copiar_trecho(origem, destino, inicio)
+                            destino.write(bloco)
+                            origem.seek(fim)
+                        _copiar_trecho(origem, destino, fim_copiado)
+                destino.write(b''.join(novos))
+
+                with self.escritor.exclusivo(), self._trava:
+                    atual = self._assinatura_arquivo(self.caminho)
+                    if atual != assinatura and (atual is None or assinatura is None or atual[0] != assinatura[0]
+                                                or atual[1] < fim_copiado):
+                        return None
+
+                    # Registros anexados ao arquivo principal durante a cópia
+                    if atual is not None:
+                        with open(self.caminho, 'rb') as origem:
+                            origem.seek(fim_copiado)
+                            _copiar_trecho(origem, destino, atual[1])
+                    destino.flush()
+                    os.fsync(destino.fileno())
+                    os.replace(temporario, self.caminho)
+
+                    # Atualizações que chegaram durante a cópia continuam no log;
+                    # reaplicá-las sobre o registro já consolidado dá o mesmo resultado
+                    with open(self.caminho_atualizacoes, 'rb') as f:
+                        f.seek(offset_atualizacoes)
+                        restantes = f.read()
+                    with open(self.caminho_atualizacoes + '.tmp', 'wb') as f:
+                        f.write(restantes)
+                        f.flush()
+                        os.fsync(f.fileno())
+                    os.replace(self.caminho_atualizacoes + '.tmp', self.caminho_atualizacoes)
+
+                    self._atualizar()
+                    return len(trocas) + len(novos)
+        finally:
+            if os.path.exists(temporario):
+                os.remove(temporario)
+
+
+def _copiar_trecho(origem, destino, fim, tamanho_bloco=1024 * 1024):
+    """Copia de `origem` (da posição atual até `fim`) para `destino`, em blocos"""
+    restante = fim - origem.tell()
+    while restante > 0:
+        bloco = origem.read(min(tamanho_bloco, restante))
+        if not bloco:
+            break
+        destino.write(bloco)
+        restante -= len(bloco)
+
+
+# ============================================================================
+# ARMAZENAMENTO EM SQLITE (USUÁRIOS, DADOS DOS ALUNOS E HISTÓRICO)
+# ============================================================================
+# Alternativa aos arquivos de texto com a mesma interface das classes acima:
+# um único banco em modo WAL (leitores não bloqueiam quem escreve), chaves e
+# índices por RA e um pool de conexões compartilhado entre as requisições.
+# Os dados existentes entram com importar_para_sqlite (ver importar_sqlite.py).
+
+class PoolConexoesSQLite:
+    def __init__(self, caminho, tamanho):
+        self.caminho = caminho
+        self._livres = []
+        self._trava = threading.Lock()
+        self._vagas = threading.BoundedSemaphore(tamanho)
+
+    def _nova_conexao(self):
+        conexao = sqlite3.connect(self.caminho, check_same_thread=False, timeout=30)
+        conexao.execute("PRAGMA journal_mode=WAL")
+        conexao.execute("PRAGMA synchronous=NORMAL")
+        return conexao
+
+    @contextmanager
+    def conexao(self):
+        """Empresta uma conexão; o bloco é uma transação (commit no fim, rollback se der erro)"""
+        self._vagas.acquire()
+        try:
+            with self._trava:
+                conexao = self._livres.pop() if self._livres else None
+            if conexao is None:
+                conexao = self._nova_conexao()
+
+            try:
+                with conexao:
+                    yield conexao
+            finally:
+                with self._trava:
+                    self._livres.append(conexao)
+        finally:
+            self._vagas.release()
+
+    def fechar(self):
+        with self._trava:
+            for conexao in self._livres:
+                conexao.close()
+            self._livres = []
+
+    def reabrir(self):
+        """Depois de um fork: abandona as conexões herdadas (sem fechar, elas ainda são do mestre)"""
+        with self._trava:
+            self._livres = []
+
+
+def criar_esquema_sqlite(pool):
+    with pool.conexao() as c:
+        c.execute(
+            "CREATE TABLE IF NOT EXISTS usuarios ("
+            "ra TEXT PRIMARY KEY, nome TEXT NOT NULL, email TEXT NOT NULL, cpf TEXT NOT NULL, "
+            "curso TEXT NOT NULL, senha_hash TEXT NOT NULL, data_cadastro TEXT NOT NULL, "
+            "email_busca TEXT NOT NULL, cpf_busca TEXT NOT NULL)"
+        )
+        c.execute("CREATE INDEX IF NOT EXISTS idx_usuarios_email ON usuarios (email_busca)")
+        c.execute("CREATE INDEX IF NOT EXISTS idx_usuarios_cpf ON usuarios (cpf_busca)")
+        c.execute(
+            "CREATE TABLE IF NOT EXISTS alunos ("
+            "ra TEXT PRIMARY KEY, registro TEXT NOT NULL, versao INTEGER NOT NULL DEFAULT 1)"
+        )
+        c.execute(
+            "CREATE TABLE IF NOT EXISTS historico ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, ra TEXT NOT NULL, data TEXT NOT NULL, "
+            "pergunta TEXT NOT NULL, resposta TEXT NOT NULL)"
+        )
+        c.execute("CREATE INDEX IF NOT EXISTS idx_historico_ra ON historico (ra, id)")
+
+
+class RepositorioUsuariosSQLite:
+    COLUNAS = "ra, nome, email, cpf, curso, senha_hash, data_cadastro"
+
+    def __init__(self, pool):
+        self.pool = pool
+
+    def _buscar(self, coluna, valor):
+        with medir_leitura('usuarios'), self.pool.conexao() as c:
+            linha = c.execute(
+                f"SELECT {self.COLUNAS} FROM usuarios WHERE {coluna} = ? ORDER BY rowid LIMIT 1", (valor,)
+            ).fetchone()
+
+        if linha is None:
+            return None
+        return dict(zip(('ra', 'nome', 'email', 'cpf', 'curso', 'senha_hash', 'data_cadastro'), linha))
+
+    def buscar_por_ra(self, ra):
+        return self._buscar('ra', ra)
+
+    def buscar_por_email(self, email):
+        return self._buscar('email_busca', _normalizar_email(email))
+
+    def buscar_por_cpf(self, cpf):
+        return self._buscar('cpf_busca', _normalizar_cpf(cpf))
+
+    def total(self):
+        with self.pool.conexao() as c:
+            return c.execute("SELECT COUNT(*) FROM usuarios").fetchone()[0]
+
+    def versao(self, ra):
+        return 0, self.buscar_por_ra(ra) is not None
+
+    def todos(self):
+        with self.pool.conexao() as c:
+            linhas = c.execute(f"SELECT {self.COLUNAS} FROM usuarios ORDER BY rowid").fetchall()
+        return [dict(zip(('ra', 'nome', 'email', 'cpf', 'curso', 'senha_hash', 'data_cadastro'), l))
+                for l in linhas]
+
+    def adicionar(self, dados):
+        """A chave primária garante um cadastro por RA, mesmo entre workers"""
+        with self.pool.conexao() as c:
+            cursor = c.execute(
+                "INSERT OR IGNORE INTO usuarios VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (dados['ra'], dados['nome_completo'], dados['email'], dados['cpf'], dados['curso'],
+                 dados['senha_hash'], dados['data_cadastro'],
+                 _normalizar_email(dados['email']), _normalizar_cpf(dados['cpf']))
+            )
+            return cursor.rowcount == 1
+
+
+class DadosAlunosSQLite:
+    """Registros estruturados dos alunos (JSON por RA); atualizações são aplicadas na hora"""
+
+    def __init__(self, pool):
+        self.pool = pool
+
+    def existe(self, ra):
+        with self.pool.conexao() as c:
+            return c.execute("SELECT 1 FROM alunos WHERE ra = ?", (ra,)).fetchone() is not None
+
+    def versao(self, ra):
+        with self.pool.conexao() as c:
+            linha = c.execute("SELECT versao FROM alunos WHERE ra = ?", (ra,)).fetchone()
+        return 0, linha[0] if linha else 0
+
+    def obter(self, ra):
+        with medir_leitura('dados_alunos'), self.pool.conexao() as c:
+            linha = c.execute("SELECT registro FROM alunos WHERE ra = ?", (ra,)).fetchone()
+        return json.loads(linha[0]) if linha else None
+
+    def texto(self, ra):
+        registro = self.obter(ra)
+        return renderizar_registro_aluno(registro) if registro else ""
+
+    def ras(self):
+        with self.pool.conexao() as c:
+            return [linha[0] for linha in c.execute("SELECT ra FROM alunos ORDER BY rowid")]
+
+    def adicionar_inicial(self, ra, nome, curso):
+        registro = registro_inicial_aluno(ra, nome, curso)
+        with self.pool.conexao() as c:
+            cursor = c.execute("INSERT OR IGNORE INTO alunos (ra, registro) VALUES (?, ?)",
+                               (ra, json.dumps(registro, ensure_ascii=False)))
+            return cursor.rowcount == 1
+
+    def atualizar(self, atualizacoes):
+        with self.pool.conexao() as c:
+            # Trava de escrita desde o início: ler e regravar o registro sem corrida
+            c.execute("BEGIN IMMEDIATE")
+            for atualizacao in atualizacoes:
+                ra = atualizacao['ra']
+                linha = c.execute("SELECT registro FROM alunos WHERE ra = ?", (ra,)).fetchone()
+                registro = json.loads(linha[0]) if linha else {
+                    'ra': ra, 'nome': '', 'curso': '', 'grupo': '', 'notas': [], 'historico': []}
+                aplicar_atualizacao_aluno(registro, atualizacao)
+                c.execute(
+                    "INSERT INTO alunos (ra, registro) VALUES (?, ?) "
+                    "ON CONFLICT (ra) DO UPDATE SET registro = excluded.registro, versao = versao + 1",
+                    (ra, json.dumps(registro, ensure_ascii=False))
+                )
+
+    def consolidar(self):
+        return 0  # as atualizações já são gravadas no próprio registro
+
+
+class HistoricoSQLite:
+    def __init__(self, pool):
+        self.pool = pool
+
+    def anexar(self, registros):
+        with self.pool.conexao() as c:
+            c.executemany(
+                "INSERT INTO historico (ra, data, pergunta, resposta) VALUES (?, ?, ?, ?)",
+                [(r['ra'], r['data'], r['pergunta'], r['resposta']) for r in registros]
+            )
+
+    # O cursor de um registro é o seu id na tabela
+    @staticmethod
+    def _com_cursor(linhas):
+        return [dict(zip(('cursor', 'ra', 'data', 'pergunta', 'resposta'), (str(l[0]),) + tuple(l[1:])))
+                for l in linhas]
+
+    def pagina(self, ra, limite, antes=None):
+        """
+        Até `limite` registros do aluno anteriores ao cursor `antes` (do mais
+        antigo ao mais novo) e o cursor da página seguinte, ou None se acabou
+        """
+        antes = int(antes) if antes is not None else None
+        with medir_leitura('historico'), self.pool.conexao() as c:
+            linhas = c.execute(
+                "SELECT id, ra, data, pergunta, resposta FROM historico "
+                "WHERE ra = ? AND id < ? ORDER BY id DESC LIMIT ?",
+                (ra, antes if antes is not None else 2 ** 63 - 1, limite + 1)
+            ).fetchall()
+
+        registros = self._com_cursor(reversed(linhas[:limite]))
+        return registros, (registros[0]['cursor'] if registros and len(linhas) > limite else None)
+
+    def registros_apos(self, ra, depois=None):
+        """Registros do aluno posteriores ao cursor `depois` (todos se None), do mais antigo ao mais novo"""
+        with medir_leitura('historico'), self.pool.conexao() as c:
+            linhas = c.execute(
+                "SELECT id, ra, data, pergunta, resposta FROM historico WHERE ra = ? AND id > ? ORDER BY id",
+                (ra, int(depois) if depois is not None else 0)
+            ).fetchall()
+        return self._com_cursor(linhas)
+
+    def ler(self, ra, cursores):
+        """Registros do aluno com os cursores dados, na mesma ordem (os que não existem mais ficam de fora)"""
+        ids = [int(cursor) for cursor in cursores]
+        if not ids:
+            return []
+        with medir_leitura('historico'), self.pool.conexao() as c:
+            linhas = c.execute(
+                f"SELECT id, ra, data, pergunta, resposta FROM historico "
+                f"WHERE ra = ? AND id IN ({','.join('?' * len(ids))})",
+                [ra] + ids
+            ).fetchall()
+        por_id = {l[0]: l for l in linhas}
+        return self._com_cursor(por_id[i] for i in ids if i in por_id)
+
+    def geracao(self):
+        return 0  # os ids não mudam
+
+    def total_registros(self):
+        with self.pool.conexao() as c:
+            return c.execute("SELECT COUNT(*) FROM historico").fetchone()[0]
+
+    def todos(self):
+        with self.pool.conexao() as c:
+            linhas = c.execute("SELECT ra, data, pergunta, resposta FROM historico ORDER BY id").fetchall()
+        for l in linhas:
+            yield dict(zip(('ra', 'data', 'pergunta', 'resposta'), l))
+
+    def migrar_texto(self, caminho):
+        total = 0
+        for lote in _em_lotes(_ler_historico_texto(caminho), HISTORICO_MIGRACAO_LOTE_BYTES):
+            self.anexar(lote)
+            total += len(lote)
+        return total
+
+    def salvar_indice(self):
+        pass  # o índice por RA fica no próprio banco
+
+
+def importar_para_sqlite(pool, usuarios, dados_alunos, historico):
+    """
+    Copia usuários, dados dos alunos (já com as atualizações aplicadas) e o
+    histórico dos repositórios de texto para o banco. RAs já presentes no
+    banco são mantidos; o histórico só é importado se a tabela estiver vazia.
+    """
+    criar_esquema_sqlite(pool)
+    totais = {'usuarios': 0, 'alunos': 0, 'historico': 0}
+
+    with pool.conexao() as c:
+        for u in usuarios.todos():
+            cursor = c.execute(
+                "INSERT OR IGNORE INTO usuarios VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (u['ra'], u['nome'], u['email'], u['cpf'], u['curso'], u['senha_hash'], u['data_cadastro'],
+                 _normalizar_email(u['email']), _normalizar_cpf(u['cpf']))
+            )
+            totais['usuarios'] += cursor.rowcount
+
+        for ra in dados_alunos.ras():
+            cursor = c.execute("INSERT OR IGNORE INTO alunos (ra, registro) VALUES (?, ?)",
+                               (ra, json.dumps(dados_alunos.obter(ra), ensure_ascii=False)))
+            totais['alunos'] += cursor.rowcount
+
+        if c.execute("SELECT COUNT(*) FROM historico").fetchone()[0] == 0:
+            for r in historico.todos():
+                c.execute("INSERT INTO historico (ra, data, pergunta, resposta) VALUES (?, ?, ?, ?)",
+                          (r['ra'], r.get('data', 'N/A'), r.get('pergunta', ''), r.get('resposta', '')))
+                totais['historico'] += 1
+
+    return totais
+
+
+def criar_repositorios_texto():
+    """(usuários, dados dos alunos, histórico) sobre os arquivos de texto"""
+    escritor = escritor_arquivos()
+    historico = LogConversas(NOME_DIRETORIO_HISTORICO, HISTORICO_SEGMENTO_MAX_BYTES,
+                             HISTORICO_COMPACTAR_APOS_SEGMENTOS, HISTORICO_MAX_POR_ALUNO, escritor)
+    atexit.register(historico.salvar_indice)
+
+    return (RepositorioUsuarios(NOME_ARQUIVO_USUARIOS, escritor),
+            CacheDadosAlunos(NOME_ARQUIVO_DADOS_ALUNOS, NOME_ARQUIVO_ATUALIZACOES_ALUNOS, escritor),
+            historico)
+
+
+def criar_repositorios(backend=ARMAZENAMENTO_BACKEND):
+    if backend == 'sqlite':
+        pool = PoolConexoesSQLite(ARMAZENAMENTO_ARQUIVO_SQLITE, ARMAZENAMENTO_POOL_CONEXOES)
+        criar_esquema_sqlite(pool)
+        atexit.register(pool.fechar)
+        return RepositorioUsuariosSQLite(pool), DadosAlunosSQLite(pool), HistoricoSQLite(pool)
+    if backend == 'texto':
+        return criar_repositorios_texto()
+    raise ValueError(f"Backend de armazenamento desconhecido: {backend}")
+
+
+# Criados na primeira necessidade, não na importação: um script que só importa
+# o app (benchmark, validação de planilha) não abre o journal nem roda a
+# recuperação no diretório atual. A migração do histórico antigo fica com
+# criar_app() (e com importar_sqlite.py).
+_repositorios = {'atuais': None}
+_trava_repositorios = threading.Lock()
+
+
+def usar_repositorios(usuarios, dados_alunos, historico):
+    """Troca os repositórios usados pelo app; o índice de busca acompanha o histórico"""
+    _repositorios['atuais'] = (usuarios, dados_alunos, historico,
+                               IndiceBuscaHistorico(historico, HISTORICO_BUSCA_MAX_ALUNOS))
+
+
+def _repositorios_atuais():
+    atuais = _repositorios['atuais']
+    if atuais is None:
+        with _trava_repositorios:
+            if _repositorios['atuais'] is None:
+                usar_repositorios(*criar_repositorios())
+            atuais = _repositorios['atuais']
+    return atuais
+
+
+def repositorio_usuarios():
+    return _repositorios_atuais()[0]
+
+
+def cache_dados_alunos():
+    return _repositorios_atuais()[1]
+
+
+def log_conversas():
+    return _repositorios_atuais()[2]
+
+
+def indice_busca_historico():
+    return _repositorios_atuais()[3]
+
+
+def migrar_historico_antigo():
+    """Passa o historico_conversas.txt antigo para o log segmentado, se ele ainda está vazio"""
+    historico = log_conversas()
+    if not isinstance(historico, LogConversas):
+        return
+    if historico.total_registros() == 0 and os.path.exists(NOME_ARQUIVO_HISTORICO):
+        migrados = historico.migrar_texto(NOME_ARQUIVO_HISTORICO)
+        registrar_evento('historico_migrado', origem=NOME_ARQUIVO_HISTORICO, registros=migrados)
+
+
+# ============================================================================
+# FUNÇÕES AUXILIARES - GERENCIAMENTO DE DADOS
+# ============================================================================
+
+def carregar_dados_aluno(ra):
+    try:
+        return cache_dados_alunos().texto(ra)
 
     except Exception as e:
-        print(f"❌ ERRO ao carregar dados do aluno: {e}")
+        registrar_evento('erro_carregar_dados_aluno', logging.ERROR, ra=ra, erro=str(e))
         return ""
 
 
 def salvar_dados_aluno_inicial(ra, nome, curso):
     try:
-        if not os.path.exists(NOME_ARQUIVO_DADOS_ALUNOS):
-            with open(NOME_ARQUIVO_DADOS_ALUNOS, 'w', encoding='utf-8') as f:
-                f.write("# ============================================\n")
-                f.write("# DADOS PERSONALIZADOS DOS ALUNOS - UNIHELP\n")
-                f.write("# ============================================\n\n")
-
-        dados_existentes = carregar_dados_aluno(ra)
-        if dados_existentes:
-            return
-
-        with open(NOME_ARQUIVO_DADOS_ALUNOS, 'a', encoding='utf-8') as f:
-            f.write(f"\n[RA:{ra}]\n")
-            f.write(f"NOME: {nome}\n")
-            f.write(f"CURSO: {curso}\n")
-            f.write(f"GRUPO: Não atribuído\n\n")
-            f.write("NOTAS:\n")
-            f.write("Ciclo 1|AFE - Avaliação Final de entrega|0.00\n")
-            f.write("Ciclo 1|VRAU - Verificação Regular|0.00\n")
-            f.write("Ciclo 1|PI - Projeto Integrador|0.00\n")
-            f.write("Ciclo 1|Avaliação 360°|0.00\n\n")
-            f.write("HISTORICO:\n")
-            f.write("Cidadania ética e espiritualidade|1|0.0|Cursando\n")
-            f.write("Introdução a engenharia de soluções|1|0.0|Cursando\n")
-            f.write("Fundamentos matemáticos para computação|1|0.0|Cursando\n")
-            f.write("Fundamentos de computação e infraestrutura|1|0.0|Cursando\n")
-            f.write("Fundamentos de engenharia de dados|1|0.0|Cursando\n")
-            f.write("[FIM]\n\n")
-
-        print(f"✅ Dados iniciais criados para: {nome} (RA: {ra})")
+        if cache_dados_alunos().adicionar_inicial(ra, nome, curso):
+            registrar_evento('dados_aluno_criados', ra=ra)
 
     except Exception as e:
-        print(f"❌ ERRO ao criar dados do aluno: {e}")
+        registrar_evento('erro_criar_dados_aluno', logging.ERROR, ra=ra, erro=str(e))
 
 
 def hash_senha(senha):
@@ -171,54 +2159,25 @@ def hash_senha(senha):
 
 def salvar_usuario(dados):
     try:
-        if not os.path.exists(NOME_ARQUIVO_USUARIOS):
-            with open(NOME_ARQUIVO_USUARIOS, 'w', encoding='utf-8') as f:
-                f.write("# ============================================\n")
-                f.write("# BANCO DE DADOS DE USUÁRIOS - UNIHELP\n")
-                f.write("# ============================================\n")
-                f.write("# Estrutura: RA|NOME|EMAIL|CPF|CURSO|SENHA_HASH|DATA_CADASTRO\n")
-                f.write("# " + "=" * 80 + "\n\n")
-
-        with open(NOME_ARQUIVO_USUARIOS, 'a', encoding='utf-8') as f:
-            linha = f"{dados['ra']}|{dados['nome_completo']}|{dados['email']}|{dados['cpf']}|{dados['curso']}|{dados['senha_hash']}|{dados['data_cadastro']}\n"
-            f.write(linha)
+        if not repositorio_usuarios().adicionar(dados):
+            registrar_evento('cadastro_ra_duplicado', logging.WARNING, ra=dados['ra'])
+            return False
 
         salvar_dados_aluno_inicial(dados['ra'], dados['nome_completo'], dados['curso'])
-        print(f"✅ Usuário salvo: {dados['nome_completo']} (RA: {dados['ra']})")
+        registrar_evento('usuario_cadastrado', ra=dados['ra'])
         return True
 
     except Exception as e:
-        print(f"❌ ERRO ao salvar usuário: {e}")
+        registrar_evento('erro_salvar_usuario', logging.ERROR, ra=dados.get('ra'), erro=str(e))
         return False
 
 
 def buscar_usuario(ra):
     try:
-        if not os.path.exists(NOME_ARQUIVO_USUARIOS):
-            return None
-
-        with open(NOME_ARQUIVO_USUARIOS, 'r', encoding='utf-8') as f:
-            for linha in f:
-                linha = linha.strip()
-                if linha.startswith('#') or not linha:
-                    continue
-
-                partes = linha.split('|')
-                if len(partes) >= 6 and partes[0] == ra:
-                    return {
-                        'ra': partes[0],
-                        'nome': partes[1],
-                        'email': partes[2],
-                        'cpf': partes[3],
-                        'curso': partes[4],
-                        'senha_hash': partes[5],
-                        'data_cadastro': partes[6] if len(partes) > 6 else 'N/A'
-                    }
-
-        return None
+        return repositorio_usuarios().buscar_por_ra(ra)
 
     except Exception as e:
-        print(f"❌ ERRO ao buscar usuário: {e}")
+        registrar_evento('erro_buscar_usuario', logging.ERROR, ra=ra, erro=str(e))
         return None
 
 
@@ -235,17 +2194,561 @@ def validar_login(ra, senha):
 
 
 # ============================================================================
-# FUNÇÕES AUXILIARES - INTELIGÊNCIA ARTIFICIAL
+# IMPORTAÇÃO EM LOTE DE NOTAS, HISTÓRICO E GRUPOS (CSV DA SECRETARIA)
 # ============================================================================
+# A planilha é lida linha a linha, sem carregar o arquivo inteiro. Cada linha
+# é validada e vira uma atualização parcial do registro do aluno (a mesma de
+# CacheDadosAlunos.atualizar); a cada IMPORTACAO_LOTE_LINHAS as atualizações,
+# agrupadas por RA, são gravadas de uma vez e, no fim, consolidar() reescreve
+# dados_alunos.txt num arquivo temporário e o troca pelo original (rename).
+# Reimportar a mesma planilha dá o mesmo resultado: notas são substituídas
+# por (ciclo, descrição) e o histórico por componente.
+#
+# Colunas (cabeçalho obrigatório, separador "," ou ";"; só "ra" é obrigatória,
+# mas um RA ainda sem registro precisa de "nome" na sua primeira linha):
+#   ra, nome, curso, grupo            -> dados do aluno
+#   ciclo, descricao, nota            -> uma nota de avaliação
+#   componente, semestre, nota, situacao -> um item do histórico
+
+COLUNAS_IMPORTACAO = ('ra', 'nome', 'curso', 'grupo', 'ciclo', 'descricao', 'componente', 'semestre',
+                      'nota', 'situacao')
+
+
+class ErroImportacao(Exception):
+    """Planilha que não pode ser importada (cabeçalho ausente ou sem a coluna "ra")"""
+
+
+def _campo_valido(valor):
+    return '|' not in valor and '\n' not in valor and '\r' not in valor
+
+
+def validar_linha_importacao(linha):
+    """Converte uma linha da planilha em atualização parcial; levanta ValueError com o motivo"""
+    campos = {coluna: (linha.get(coluna) or '').strip() for coluna in COLUNAS_IMPORTACAO}
+
+    ra = campos['ra']
+    if not ra:
+        raise ValueError("RA vazio")
+    if not re.fullmatch(r'[\w.-]+', ra):
+        raise ValueError(f"RA inválido: {ra!r}")
+    for coluna, valor in campos.items():
+        if not _campo_valido(valor):
+            raise ValueError(f"'{coluna}' não pode ter '|' nem quebra de linha")
+
+    atualizacao = {'ra': ra}
+    for campo in ('nome', 'curso'):
+        if campos[campo]:
+            atualizacao[campo] = campos[campo]
+    if campos['grupo']:
+        atualizacao['grupo'] = f"Grupo {int(campos['grupo'])}" if campos['grupo'].isdigit() else campos['grupo']
+
+    nota = None
+    if campos['ciclo'] or campos['descricao'] or campos['componente']:
+        nota = _converter_nota(campos['nota'])
+        if nota is None or nota < 0:
+            raise ValueError(f"nota inválida: {campos['nota']!r}")
+
+    if campos['ciclo'] or campos['descricao']:
+        if not (campos['ciclo'] and campos['descricao']):
+            raise ValueError("nota de avaliação precisa de 'ciclo' e 'descricao'")
+        ciclo = f"Ciclo {int(campos['ciclo'])}" if campos['ciclo'].isdigit() else campos['ciclo']
+        atualizacao['notas'] = [{'ciclo': ciclo, 'descricao': campos['descricao'], 'nota': nota}]
+
+    if campos['componente']:
+        if not (campos['semestre'] and campos['situacao']):
+            raise ValueError("item do histórico precisa de 'semestre' e 'situacao'")
+        atualizacao['historico'] = [{'componente': campos['componente'], 'semestre': campos['semestre'],
+                                     'nota': nota, 'situacao': campos['situacao']}]
+
+    if len(atualizacao) == 1:
+        raise ValueError("linha sem dados do aluno, nota ou histórico")
+    return atualizacao
+
+
+def _juntar_atualizacoes(atualizacoes):
+    """Uma atualização por RA, na ordem em que apareceram (as linhas seguintes prevalecem)"""
+    por_ra = {}
+    for atualizacao in atualizacoes:
+        atual = por_ra.setdefault(atualizacao['ra'], {'ra': atualizacao['ra']})
+        for chave, valor in atualizacao.items():
+            if isinstance(valor, list):
+                atual.setdefault(chave, []).extend(valor)
+            else:
+                atual[chave] = valor
+    return list(por_ra.values())
+
+
+def importar_planilha_alunos(arquivo, dados_alunos, apenas_validar=False):
+    """
+    Importa a planilha (arquivo de texto já aberto) para os registros dos
+    alunos. Linhas inválidas são puladas e relatadas; com apenas_validar nada
+    é gravado. Retorna o resumo da importação.
+    """
+    inicio = time.perf_counter()
+    linhas = iter(arquivo)
+    cabecalho = next(linhas, '')
+    if not cabecalho.strip():
+        raise ErroImportacao("Planilha vazia")
+
+    separador = ';' if cabecalho.count(';') > cabecalho.count(',') else ','
+    colunas = [normalizar_texto(c).strip() for c in next(csv.reader([cabecalho], delimiter=separador))]
+    if 'ra' not in colunas:
+        raise ErroImportacao("A planilha precisa da coluna 'ra'")
+
+    resumo = {'linhas': 0, 'validas': 0, 'invalidas': 0, 'alunos': 0, 'novos': 0, 'erros': []}
+    ras = set()
+    lote = []
+
+    def gravar():
+        if lote and not apenas_validar:
+            dados_alunos.atualizar(_juntar_atualizacoes(lote))
+        lote.clear()
+
+    leitor = csv.DictReader(linhas, fieldnames=colunas, delimiter=separador)
+    for linha in leitor:
+        if not any((v or '').strip() for k, v in linha.items() if k is not None):
+            continue
+        resumo['linhas'] += 1
+        try:
+            atualizacao = validar_linha_importacao(linha)
+            # Sem nome, um RA desconhecido (RA digitado errado, em geral) viraria um aluno sem nome nem curso
+            novo = atualizacao['ra'] not in ras and not dados_alunos.existe(atualizacao['ra'])
+            if novo and 'nome' not in atualizacao:
+                raise ValueError(f"RA {atualizacao['ra']} sem registro: a primeira linha do aluno precisa de 'nome'")
+        except ValueError as e:
+            resumo['invalidas'] += 1
+            if len(resumo['erros']) < IMPORTACAO_MAX_ERROS_LISTADOS:
+                # +1: a primeira linha do arquivo (cabeçalho) foi lida fora do leitor
+                resumo['erros'].append({'linha': leitor.line_num + 1, 'erro': str(e)})
+            continue
+
+        resumo['validas'] += 1
+        if novo:
+            resumo['novos'] += 1
+        ras.add(atualizacao['ra'])
+        lote.append(atualizacao)
+        if len(lote) >= IMPORTACAO_LOTE_LINHAS:
+            gravar()
+
+    gravar()
+    if not apenas_validar and resumo['validas']:
+        dados_alunos.consolidar()
+
+    resumo['alunos'] = len(ras)
+    resumo['duracao_s'] = round(time.perf_counter() - inicio, 3)
+    metricas.incrementar('unihelp_importacao_linhas_total', resumo['validas'], resultado='valida')
+    metricas.incrementar('unihelp_importacao_linhas_total', resumo['invalidas'], resultado='invalida')
+    registrar_evento('importacao_alunos', apenas_validar=apenas_validar,
+                     **{k: v for k, v in resumo.items() if k != 'erros'})
+    return resumo
 
-def construir_prompt_sistema(ra_usuario):
-    contexto_geral = carregar_contexto()
-    dados_aluno = carregar_dados_aluno(ra_usuario)
-    usuario = buscar_usuario(ra_usuario)
-    nome_usuario = usuario['nome'] if usuario else "Aluno"
-    curso_usuario = usuario['curso'] if usuario else "Não especificado"
 
-    prompt = f"""Você é UniHelp, assistente acadêmica PERSONALIZADA da UniEVANGÉLICA.
+# ============================================================================
+# RECUPERAÇÃO DE CONTEXTO (RAG) NA BASE DE CONHECIMENTO
+# ============================================================================
+# A base de conhecimento é dividida nas suas próprias seções (cabeçalhos # na
+# parte geral; #COMPONENTE / ##CICLO / ###SEMANA na parte de conteúdos, ver
+# indexar_secoes) e indexada com BM25. Cada pergunta recebe só os trechos mais
+# relevantes, dentro de um orçamento de tokens, em vez do arquivo inteiro.
+
+RAG_ATIVO = True
+RAG_TOP_K = 6
+RAG_ORCAMENTO_TOKENS = 2500
+
+STOPWORDS = {
+    'a', 'o', 'as', 'os', 'um', 'uma', 'uns', 'umas', 'de', 'do', 'da', 'dos', 'das', 'em', 'no',
+    'na', 'nos', 'nas', 'por', 'para', 'pra', 'com', 'sem', 'e', 'ou', 'que', 'qual', 'quais',
+    'quando', 'como', 'onde', 'se', 'me', 'meu', 'minha', 'meus', 'minhas', 'eu', 'voce', 'ao',
+    'aos', 'mais', 'muito', 'sobre', 'esse', 'essa', 'este', 'esta', 'isso', 'isto', 'ja', 'tem',
+    'ter', 'ser', 'sao', 'foi', 'vai', 'quero', 'queria', 'gostaria', 'saber', 'pode', 'poderia',
+    'favor', 'por', 'oi', 'ola', 'obrigado', 'obrigada', 'lá', 'la', 'ai', 'tudo', 'bem',
+}
+
+
+# Expansão de termos da pergunta para o vocabulário usado na base
+SINONIMOS = {
+    'prova': ['avaliacao', 'verificacao'],
+    'teste': ['avaliacao', 'verificacao'],
+    'va': ['verificacao', 'avaliacao'],
+    'aula': ['letivo', 'horario'],
+    'ferias': ['feriado'],
+    'coordenador': ['coordenadora'],
+    'coordenacao': ['coordenadora'],
+}
+
+
+def normalizar_texto(texto):
+    """Minúsculas e sem acentos"""
+    texto = unicodedata.normalize('NFKD', texto.lower())
+    return ''.join(c for c in texto if not unicodedata.combining(c))
+
+
+def _radical(token):
+    """Reduz plurais simples: materiais -> material, solucoes -> solucao, notas -> nota"""
+    if len(token) > 4 and token.endswith('ais'):
+        return token[:-3] + 'al'
+    if len(token) > 4 and token.endswith('oes'):
+        return token[:-3] + 'ao'
+    if len(token) > 3 and token.endswith('s') and not token.endswith('ss'):
+        return token[:-1]
+    return token
+
+
+def tokenizar(texto, remover_stopwords=True):
+    tokens = []
+    for token in re.findall(r'\w+', normalizar_texto(texto)):
+        if token.isdigit():
+            token = str(int(token))  # "03" e "3" viram o mesmo termo
+        elif remover_stopwords and token in STOPWORDS:
+            continue
+        else:
+            token = _radical(token)
+        tokens.append(token)
+    return tokens
+
+
+def expandir_consulta(tokens):
+    expandidos = list(tokens)
+    for token in tokens:
+        expandidos.extend(SINONIMOS.get(token, []))
+    return expandidos
+
+
+def estimar_tokens(texto):
+    return len(texto) // 4 + 1
+
+
+class IndiceBM25:
+    """BM25 sobre o conteúdo dos trechos, com bônus para termos que aparecem no título"""
+
+    def __init__(self, trechos, k1=1.5, b=0.75, peso_titulo=1.5):
+        self.trechos = trechos
+        self.k1 = k1
+        self.b = b
+        self.peso_titulo = peso_titulo
+        self._frequencias = []
+        self._tamanhos = []
+        self._titulos = []
+        documentos_com_termo = {}
+
+        for titulo, conteudo in trechos:
+            self._titulos.append(set(tokenizar(titulo)))
+            tokens = tokenizar(conteudo)
+            frequencias = {}
+            for token in tokens:
+                frequencias[token] = frequencias.get(token, 0) + 1
+            for token in frequencias:
+                documentos_com_termo[token] = documentos_com_termo.get(token, 0) + 1
+            self._frequencias.append(frequencias)
+            self._tamanhos.append(len(tokens))
+
+        total = len(trechos)
+        self._tamanho_medio = (sum(self._tamanhos) / total) if total else 0
+        self._idf = {termo: math.log(1 + (total - n + 0.5) / (n + 0.5))
+                     for termo, n in documentos_com_termo.items()}
+
+    def buscar(self, consulta, top_k):
+        termos = set(expandir_consulta(tokenizar(consulta)))
+        pontuacoes = []
+
+        for i, frequencias in enumerate(self._frequencias):
+            pontuacao = 0.0
+            normalizacao = self.k1 * (1 - self.b + self.b * self._tamanhos[i] / (self._tamanho_medio or 1))
+            for termo in termos:
+                f = frequencias.get(termo)
+                if f:
+                    pontuacao += self._idf[termo] * f * (self.k1 + 1) / (f + normalizacao)
+                    if termo in self._titulos[i]:
+                        pontuacao += self.peso_titulo * self._idf[termo]
+            if pontuacao > 0:
+                pontuacoes.append((pontuacao, i))
+
+        pontuacoes.sort(reverse=True)
+        return [i for _, i in pontuacoes[:top_k]]
+
+
+# ============================================================================
+# BASE DE CONHECIMENTO VERSIONADA (MAPA DE MEMÓRIA E ÍNDICE DE SEÇÕES)
+# ============================================================================
+# Cada versão da base é imutável: os bytes do arquivo ficam num mapa de memória,
+# com um índice das seções (cabeçalhos #, ## e ###) por offset, e os leitores
+# recebem fatias (memoryview) sem copiar o texto. Os trechos do índice BM25 são
+# as próprias seções, lidos pelas fatias; as tabelas (horário, calendário) são
+# montadas junto, a partir da mesma leitura.
+#
+# O mapa é anônimo, preenchido com uma cópia do arquivo: mapear o próprio
+# arquivo derrubaria o processo (SIGBUS) quando um editor o truncasse para
+# regravar. Como é criado antes do fork, os workers compartilham as páginas.
+
+def _limpar_titulo_secao(titulo):
+    return titulo.replace('COMPONENTE:', '').replace(':', '').strip()
+
+
+def indexar_secoes(dados, tamanho):
+    """[{'nivel', 'titulo', 'caminho', 'inicio', 'fim'}] das seções, com offsets em bytes"""
+    secoes = []
+    abertas = []
+    nivel_anterior = None
+    posicao = 0
+
+    while posicao < tamanho:
+        quebra = dados.find(b'\n', posicao, tamanho)
+        proxima = tamanho if quebra == -1 else quebra + 1
+        linha = dados[posicao:proxima].strip()
+
+        if linha.startswith(b'#'):
+            nivel = len(linha) - len(linha.lstrip(b'#'))
+            # Linhas de cabeçalho seguidas, do mesmo nível, descrevem a seção
+            # aberta pela primeira ("# Estrutura: ...") e não abrem outra
+            if nivel != nivel_anterior:
+                while abertas and abertas[-1]['nivel'] >= nivel:
+                    abertas.pop()['fim'] = posicao
+                titulo = _limpar_titulo_secao(linha.lstrip(b'#').decode('utf-8', errors='replace'))
+                secao = {'nivel': nivel, 'titulo': titulo, 'inicio': posicao, 'fim': tamanho,
+                         'caminho': ' > '.join([a['titulo'] for a in abertas] + [titulo])}
+                abertas.append(secao)
+                secoes.append(secao)
+            nivel_anterior = nivel
+        elif linha:
+            nivel_anterior = None
+
+        posicao = proxima
+
+    return secoes
+
+
+class VersaoBaseConhecimento:
+    """Uma versão imutável da base: numero cresce a cada troca e serve de chave para os caches"""
+
+    def __init__(self, numero, assinatura, dados):
+        self.numero = numero
+        self.assinatura = assinatura
+        self.tamanho = len(dados)
+        self._mapa = mmap.mmap(-1, max(1, self.tamanho))
+        self._mapa.write(dados)
+        self.secoes = indexar_secoes(self._mapa, self.tamanho)
+        self.indice = IndiceBM25(self._trechos())
+        self.tabelas = analisar_tabelas_base(dados.decode('utf-8', errors='replace'))
+
+    def _trechos(self):
+        """
+        Um trecho (titulo, conteudo) por seção, com o texto entre o cabeçalho e
+        a primeira subseção; seções sem texto próprio (só subseções) ficam de fora
+        """
+        trechos = []
+        for i, secao in enumerate(self.secoes):
+            proxima = self.secoes[i + 1] if i + 1 < len(self.secoes) else None
+            fim = min(secao['fim'], proxima['inicio']) if proxima else secao['fim']
+            linhas = self.texto(self.fatia(secao['inicio'], fim)).split('\n')[1:]
+            corpo = '\n'.join(l for l in linhas if l.strip() and not re.fullmatch(r'-{3,}', l.strip())).strip()
+            if corpo:
+                trechos.append((secao['caminho'], f"[{secao['caminho']}]\n{corpo}"))
+        return trechos
+
+    def fatia(self, inicio=0, fim=None):
+        return memoryview(self._mapa)[inicio:self.tamanho if fim is None else fim]
+
+    def texto(self, fatia=None):
+        """Texto da base inteira (ou de uma fatia); cria uma string nova a cada chamada"""
+        return str(self.fatia() if fatia is None else fatia, 'utf-8', errors='replace')
+
+
+class BaseConhecimento:
+    """
+    Mantém a versão atual da base e a troca por uma nova quando o arquivo muda.
+    A verificação acontece no acesso (sem thread, então sobrevive ao fork) e só
+    quem a faz espera a nova versão ser montada; os demais seguem na anterior.
+    """
+
+    def __init__(self, caminho, intervalo_verificacao):
+        self.caminho = caminho
+        self.intervalo_verificacao = intervalo_verificacao
+        self._atual = None
+        self._proximo_numero = 1
+        self._verificada_em = None
+        self._trava = threading.Lock()
+
+    def _assinatura(self):
+        try:
+            info = os.stat(self.caminho)
+            return info.st_ino, info.st_size, info.st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def _carregar(self, assinatura):
+        inicio = time.perf_counter()
+        try:
+            with medir_leitura('base_conhecimento'), open(self.caminho, 'rb') as f:
+                dados = f.read()
+        except FileNotFoundError:
+            registrar_evento('base_conhecimento_ausente', logging.WARNING, arquivo=self.caminho)
+            dados = "Nenhum contexto específico fornecido.".encode('utf-8')
+
+        versao = VersaoBaseConhecimento(self._proximo_numero, assinatura, dados)
+        self._proximo_numero += 1
+        registrar_evento('base_conhecimento_carregada', versao=versao.numero, bytes=versao.tamanho,
+                         secoes=len(versao.secoes), trechos=len(versao.indice.trechos),
+                         duracao_ms=round((time.perf_counter() - inicio) * 1000, 2))
+        return versao
+
+    def atual(self):
+        versao = self._atual
+        if versao is not None and time.monotonic() - self._verificada_em < self.intervalo_verificacao:
+            return versao
+
+        if not self._trava.acquire(blocking=versao is None):
+            return versao
+        try:
+            if self._atual is None or time.monotonic() - self._verificada_em >= self.intervalo_verificacao:
+                # A assinatura é lida antes do arquivo: uma gravação durante a
+                # leitura muda o arquivo de novo e gera outra versão na próxima verificação
+                assinatura = self._assinatura()
+                if self._atual is None or self._atual.assinatura != assinatura:
+                    self._atual = self._carregar(assinatura)
+                self._verificada_em = time.monotonic()
+            return self._atual
+        finally:
+            self._trava.release()
+
+
+base_conhecimento = BaseConhecimento(NOME_ARQUIVO_CONTEXTO, BASE_VERIFICAR_SEGUNDOS)
+
+
+def versao_base_conhecimento():
+    """Número da versão atual da base (cresce a cada troca; chave dos caches que dependem dela)"""
+    return base_conhecimento.atual().numero
+
+
+def obter_indice_base():
+    return base_conhecimento.atual().indice
+
+
+def recuperar_contexto(consulta, top_k=RAG_TOP_K, orcamento_tokens=RAG_ORCAMENTO_TOKENS):
+    """Trechos mais relevantes para a consulta, na ordem do arquivo, dentro do orçamento"""
+    indice = obter_indice_base()
+    escolhidos = []
+    usados = 0
+
+    for i in indice.buscar(consulta, top_k):
+        custo = estimar_tokens(indice.trechos[i][1])
+        if usados + custo > orcamento_tokens:
+            continue
+        escolhidos.append(i)
+        usados += custo
+
+    return '\n\n'.join(indice.trechos[i][1] for i in sorted(escolhidos))
+
+
+def mensagens_com_contexto(historico_mensagens):
+    """Anexa os trechos recuperados à última pergunta (só na cópia enviada ao modelo)"""
+    if not RAG_ATIVO:
+        return historico_mensagens
+
+    perguntas = [m['content'] for m in historico_mensagens if m['role'] == 'user']
+    if not perguntas:
+        return historico_mensagens
+
+    # A pergunta anterior ajuda em continuações como "e da semana 4?"
+    consulta = ' '.join(perguntas[-2:])
+    with medir_etapa('recuperacao_base'):
+        trechos = recuperar_contexto(consulta)
+
+    conteudo = f"""TRECHOS RELEVANTES DA BASE DE CONHECIMENTO:
+{trechos if trechos else "Nenhum trecho relevante encontrado."}
+
+PERGUNTA DO ALUNO:
+{perguntas[-1]}"""
+
+    return historico_mensagens[:-1] + [{"role": "user", "content": conteudo}]
+
+
+# ============================================================================
+# JANELA DE CONTEXTO DA CONVERSA (ORÇAMENTO DE TOKENS E RESUMO)
+# ============================================================================
+# O histórico guarda o texto cru do modelo em 'content' (é o que volta para ele)
+# e o HTML da resposta em 'html' (só para exibir). Quando os turnos passam do
+# orçamento, os mais antigos saem do histórico e entram, em uma linha cada, no
+# resumo guardado junto do prompt de sistema (chave 'resumo'), que vai para o
+# modelo como parte da system_instruction.
+
+_PADRAO_MARCACAO_RESUMO = re.compile(r'<[^>]+>|\[[A-Z_0-9]+\]|https?://\S+')
+
+
+def _texto_para_resumo(conteudo):
+    """Primeiras palavras da mensagem, sem marcações, links ou HTML (históricos antigos)"""
+    texto = ' '.join(html.unescape(_PADRAO_MARCACAO_RESUMO.sub(' ', conteudo)).split())
+    if len(texto) > RESUMO_MAX_CARACTERES_MENSAGEM:
+        texto = texto[:RESUMO_MAX_CARACTERES_MENSAGEM].rsplit(' ', 1)[0] + '…'
+    return texto
+
+
+def resumir_turnos(resumo_anterior, mensagens):
+    """Acrescenta as mensagens ao resumo; passando de RESUMO_MAX_TOKENS, esquece as linhas mais antigas"""
+    linhas = resumo_anterior.split('\n') if resumo_anterior else []
+    for msg in mensagens:
+        texto = _texto_para_resumo(msg['content'])
+        if texto:
+            linhas.append(f"- Aluno: {texto}" if msg['role'] == 'user' else f"  UniHelp: {texto}")
+
+    while len(linhas) > 1 and estimar_tokens('\n'.join(linhas)) > RESUMO_MAX_TOKENS:
+        linhas.pop(0)
+    return '\n'.join(linhas)
+
+
+def instrucao_sistema(historico_mensagens):
+    """Prompt de sistema da conversa, com o resumo dos turnos antigos quando houver"""
+    if not historico_mensagens or historico_mensagens[0]['role'] != 'system':
+        return None
+
+    sistema = historico_mensagens[0]
+    if not sistema.get('resumo'):
+        return sistema['content']
+    return f"{sistema['content']}\n\nRESUMO DA CONVERSA ATÉ AQUI (turnos mais antigos):\n{sistema['resumo']}"
+
+
+def tokens_da_janela(historico_mensagens):
+    """Tokens estimados dos turnos e do resumo (o prompt de sistema fica de fora)"""
+    total = 0
+    for msg in historico_mensagens:
+        total += estimar_tokens(msg.get('resumo', '')) if msg['role'] == 'system' else estimar_tokens(msg['content'])
+    return total
+
+
+def ajustar_janela_historico(historico_mensagens, novo_prompt_sistema):
+    """
+    Histórico dentro do orçamento de tokens. Se precisar resumir, os turnos
+    antigos saem aos pares (pergunta e resposta), as últimas
+    HISTORICO_MIN_MENSAGENS_RECENTES ficam sempre, e o prompt de sistema é
+    reconstruído com `novo_prompt_sistema()`.
+    """
+    total = tokens_da_janela(historico_mensagens)
+    if total <= HISTORICO_ORCAMENTO_TOKENS:
+        return historico_mensagens
+
+    sistema = historico_mensagens[0] if historico_mensagens and historico_mensagens[0]['role'] == 'system' else {}
+    turnos = [m for m in historico_mensagens if m['role'] != 'system']
+
+    alvo = HISTORICO_ORCAMENTO_TOKENS * HISTORICO_FRACAO_APOS_RESUMO
+    corte = 0
+    while total > alvo and len(turnos) - corte > HISTORICO_MIN_MENSAGENS_RECENTES:
+        total -= estimar_tokens(turnos[corte]['content'])
+        corte += 1
+    while corte < len(turnos) - 1 and turnos[corte]['role'] != 'user':
+        corte += 1
+
+    if corte == 0:
+        return historico_mensagens
+
+    resumo = resumir_turnos(sistema.get('resumo', ''), turnos[:corte])
+    metricas.incrementar('unihelp_historico_resumos_total')
+    return [{"role": "system", "content": novo_prompt_sistema(), "resumo": resumo}] + turnos[corte:]
+
+
+# ============================================================================
+# FUNÇÕES AUXILIARES - INTELIGÊNCIA ARTIFICIAL
+# ============================================================================
+
+PROMPT_SISTEMA_MODELO = """Você é UniHelp, assistente acadêmica PERSONALIZADA da UniEVANGÉLICA.
 
 INFORMAÇÕES DO USUÁRIO LOGADO:
 Nome: {nome_usuario}
@@ -256,7 +2759,7 @@ BASE DE CONHECIMENTO GERAL:
 {contexto_geral}
 
 DADOS ESPECÍFICOS DESTE ALUNO:
-{dados_aluno if dados_aluno else "Nenhum dado específico cadastrado ainda."}
+{dados_aluno}
 
 REGRAS IMPORTANTES:
 1. Use APENAS informações da base de conhecimento e dos dados específicos deste aluno
@@ -282,68 +2785,1411 @@ FORMATO PARA LISTAR CONTEÚDOS:
 IMPORTANTE: Seja concisa e objetiva
 """
 
-    return prompt
+PROMPT_CACHE_MAX_ITENS = 5000
+
+
+class ModeloPrompt:
+    """Modelo de texto compilado uma única vez em partes fixas e campos"""
+
+    def __init__(self, partes):
+        self.partes = partes  # lista de (texto fixo, nome do campo ou None)
+
+    @classmethod
+    def compilar(cls, texto):
+        return cls([(literal, campo) for literal, campo, _, _ in string.Formatter().parse(texto)])
+
+    def preencher(self, **campos):
+        """Fixa alguns campos, devolvendo um novo modelo com menos partes"""
+        partes = []
+        for literal, campo in self.partes:
+            if campo in campos:
+                literal, campo = literal + campos[campo], None
+            if partes and partes[-1][1] is None:
+                partes[-1] = (partes[-1][0] + literal, campo)
+            else:
+                partes.append((literal, campo))
+        return ModeloPrompt(partes)
+
+    def renderizar(self, **campos):
+        return ''.join(literal + (campos[campo] if campo else '') for literal, campo in self.partes)
+
+
+class CachePromptSistema:
+    """Prompts de sistema já renderizados por RA, válidos enquanto as versões não mudam"""
+
+    def __init__(self, texto_modelo, max_itens):
+        self._modelo = ModeloPrompt.compilar(texto_modelo)
+        self._modelo_base = None
+        self._versao_base = None
+        self.max_itens = max_itens
+        self._prompts = OrderedDict()
+        self._trava = threading.Lock()
+        self.acertos = 0
+        self.falhas = 0
+
+    def _modelo_com_base(self, base):
+        if self._modelo_base is None or self._versao_base != base.numero:
+            if RAG_ATIVO:
+                contexto_geral = "Os trechos relevantes da base são enviados junto com cada pergunta, na seção \"TRECHOS RELEVANTES DA BASE DE CONHECIMENTO\"."
+            else:
+                contexto_geral = base.texto()
+            self._modelo_base = self._modelo.preencher(contexto_geral=contexto_geral)
+            self._versao_base = base.numero
+        return self._modelo_base
+
+    def obter(self, ra_usuario):
+        base = base_conhecimento.atual()
+        versao_base = base.numero
+        chave = (versao_base, cache_dados_alunos().versao(ra_usuario), repositorio_usuarios().versao(ra_usuario))
+
+        with self._trava:
+            item = self._prompts.get(ra_usuario)
+            if item is not None and item[0] == chave:
+                self._prompts.move_to_end(ra_usuario)
+                self.acertos += 1
+                return item[1]
+            self.falhas += 1
+            modelo = self._modelo_com_base(base)
+
+        dados_aluno = carregar_dados_aluno(ra_usuario)
+        usuario = buscar_usuario(ra_usuario)
+
+        prompt = modelo.renderizar(
+            nome_usuario=usuario['nome'] if usuario else "Aluno",
+            ra_usuario=ra_usuario,
+            curso_usuario=usuario['curso'] if usuario else "Não especificado",
+            dados_aluno=dados_aluno if dados_aluno else "Nenhum dado específico cadastrado ainda."
+        )
+
+        with self._trava:
+            self._prompts[ra_usuario] = (chave, prompt)
+            self._prompts.move_to_end(ra_usuario)
+            while len(self._prompts) > self.max_itens:
+                self._prompts.popitem(last=False)
+
+        return prompt
+
+    def estatisticas(self):
+        with self._trava:
+            return {'acertos': self.acertos, 'falhas': self.falhas, 'itens': len(self._prompts)}
+
+
+cache_prompt_sistema = CachePromptSistema(PROMPT_SISTEMA_MODELO, PROMPT_CACHE_MAX_ITENS)
+
+
+def construir_prompt_sistema(ra_usuario):
+    with medir_etapa('prompt_sistema'):
+        return cache_prompt_sistema.obter(ra_usuario)
+
+
+# Todas as marcações reconhecidas em um único padrão compilado. O texto é
+# escapado para HTML uma vez e cada linha é percorrida uma vez: linhas sem '['
+# viram parágrafo direto, sem passar pelo regex.
+_PADRAO_MARCACOES = re.compile(
+    r'\[(?:(?P<ciclo>CICLO_(\d+)\])'
+    r'|(?P<semana>SEMANA_(\d+)\][ \t]*(.*))'
+    r'|(?P<video>MAT_VIDEO\][ \t]*(.+))'
+    r'|(?P<slide>MAT_SLIDE\][ \t]*(.+))'
+    r'|(?P<link>LINK\][ \t]*(https?://[^\s&"]+(?:&amp;[^\s&"]*)*))'
+    r'|(?P<separador>SEPARADOR\]))'
+)
+
+_RENDERIZAR_MARCACAO = {
+    'ciclo': lambda m: f'<div class="ciclo-header">📚 CICLO {m.group(2)}</div>',
+    'semana': lambda m: f'<div class="semana-header">📌 SEMANA {m.group(4)}: {m.group(5)}</div>',
+    'video': lambda m: f'<div class="material-item"><span class="material-tipo">🎥 Vídeo:</span> {m.group(7)}</div>',
+    'slide': lambda m: f'<div class="material-item"><span class="material-tipo">📄 Slide:</span> {m.group(9)}</div>',
+    'link': lambda m: f'<div class="material-link">🔗 <a href="{m.group(11)}" target="_blank">{m.group(11)}</a></div>',
+    'separador': lambda m: '<div class="separador"></div>',
+}
+
+
+def _escapar(texto):
+    return html.escape(texto.replace('*', ''), quote=False)
+
+
+def _formatar_linha_escapada(linha):
+    linha = linha.strip()
+    if not linha:
+        return ''
+    if '[' not in linha:
+        return f'<p>{linha}</p>'
+
+    m = _PADRAO_MARCACOES.search(linha)
+    if m is None:
+        return f'<p>{linha}</p>'
+    if m.start() == 0 and m.end() == len(linha):
+        return _RENDERIZAR_MARCACAO[m.lastgroup](m)
+
+    partes = []
+    posicao = 0
+    while m is not None:
+        partes.append(linha[posicao:m.start()])
+        partes.append(_RENDERIZAR_MARCACAO[m.lastgroup](m))
+        posicao = m.end()
+        m = _PADRAO_MARCACOES.search(linha, posicao)
+    partes.append(linha[posicao:])
+    return ''.join(partes).strip()
+
+
+def formatar_linha(linha):
+    """Formata uma única linha da resposta; linhas vazias viram string vazia"""
+    return _formatar_linha_escapada(_escapar(linha))
 
 
 def formatar_resposta(texto):
-    import re
+    resultado = []
+    with medir_etapa('formatacao'):
+        for linha in _escapar(texto).split('\n'):
+            linha = _formatar_linha_escapada(linha)
+            if linha:
+                resultado.append(linha)
 
-    texto = texto.replace('***', '').replace('**', '').replace('*', '')
+    return '\n'.join(resultado)
 
-    texto = re.sub(r'\[CICLO_(\d+)\]', r'<div class="ciclo-header">📚 CICLO \1</div>', texto)
-    texto = re.sub(r'\[SEMANA_(\d+)\]\s*([^\n]+)', r'<div class="semana-header">📌 SEMANA \1: \2</div>', texto)
-    texto = re.sub(r'\[MAT_VIDEO\]\s*([^\n]+)',
-                   r'<div class="material-item"><span class="material-tipo">🎥 Vídeo:</span> \1</div>', texto)
-    texto = re.sub(r'\[MAT_SLIDE\]\s*([^\n]+)',
-                   r'<div class="material-item"><span class="material-tipo">📄 Slide:</span> \1</div>', texto)
-    texto = re.sub(r'\[LINK\]\s*(https?://[^\s<]+)',
-                   r'<div class="material-link">🔗 <a href="\1" target="_blank">\1</a></div>', texto)
-    texto = re.sub(r'\[SEPARADOR\]', r'<div class="separador"></div>', texto)
 
-    linhas = texto.split('\n')
-    resultado = []
+class FormatadorIncremental:
+    """Recebe pedaços de texto (ex.: do streaming) e formata cada linha assim que ela fecha"""
 
-    for linha in linhas:
-        linha = linha.strip()
-        if linha and not any(tag in linha for tag in ['<div', '</div>']):
-            resultado.append(f'<p>{linha}</p>')
-        elif linha:
-            resultado.append(linha)
+    def __init__(self):
+        self._buffer = ''
+
+    def alimentar(self, pedaco):
+        """Retorna [(texto_bruto, html), ...] das linhas completadas por este pedaço"""
+        self._buffer += pedaco
+        fim = self._buffer.rfind('\n')
+        if fim == -1:
+            return []
+
+        completas, self._buffer = self._buffer[:fim], self._buffer[fim + 1:]
+        return [(linha + '\n', formatar_linha(linha)) for linha in completas.split('\n')]
+
+    def finalizar(self):
+        resto, self._buffer = self._buffer, ''
+        return [(resto, formatar_linha(resto))] if resto else []
+
+
+def _converter_historico_gemini(historico_mensagens):
+    """Converte os turnos de usuário/assistente; o prompt de sistema vai como system_instruction"""
+    historico_gemini = []
+
+    for msg in historico_mensagens:
+        if msg['role'] == 'user':
+            historico_gemini.append({'role': 'user', 'parts': [msg['content']]})
+        elif msg['role'] == 'assistant':
+            historico_gemini.append({'role': 'model', 'parts': [msg['content']]})
+
+    return historico_gemini
 
-    return '\n'.join(resultado)
 
+class ErroModelo(Exception):
+    """Falha definitiva ao consultar o modelo; `mensagem` é o texto mostrado ao aluno"""
 
-def obter_resposta_gemini(historico_mensagens):
-    """Versão SEM streaming - retorna resposta completa"""
+    def __init__(self, tipo, mensagem):
+        super().__init__(mensagem)
+        self.tipo = tipo
+        self.mensagem = mensagem
+
+
+CODIGOS_RETENTAVEIS = {408, 429, 500, 502, 503, 504}
+ERROS_RETENTAVEIS = {'ResourceExhausted', 'TooManyRequests', 'ServiceUnavailable', 'InternalServerError',
+                     'DeadlineExceeded', 'GatewayTimeout', 'RetryError'}
+MENSAGEM_SERVIDOR_OCUPADO = "ERRO: Muitas conversas ao mesmo tempo. Tente novamente em instantes."
+
+
+def _erro_retentavel(e):
+    """429, 5xx, timeouts e quedas de conexão costumam passar sozinhos; chave inválida não"""
+    if isinstance(e, (TimeoutError, ConnectionError)):
+        return True
+    return getattr(e, 'code', None) in CODIGOS_RETENTAVEIS or type(e).__name__ in ERROS_RETENTAVEIS
+
+
+def _erro_modelo(e):
+    if "API_KEY" in str(e) or "invalid" in str(e).lower():
+        tipo, mensagem = 'chave_invalida', "ERRO: Chave de API inválida."
+    elif "quota" in str(e).lower() or getattr(e, 'code', None) == 429 or type(e).__name__ == 'ResourceExhausted':
+        tipo, mensagem = 'cota', "ERRO: Limite de requisições atingido."
+    elif isinstance(e, TimeoutError) or type(e).__name__ in ('DeadlineExceeded', 'GatewayTimeout'):
+        tipo, mensagem = 'prazo', "ERRO: O modelo demorou demais para responder. Tente novamente."
+    else:
+        tipo, mensagem = 'conexao', f"Erro ao conectar: {str(e)}"
+
+    metricas.incrementar('unihelp_modelo_erros_total', tipo=tipo)
+    registrar_evento('erro_modelo', logging.ERROR, tipo=tipo, erro=str(e))
+    return ErroModelo(tipo, mensagem)
+
+
+def _registrar_tamanho(tipo, texto):
+    """tipo 'prompt' ou 'resposta': caracteres e tokens estimados, nas métricas e no log do turno"""
+    caracteres = len(texto)
+    tokens = estimar_tokens(texto)
+    metricas.incrementar(f'unihelp_{tipo}_caracteres_total', caracteres)
+    metricas.observar(f'unihelp_{tipo}_tokens_estimados', tokens)
+    if has_app_context():
+        g.setdefault('tamanhos', {}).update({f'{tipo}_caracteres': caracteres, f'{tipo}_tokens': tokens})
+
+
+class LimitadorTaxa:
+    """
+    Token bucket: `por_minuto` fichas repostas continuamente, acumulando até
+    10 segundos de cota. Quem chega reserva as fichas na ordem de chegada (o
+    saldo pode ficar negativo) e dorme fora da trava até a sua vez; se a vez
+    passar do prazo, devolve a reserva e desiste.
+    """
+
+    def __init__(self, por_minuto):
+        self.taxa = por_minuto / 60
+        self.capacidade = max(1.0, por_minuto / 6)
+        self._fichas = self.capacidade
+        self._atualizado_em = time.monotonic()
+        self._trava = threading.Lock()
+
+    def _repor(self):
+        agora = time.monotonic()
+        self._fichas = min(self.capacidade, self._fichas + (agora - self._atualizado_em) * self.taxa)
+        self._atualizado_em = agora
+        return agora
+
+    def consumir(self, quantidade, prazo):
+        """Espera a cota para `quantidade` fichas até o instante `prazo` (time.monotonic); False se não der"""
+        quantidade = min(quantidade, self.capacidade)
+        with self._trava:
+            agora = self._repor()
+            espera = max(0.0, (quantidade - self._fichas) / self.taxa)
+            if agora + espera > prazo:
+                return False
+            self._fichas -= quantidade
+
+        if espera:
+            time.sleep(espera)
+        return True
+
+    def devolver(self, quantidade):
+        """Devolve as fichas de um consumir() cuja chamada acabou não sendo feita"""
+        with self._trava:
+            self._repor()
+            self._fichas = min(self.capacidade, self._fichas + min(quantidade, self.capacidade))
+
+
+class FilaJustaChamadas:
+    """
+    Limita as chamadas simultâneas ao modelo e, quando não há vaga, atende os
+    alunos em rodízio: cada RA tem sua fila e a próxima vaga vai para o RA
+    seguinte, então quem dispara várias perguntas não trava os outros.
+    """
+
+    def __init__(self, vagas):
+        self._livres = vagas
+        self._filas = OrderedDict()  # ra -> deque de senhas, na ordem do rodízio
+        self._condicao = threading.Condition()
+
+    def _vez_de(self, senha):
+        if self._livres <= 0 or not self._filas:
+            return False
+        return next(iter(self._filas.values()))[0] is senha
+
+    def entrar(self, chave, timeout):
+        senha = object()
+        limite = time.monotonic() + timeout
+
+        with self._condicao:
+            if self._livres > 0 and not self._filas:
+                self._livres -= 1
+                return True
+
+            self._filas.setdefault(chave, deque()).append(senha)
+            while not self._vez_de(senha):
+                restante = limite - time.monotonic()
+                if restante <= 0:
+                    self._retirar(chave, senha)
+                    self._condicao.notify_all()
+                    return False
+                self._condicao.wait(restante)
+
+            self._retirar(chave, senha)
+            self._livres -= 1
+            self._condicao.notify_all()
+            return True
+
+    def _retirar(self, chave, senha):
+        fila = self._filas[chave]
+        fila.remove(senha)
+        if fila:
+            self._filas.move_to_end(chave)  # o próximo pedido deste RA vai para o fim do rodízio
+        else:
+            del self._filas[chave]
+
+    def sair(self):
+        with self._condicao:
+            self._livres += 1
+            self._condicao.notify_all()
+
+    def aguardando(self):
+        with self._condicao:
+            return sum(len(f) for f in self._filas.values())
+
+
+fila_chamadas_modelo = FilaJustaChamadas(MAX_CHAMADAS_MODELO_SIMULTANEAS)
+# A cota da API é do projeto inteiro: cada worker fica com a sua parte
+limite_requisicoes_modelo = (LimitadorTaxa(MODELO_REQUISICOES_POR_MINUTO / PROCESSOS_SERVIDOR)
+                             if MODELO_REQUISICOES_POR_MINUTO else None)
+limite_tokens_modelo = (LimitadorTaxa(MODELO_TOKENS_POR_MINUTO / PROCESSOS_SERVIDOR)
+                        if MODELO_TOKENS_POR_MINUTO else None)
+
+
+@contextmanager
+def _vaga_no_modelo(ra_usuario, prazo):
+    with medir_etapa('espera_modelo'):
+        conseguiu = fila_chamadas_modelo.entrar(ra_usuario,
+                                                min(ESPERA_VAGA_MODELO_SEGUNDOS, prazo - time.monotonic()))
+    if not conseguiu:
+        metricas.incrementar('unihelp_modelo_erros_total', tipo='ocupado')
+        raise ErroModelo('ocupado', MENSAGEM_SERVIDOR_OCUPADO)
     try:
-        historico_gemini = []
+        yield
+    finally:
+        fila_chamadas_modelo.sair()
+
+
+def _respeitar_cota(tokens, prazo):
+    consumidos = []
+    with medir_etapa('espera_modelo'):
+        for limitador, quantidade in ((limite_requisicoes_modelo, 1), (limite_tokens_modelo, tokens)):
+            if limitador is None:
+                continue
+            if not limitador.consumir(quantidade, prazo):
+                # A chamada não vai ser feita: a cota já reservada volta para os outros
+                for consumido, quantidade_consumida in consumidos:
+                    consumido.devolver(quantidade_consumida)
+                metricas.incrementar('unihelp_modelo_erros_total', tipo='cota_local')
+                raise ErroModelo('ocupado', MENSAGEM_SERVIDOR_OCUPADO)
+            consumidos.append((limitador, quantidade))
+
+
+def _com_retentativas(prazo, tentar):
+    """Chama tentar(timeout) até dar certo; erros temporários esperam com backoff exponencial e jitter"""
+    tentativa = 0
+    while True:
+        try:
+            return tentar(max(1.0, prazo - time.monotonic()))
+        except ErroModelo:
+            raise
+        except Exception as e:
+            tentativa += 1
+            espera = random.uniform(0, min(MODELO_ESPERA_MAX_SEGUNDOS,
+                                           MODELO_ESPERA_BASE_SEGUNDOS * 2 ** (tentativa - 1)))
+            if (not _erro_retentavel(e) or tentativa >= MODELO_MAX_TENTATIVAS or
+                    time.monotonic() + espera >= prazo):
+                raise _erro_modelo(e) from e
+
+            metricas.incrementar('unihelp_modelo_retentativas_total')
+            registrar_evento('retentativa_modelo', logging.WARNING, tentativa=tentativa,
+                             espera_s=round(espera, 3), erro=str(e))
+            time.sleep(espera)
+
+
+_cliente_gemini = {'modulo': None}
+_trava_cliente_gemini = threading.Lock()
+
+
+def cliente_gemini():
+    """google.generativeai importado e configurado uma única vez, na primeira necessidade"""
+    with _trava_cliente_gemini:
+        if _cliente_gemini['modulo'] is None:
+            import google.generativeai as genai
+            genai.configure(api_key=GOOGLE_API_KEY, transport=GEMINI_TRANSPORTE)
+            _cliente_gemini['modulo'] = genai
+        return _cliente_gemini['modulo']
+
+
+def criar_modelo_gemini(instrucao_sistema):
+    return cliente_gemini().GenerativeModel(NOME_MODELO_GEMINI, system_instruction=instrucao_sistema)
+
+
+class GerenciadorSessoesChat:
+    """Mantém um objeto de chat do modelo por conversa.
+
+    O prompt de sistema vai uma única vez como system_instruction e cada
+    requisição só envia o novo turno do aluno. Se o chat em memória não
+    corresponde mais ao histórico salvo (despejado, outro worker, prompt
+    reconstruído), ele é recriado a partir do histórico. `criar_modelo`
+    pode ser trocado por um modelo falso local.
+    """
+
+    def __init__(self, criar_modelo, max_sessoes, ociosidade_segundos):
+        self.criar_modelo = criar_modelo
+        self.max_sessoes = max_sessoes
+        self.ociosidade_segundos = ociosidade_segundos
+        self._sessoes = OrderedDict()
+        self._trava = threading.Lock()
+
+    def _despejar(self, agora):
+        for id_conversa in list(self._sessoes):
+            if agora - self._sessoes[id_conversa]['usado_em'] <= self.ociosidade_segundos:
+                break
+            del self._sessoes[id_conversa]
+
+        while len(self._sessoes) > self.max_sessoes:
+            self._sessoes.popitem(last=False)
+
+    def _nova_sessao(self, prompt, turnos):
+        chat = self.criar_modelo(prompt).start_chat(history=_converter_historico_gemini(turnos))
+        return {'chat': chat, 'prompt': prompt, 'turnos': len(turnos),
+                'usado_em': time.time(), 'trava': threading.Lock()}
+
+    def obter(self, id_conversa, historico_mensagens):
+        """Sessão pronta para enviar a última mensagem de `historico_mensagens`"""
+        prompt = instrucao_sistema(historico_mensagens)
+        turnos = [m for m in historico_mensagens[:-1] if m['role'] != 'system']
+
+        if id_conversa is None:
+            return self._nova_sessao(prompt, turnos)
+
+        agora = time.time()
+        with self._trava:
+            self._despejar(agora)
+            sessao = self._sessoes.get(id_conversa)
+            if sessao is not None and sessao['turnos'] == len(turnos) and sessao['prompt'] == prompt:
+                sessao['usado_em'] = agora
+                self._sessoes.move_to_end(id_conversa)
+                return sessao
+
+        sessao = self._nova_sessao(prompt, turnos)
+        with self._trava:
+            self._sessoes[id_conversa] = sessao
+            self._despejar(agora)
+        return sessao
+
+    def sincronizar(self, id_conversa, historico_mensagens):
+        """Troca a pergunta enviada (com trechos da base) pela original e acompanha o corte da janela"""
+        with self._trava:
+            sessao = self._sessoes.get(id_conversa)
+        if sessao is None:
+            return
+
+        turnos = [m for m in historico_mensagens if m['role'] != 'system']
+        if instrucao_sistema(historico_mensagens) != sessao['prompt']:
+            # Prompt reconstruído ou resumo novo: a system_instruction muda, então o chat é recriado
+            self.remover(id_conversa)
+            return
+
+        try:
+            with sessao['trava']:
+                historico_chat = list(sessao['chat'].history)
+                if len(historico_chat) < len(turnos):
+                    raise ValueError("Histórico do chat menor que o histórico salvo")
+                historico_chat = historico_chat[len(historico_chat) - len(turnos):]
+                for i in range(len(historico_chat) - 1, -1, -1):
+                    if turnos[i]['role'] == 'user':
+                        historico_chat[i] = {'role': 'user', 'parts': [turnos[i]['content']]}
+                        break
+                sessao['chat'].history = historico_chat
+                sessao['turnos'] = len(turnos)
+        except Exception:
+            # Histórico do chat inconsistente (ex.: stream interrompido): recria na próxima vez
+            self.remover(id_conversa)
+
+    def registrar_turno(self, id_conversa, historico_mensagens, resposta):
+        """Inclui no chat um turno respondido sem chamar o modelo (ex.: resposta em cache)"""
+        with self._trava:
+            sessao = self._sessoes.get(id_conversa)
+        if sessao is None:
+            return
 
-        for msg in historico_mensagens:
-            if msg['role'] == 'system':
-                historico_gemini.append({'role': 'model', 'parts': [msg['content']]})
-            elif msg['role'] == 'user':
-                historico_gemini.append({'role': 'user', 'parts': [msg['content']]})
-            elif msg['role'] == 'assistant':
-                historico_gemini.append({'role': 'model', 'parts': [msg['content']]})
+        turnos_anteriores = len([m for m in historico_mensagens[:-1] if m['role'] != 'system'])
 
-        print("\nINFO: Enviando requisição para o Gemini API...")
+        try:
+            with sessao['trava']:
+                if sessao['turnos'] != turnos_anteriores:
+                    raise ValueError("Chat fora de sincronia com o histórico salvo")
+                sessao['chat'].history = list(sessao['chat'].history) + [
+                    {'role': 'user', 'parts': [historico_mensagens[-1]['content']]},
+                    {'role': 'model', 'parts': [resposta]},
+                ]
+                sessao['turnos'] += 2
+        except Exception:
+            self.remover(id_conversa)
 
-        chat = modelo_gemini.start_chat(history=historico_gemini[:-1])
-        ultima_mensagem = historico_mensagens[-1]['content']
+    def remover(self, id_conversa):
+        with self._trava:
+            self._sessoes.pop(id_conversa, None)
 
-        resposta = chat.send_message(ultima_mensagem)
 
-        print("INFO: Resposta recebida! ⚡")
-        return resposta.text
+gerenciador_sessoes_chat = GerenciadorSessoesChat(criar_modelo_gemini, CHAT_SESSOES_MAX,
+                                                  CHAT_SESSOES_OCIOSIDADE_SEGUNDOS)
 
+
+def _preparar_prompt(historico_mensagens):
+    """Última mensagem a enviar e tokens estimados do prompt (para a cota de tokens por minuto)"""
+    prompt = ''.join(m['content'] for m in historico_mensagens)
+    _registrar_tamanho('prompt', prompt)
+    return historico_mensagens[-1]['content'], estimar_tokens(prompt)
+
+
+def _texto_do_pedaco(pedaco):
+    try:
+        return pedaco.text
+    except ValueError:
+        # Pedaço sem texto (ex.: bloqueado por segurança)
+        return ''
+
+
+def obter_resposta_gemini(historico_mensagens, id_conversa=None, ra_usuario=None):
+    """Versão SEM streaming - retorna a resposta completa ou levanta ErroModelo"""
+    prazo = time.monotonic() + MODELO_PRAZO_SEGUNDOS
+    ultima_mensagem, tokens = _preparar_prompt(historico_mensagens)
+
+    def tentar(timeout):
+        # A cota é esperada antes de ocupar a vaga, e a vaga é devolvida antes
+        # da espera entre tentativas
+        _respeitar_cota(tokens, prazo)
+        with _vaga_no_modelo(ra_usuario, prazo), medir_etapa('modelo'):
+            sessao = gerenciador_sessoes_chat.obter(id_conversa, historico_mensagens)
+            try:
+                with sessao['trava']:
+                    resposta = sessao['chat'].send_message(ultima_mensagem, request_options={'timeout': timeout})
+                    texto = resposta.text
+                    sessao['turnos'] += 2
+                return texto
+            except Exception:
+                gerenciador_sessoes_chat.remover(id_conversa)
+                raise
+
+    texto = _com_retentativas(prazo, tentar)
+
+    _registrar_tamanho('resposta', texto)
+    return texto
+
+
+def _abrir_stream(sessao_e_prompt, prazo, timeout):
+    """
+    Uma tentativa do streaming: espera a cota, ocupa uma vaga, abre a chamada
+    e espera o primeiro texto, que é até onde ainda dá para tentar de novo.
+    Devolve a sessão e `ocupados`, que libera a vaga e a trava da sessão.
+    """
+    id_conversa, ra_usuario, historico_mensagens, ultima_mensagem, tokens = sessao_e_prompt
+    _respeitar_cota(tokens, prazo)
+    ocupados = ExitStack()
+    ocupados.enter_context(_vaga_no_modelo(ra_usuario, prazo))
+    try:
+        sessao = gerenciador_sessoes_chat.obter(id_conversa, historico_mensagens)
+        ocupados.enter_context(sessao['trava'])
+        pedacos = iter(sessao['chat'].send_message(ultima_mensagem, stream=True,
+                                                   request_options={'timeout': timeout}))
+        primeiro = ''
+        for pedaco in pedacos:
+            primeiro = _texto_do_pedaco(pedaco)
+            if primeiro:
+                break
+        return sessao, primeiro, pedacos, ocupados
+    except BaseException:
+        ocupados.close()
+        gerenciador_sessoes_chat.remover(id_conversa)
+        raise
+
+
+def _ler_resto_do_stream(id_conversa, sessao, pedacos, ocupados, saida, inicio):
+    """Passa o resto do stream para `saida` e libera a vaga e a sessão assim que o modelo termina"""
+    erro = None
+    try:
+        for pedaco in pedacos:
+            texto = _texto_do_pedaco(pedaco)
+            if texto:
+                saida.put(texto)
+        sessao['turnos'] += 2
     except Exception as e:
-        print(f"ERRO: {e}")
-        if "API_KEY" in str(e) or "invalid" in str(e).lower():
-            return "ERRO: Chave de API inválida."
-        elif "quota" in str(e).lower():
-            return "ERRO: Limite de requisições atingido."
+        gerenciador_sessoes_chat.remover(id_conversa)
+        erro = e
+    finally:
+        ocupados.close()
+        duracao = time.perf_counter() - inicio
+        metricas.observar('unihelp_etapa_segundos', duracao, etapa='modelo')
+        saida.put((erro, duracao))
+
+
+def obter_resposta_gemini_stream(historico_mensagens, id_conversa=None, ra_usuario=None):
+    """
+    Versão COM streaming - gera os pedaços de texto conforme chegam da API.
+    Erros antes do primeiro pedaço são tentados de novo; depois dele, encerram
+    a resposta com ErroModelo.
+    """
+    prazo = time.monotonic() + MODELO_PRAZO_SEGUNDOS
+    ultima_mensagem, tokens = _preparar_prompt(historico_mensagens)
+    sessao_e_prompt = (id_conversa, ra_usuario, historico_mensagens, ultima_mensagem, tokens)
+
+    inicio = time.perf_counter()
+    sessao, texto, pedacos, ocupados = _com_retentativas(
+        prazo, lambda timeout: _abrir_stream(sessao_e_prompt, prazo, timeout))
+    metricas.observar('unihelp_etapa_segundos', time.perf_counter() - inicio, etapa='modelo_primeiro_pedaco')
+
+    # O resto é lido do modelo em outra thread, para a vaga e a trava da sessão
+    # não ficarem presas enquanto o navegador lê devagar; o texto espera na fila
+    saida = queue.Queue()
+    threading.Thread(target=_ler_resto_do_stream, daemon=True,
+                     args=(id_conversa, sessao, pedacos, ocupados, saida, inicio)).start()
+
+    partes = []
+    while True:
+        if texto:
+            partes.append(texto)
+            yield texto
+        texto = saida.get()
+        if isinstance(texto, tuple):
+            erro, duracao = texto
+            break
+
+    if erro is not None:
+        raise _erro_modelo(erro) from erro
+
+    if has_app_context():
+        g.setdefault('etapas_ms', {})['modelo'] = duracao * 1000
+    _registrar_tamanho('resposta', ''.join(partes))
+
+
+def formatar_resposta_incremental(pedacos):
+    """Formata o texto linha a linha, assim que cada linha chega completa.
+
+    Gera tuplas (texto_bruto, html) para cada linha fechada; o resto da
+    última linha é formatado quando o stream termina.
+    """
+    formatador = FormatadorIncremental()
+    # O tempo de cada pedaço é somado e vira uma só amostra por resposta, como
+    # em formatar_resposta
+    duracao = 0.0
+    try:
+        for pedaco in pedacos:
+            inicio = time.perf_counter()
+            linhas = formatador.alimentar(pedaco)
+            duracao += time.perf_counter() - inicio
+            yield from linhas
+
+        inicio = time.perf_counter()
+        linhas = formatador.finalizar()
+        duracao += time.perf_counter() - inicio
+        yield from linhas
+    finally:
+        registrar_etapa('formatacao', duracao)
+
+
+# ============================================================================
+# RESPOSTAS DIRETAS PARA PERGUNTAS ESTRUTURADAS (HORÁRIO, CALENDÁRIO, NOTAS)
+# ============================================================================
+# O horário e o calendário da base de conhecimento e as notas, o histórico e o
+# grupo do aluno já estão em tabelas. Perguntas curtas sobre eles ("minhas
+# notas", "horário de quarta", "próxima prova") são respondidas direto dessas
+# tabelas, na mesma marcação que o modelo usa, sem chamar o modelo. Uma
+# pergunta só é reconhecida se TODAS as palavras dela forem esperadas para a
+# intenção; qualquer coisa a mais ("o que vai cair na prova?") vai para o modelo.
+
+RESPOSTAS_DIRETAS_ATIVAS = True
+
+DIAS_SEMANA = ['segunda', 'terca', 'quarta', 'quinta', 'sexta', 'sabado', 'domingo']
+MESES = ['janeiro', 'fevereiro', 'marco', 'abril', 'maio', 'junho', 'julho', 'agosto', 'setembro',
+         'outubro', 'novembro', 'dezembro']
+TIPO_POR_TERMO_CALENDARIO = {'prova': 'avaliacao', 'avaliacao': 'avaliacao', 'va': 'avaliacao',
+                             'verificacao': 'avaliacao', 'substitutiva': 'avaliacao',
+                             'feriado': 'feriado', 'ferias': 'feriado'}
+
+_TERMOS_COMUNS = {'ver', 'mostrar', 'mostra', 'mostre', 'exibir', 'listar', 'lista', 'consultar', 'informar',
+                  'informe', 'diga', 'dizer', 'fala', 'falar', 'preciso', 'todo', 'toda', 'agora', 'atual',
+                  'aqui', 'estao', 'estou', 'sera', 'seria', 'fica', 'ficou', 'acontece'}
+
+# intenção -> (termos que a disparam, termos aceitos além deles)
+INTENCOES_DIRETAS = {
+    'historico': ({'historico'}, {'nota', 'escolar', 'academico', 'disciplina', 'materia', 'componente',
+                                  'semestre', 'situacao', 'aprovado', 'aprovacao'}),
+    'notas': ({'nota', 'boletim'}, {'ciclo', 'avaliacao', 'afe', 'vrau', 'pi', 'tirei', 'tirou', 'recebi',
+                                    'lancada', 'lancado'}),
+    'grupo': ({'grupo'}, {'fico', 'fiquei', 'pertenco', 'participo', 'integrante', 'membro', 'projeto',
+                          'integrador', 'pi'}),
+    'horario': ({'horario', 'aula', 'grade'} | set(DIAS_SEMANA),
+                {'hora', 'hoje', 'amanha', 'semana', 'dia', 'feira', 'tenho', 'terei', 'temos', 'comeca',
+                 'termina', 'acaba', 'disciplina', 'materia', 'ead', 'presencial'}),
+    'calendario': (set(TIPO_POR_TERMO_CALENDARIO) | {'calendario', 'rematricula', 'trancamento'},
+                   {'proxima', 'proximo', 'data', 'dia', 'mes', 'academico', 'evento', 'prazo', 'ultimo',
+                    'inicio', 'fim', 'semestre', 'hoje'} | set(MESES)),
+}
+INTENCOES_COM_NUMEROS = {'historico', 'notas', 'calendario'}
+_PADRAO_NUMERO_ORDINAL = re.compile(r'^\d+a?$')
+
+
+def _linhas_da_secao(texto, estrutura):
+    """Linhas de dados da seção com '# Estrutura: <estrutura>', até a linha de '---'"""
+    linhas = []
+    dentro = False
+    for linha in texto.split('\n'):
+        linha = linha.strip()
+        if not dentro:
+            dentro = normalizar_texto(linha) == normalizar_texto(f"# Estrutura: {estrutura}")
+        elif linha.startswith('---'):
+            break
+        elif linha and not linha.startswith('#'):
+            linhas.append([campo.strip() for campo in linha.split(';')])
+    return linhas
+
+
+def analisar_horario(texto):
+    """[{'dia', 'indice_dia' (0 = segunda, None = EAD), 'disciplina', 'inicio', 'fim', 'tokens'}]"""
+    horario = []
+    for campos in _linhas_da_secao(texto, "DIA_SEMANA; DISCIPLINA; HORARIO_INICIO; HORARIO_FIM"):
+        if len(campos) < 2 or not campos[1]:
+            continue
+        dia = normalizar_texto(campos[0])
+        indice = next((i for i, nome in enumerate(DIAS_SEMANA) if dia.startswith(nome)), None)
+        horario.append({
+            'dia': campos[0].capitalize() if indice is not None else campos[0],
+            'indice_dia': indice,
+            'disciplina': campos[1],
+            'inicio': campos[2] if len(campos) > 2 else '',
+            'fim': campos[3] if len(campos) > 3 else '',
+            'tokens': set(tokenizar(campos[1])),
+        })
+    return horario
+
+
+def analisar_calendario(texto):
+    """Eventos com datas de início e fim; o ano vem do título e avança quando o mês volta (dez -> jan)"""
+    titulo = re.search(r'CALEND[AÁ]RIO ACAD[EÊ]MICO (\d{4})', texto)
+    ano = int(titulo.group(1)) if titulo else datetime.now().year
+    mes_anterior = 0
+    eventos = []
+
+    for campos in _linhas_da_secao(texto, "MÊS; DATA; DESCRIÇÃO; TIPO"):
+        while campos and not campos[-1]:
+            campos.pop()
+        if len(campos) < 3 or normalizar_texto(campos[0]) not in MESES:
+            continue
+        mes = MESES.index(normalizar_texto(campos[0])) + 1
+        dias = [int(d) for d in re.findall(r'\d+', campos[1])]
+        if not dias:
+            continue
+        if mes < mes_anterior:
+            ano += 1
+        mes_anterior = mes
+
+        # Descrições com ';' no meio: o tipo é sempre o último campo
+        descricao = '; '.join(campos[2:-1]) if len(campos) > 3 else campos[2]
+        tipo = campos[-1] if len(campos) > 3 else ''
+        try:
+            inicio, fim = datetime(ano, mes, dias[0]), datetime(ano, mes, dias[-1])
+        except ValueError:
+            continue
+        eventos.append({'mes': mes, 'datas': campos[1], 'descricao': descricao, 'tipo': tipo,
+                        'inicio': inicio, 'fim': fim, 'tokens': set(tokenizar(descricao))})
+
+    eventos.sort(key=lambda e: e['inicio'])
+    return eventos
+
+
+def analisar_tabelas_base(texto):
+    horario = analisar_horario(texto)
+    return {'horario': horario, 'calendario': analisar_calendario(texto),
+            'termos_disciplinas': set().union(*(h['tokens'] for h in horario))}
+
+
+def obter_tabelas_base():
+    """Horário e calendário da versão atual da base (ver VersaoBaseConhecimento)"""
+    return base_conhecimento.atual().tabelas
+
+
+def identificar_intencao(tokens, termos_disciplinas):
+    """Intenção reconhecida para a pergunta já tokenizada, ou None"""
+    for intencao, (gatilhos, aceitos) in INTENCOES_DIRETAS.items():
+        if not gatilhos.intersection(tokens):
+            continue
+        if intencao == 'horario':
+            aceitos = aceitos | termos_disciplinas
+        for token in tokens:
+            if token in gatilhos or token in aceitos or token in _TERMOS_COMUNS:
+                continue
+            if intencao in INTENCOES_COM_NUMEROS and _PADRAO_NUMERO_ORDINAL.match(token):
+                continue
+            break
+        else:
+            return intencao
+    return None
+
+
+def _numeros(tokens):
+    return {t.rstrip('a') for t in tokens if _PADRAO_NUMERO_ORDINAL.match(t)}
+
+
+def _formatar_periodo(evento):
+    return f"{evento['datas']} de {MESES[evento['mes'] - 1].replace('marco', 'março')}"
+
+
+def _responder_notas(registro, tokens, primeiro_nome):
+    ciclos = _numeros(tokens)
+    notas = [n for n in registro['notas']
+             if not ciclos or (re.findall(r'\d+', n['ciclo']) or [''])[0] in ciclos]
+    if not notas:
+        return f"{primeiro_nome}, ainda não há notas lançadas para você" + (" nesse ciclo." if ciclos else ".")
+
+    linhas = [f"{primeiro_nome}, aqui estão as suas notas:"]
+    ciclo_atual = None
+    for nota in notas:
+        if nota['ciclo'] != ciclo_atual:
+            ciclo_atual = nota['ciclo']
+            numero = re.findall(r'\d+', ciclo_atual)
+            linhas.append(f"[CICLO_{numero[0]}]" if numero else f"{ciclo_atual}:")
+        linhas.append(f"{nota['descricao']}: {_formatar_nota(nota['nota'], 2)}")
+    return '\n'.join(linhas)
+
+
+def _responder_historico(registro, tokens, primeiro_nome):
+    semestres = _numeros(tokens)
+    itens = [h for h in registro['historico'] if not semestres or str(h['semestre']) in semestres]
+    if not itens:
+        return f"{primeiro_nome}, ainda não há disciplinas no seu histórico" + (" nesse semestre." if semestres else ".")
+
+    linhas = [f"{primeiro_nome}, este é o seu histórico de notas:"]
+    semestre_atual = None
+    for item in sorted(itens, key=lambda h: str(h['semestre'])):
+        if item['semestre'] != semestre_atual:
+            if semestre_atual is not None:
+                linhas.append("[SEPARADOR]")
+            semestre_atual = item['semestre']
+            linhas.append(f"{semestre_atual}º semestre:")
+        linhas.append(f"{item['componente']}: {_formatar_nota(item['nota'], 1)} ({item['situacao']})")
+    return '\n'.join(linhas)
+
+
+def _responder_grupo(registro, tokens, primeiro_nome):
+    if not registro['grupo'] or registro['grupo'] == 'Não atribuído':
+        return f"{primeiro_nome}, você ainda não tem um grupo atribuído."
+    return f"{primeiro_nome}, você está no {registro['grupo']}."
+
+
+DIAS_SEMANA_EXIBICAO = ['segunda-feira', 'terça-feira', 'quarta-feira', 'quinta-feira', 'sexta-feira',
+                        'sábado', 'domingo']
+
+
+def _responder_horario(tabelas, tokens, hoje):
+    dias = {DIAS_SEMANA.index(t) for t in tokens if t in DIAS_SEMANA}
+    if 'hoje' in tokens:
+        dias.add(hoje.weekday())
+    if 'amanha' in tokens:
+        dias.add((hoje.weekday() + 1) % 7)
+
+    aulas = tabelas['horario']
+    termos = set(tokens) & tabelas['termos_disciplinas']
+    if termos:
+        # Pergunta sobre uma disciplina: as aulas que mais combinam com os termos dela
+        melhor = max(len(termos & a['tokens']) for a in aulas)
+        aulas = [a for a in aulas if len(termos & a['tokens']) == melhor]
+    if dias:
+        aulas = [a for a in aulas if a['indice_dia'] in dias]
+
+    if not aulas:
+        nomes = ', '.join(DIAS_SEMANA_EXIBICAO[d] for d in sorted(dias))
+        return f"Você não tem aulas presenciais em: {nomes}." if dias else "Não encontrei essa aula no horário."
+
+    linhas = ["Este é o seu horário:" if not dias and not termos else "Aqui está:"]
+    for aula in aulas:
+        if aula['indice_dia'] is None:
+            linhas.append(f"{aula['dia']}: {aula['disciplina']}")
+        else:
+            linhas.append(f"{aula['dia']}: {aula['disciplina']}, das {aula['inicio']} às {aula['fim']}")
+    return '\n'.join(linhas)
+
+
+def _responder_calendario(tabelas, tokens, hoje):
+    eventos = tabelas['calendario']
+    tipos = {TIPO_POR_TERMO_CALENDARIO[t] for t in tokens if t in TIPO_POR_TERMO_CALENDARIO}
+    if tipos:
+        eventos = [e for e in eventos if normalizar_texto(e['tipo']) in tipos]
+    for termo in ('rematricula', 'trancamento', 'substitutiva'):
+        if termo in tokens:
+            eventos = [e for e in eventos if termo in e['tokens']]
+
+    numeros = _numeros(tokens)
+    if numeros:
+        # "2ª VA": ordinais na descrição; outro número qualquer ("avaliação 360") fica para o modelo
+        eventos = [e for e in eventos if any(f"{n}a" in e['tokens'] for n in numeros)]
+        if not eventos:
+            return None
+
+    meses = {MESES.index(t) + 1 for t in tokens if t in MESES}
+    if meses:
+        eventos = [e for e in eventos if e['mes'] in meses]
+    else:
+        inicio_hoje = hoje.replace(hour=0, minute=0, second=0, microsecond=0)
+        eventos = [e for e in eventos if e['fim'] >= inicio_hoje]
+        if 'proxima' in tokens or 'proximo' in tokens:
+            eventos = eventos[:1 if tipos or numeros else 3]
+        else:
+            eventos = eventos[:5]
+
+    if not eventos:
+        return ("Não encontrei datas para isso no calendário acadêmico." if meses else
+                "Não há mais datas previstas para isso no calendário acadêmico atual.")
+
+    linhas = ["Pelo calendário acadêmico:"]
+    linhas += [f"{_formatar_periodo(e)}: {e['descricao']}" + (f" ({e['tipo']})" if e['tipo'] else '')
+               for e in eventos]
+    return '\n'.join(linhas)
+
+
+def responder_diretamente(ra_usuario, nome_usuario, pergunta, hoje=None):
+    """(texto, html) quando a pergunta é respondida pelas tabelas, ou None para seguir ao modelo"""
+    if not RESPOSTAS_DIRETAS_ATIVAS:
+        return None
+
+    with medir_etapa('resposta_direta'):
+        tokens = tokenizar(pergunta)
+        if not tokens or _PADRAO_CONTINUACAO.match(' '.join(re.findall(r'\w+', normalizar_texto(pergunta)))):
+            return None
+
+        tabelas = obter_tabelas_base()
+        intencao = identificar_intencao(tokens, tabelas['termos_disciplinas'])
+        if intencao is None:
+            return None
+
+        hoje = hoje or datetime.now()
+        primeiro_nome = nome_usuario.split()[0] if nome_usuario else "Aluno"
+
+        if intencao in ('notas', 'historico', 'grupo'):
+            registro = cache_dados_alunos().obter(ra_usuario)
+            if registro is None:
+                return None
+            responder = {'notas': _responder_notas, 'historico': _responder_historico,
+                         'grupo': _responder_grupo}[intencao]
+            texto = responder(registro, tokens, primeiro_nome)
+        elif intencao == 'horario':
+            if not tabelas['horario']:
+                return None
+            texto = _responder_horario(tabelas, tokens, hoje)
         else:
-            return f"Erro ao conectar: {str(e)}"
+            if not tabelas['calendario']:
+                return None
+            texto = _responder_calendario(tabelas, tokens, hoje)
+            if texto is None:
+                return None
+
+        texto_html = formatar_resposta(texto)
+
+    metricas.incrementar('unihelp_respostas_diretas_total', intencao=intencao)
+    return texto, texto_html
+
+
+# ============================================================================
+# CACHE DE RESPOSTAS PARA PERGUNTAS REPETIDAS
+# ============================================================================
+# A chave é a pergunta normalizada (sem acentos, caixa e stopwords) dentro da
+# versão atual da base de conhecimento. Só a primeira pergunta da conversa
+# entra: depois dela a resposta depende dos turnos anteriores ("explique
+# melhor", "e da semana 4?").
+#
+# Respostas montadas a partir do registro do aluno ficam restritas ao RA (e às
+# versões do registro e do cadastro): as de perguntas pessoais (notas, curso,
+# disciplinas, grupo, "meu", "estou"...) e as que citam dados do registro
+# (RA, grupo, notas). Uma pergunta geral procura primeiro entre as respostas
+# do próprio aluno e depois entre as compartilhadas. O nome do aluno é trocado
+# por um marcador ao guardar e pelo nome de quem pergunta ao devolver.
+
+CACHE_RESPOSTAS_MAX_ITENS = 2000
+CACHE_RESPOSTAS_TTL_SEGUNDOS = 6 * 60 * 60
+CACHE_RESPOSTAS_FUZZY = True
+CACHE_RESPOSTAS_LIMIAR_FUZZY = 0.85
+# Quantas respostas, no máximo, a busca aproximada compara a cada falha
+CACHE_RESPOSTAS_FUZZY_MAX_CANDIDATOS = 200
+
+TERMOS_PESSOAIS = {'nota', 'historico', 'grupo', 'media', 'situacao', 'aprovado', 'reprovado',
+                   'desempenho', 'boletim', 'ra', 'curso', 'cursando', 'disciplina', 'materia',
+                   'componente', 'semestre', 'matricula', 'turma', 'cadastro', 'email', 'cpf'}
+# Primeira pessoa (antes de tirar as stopwords): "qual meu curso", "o que estou cursando"
+PALAVRAS_PRIMEIRA_PESSOA = {'eu', 'meu', 'minha', 'meus', 'minhas', 'mim', 'comigo', 'estou', 'tenho',
+                            'tirei', 'fiz', 'sou', 'fui', 'fiquei', 'passei', 'reprovei', 'preciso'}
+_PADRAO_CONTINUACAO = re.compile(r'^(e|mas|entao|tambem|agora|e sobre|e da|e do|e a|e o)\b')
+_MARCADOR_NOME = '\u27e6NOME\u27e7'
+
+
+def _trigramas(texto):
+    texto = f"  {texto} "
+    return {texto[i:i + 3] for i in range(len(texto) - 2)}
+
+
+def _numeros_da_pergunta(texto):
+    return frozenset(t for t in texto.split() if t.isdigit())
+
+
+class CacheRespostas:
+    """
+    Respostas por (escopo, texto normalizado), com busca aproximada por
+    similaridade de trigramas. A busca aproximada só olha o balde do mesmo
+    escopo e dos mesmos números, e nele só os textos de tamanho compatível com
+    o limiar (Jaccard >= t exige tamanhos entre t*n e n/t), dos mais recentes
+    aos mais antigos, até max_candidatos_fuzzy: uma falha não percorre o cache
+    inteiro segurando a trava.
+    """
+
+    def __init__(self, max_itens, ttl_segundos, fuzzy, limiar_fuzzy,
+                 max_candidatos_fuzzy=CACHE_RESPOSTAS_FUZZY_MAX_CANDIDATOS):
+        self.max_itens = max_itens
+        self.ttl_segundos = ttl_segundos
+        self.fuzzy = fuzzy
+        self.limiar_fuzzy = limiar_fuzzy
+        self.max_candidatos_fuzzy = max_candidatos_fuzzy
+        # (escopo, texto normalizado) -> {'resposta', 'trigramas', 'numeros', 'criado_em'}
+        self._itens = OrderedDict()
+        # (escopo, números) -> {quantidade de trigramas -> OrderedDict(texto -> None)}
+        self._baldes = {}
+        self._trava = threading.Lock()
+        self.acertos = 0
+        self.acertos_fuzzy = 0
+        self.falhas = 0
+
+    def _expirado(self, item, agora):
+        return agora - item['criado_em'] > self.ttl_segundos
+
+    def buscar(self, escopo, texto):
+        agora = time.time()
+
+        with self._trava:
+            item = self._itens.get((escopo, texto))
+            if item is not None and not self._expirado(item, agora):
+                self._itens.move_to_end((escopo, texto))
+                self.acertos += 1
+                return item['resposta']
+
+            if self.fuzzy:
+                trigramas = _trigramas(texto)
+                melhor, melhor_similaridade = None, self.limiar_fuzzy
+
+                # Números precisam bater exatamente: "semana 3" não serve para "semana 4"
+                for texto_item in self._candidatos(escopo, _numeros_da_pergunta(texto), len(trigramas)):
+                    candidato = self._itens[(escopo, texto_item)]
+                    if self._expirado(candidato, agora):
+                        continue
+                    uniao = len(trigramas | candidato['trigramas'])
+                    similaridade = len(trigramas & candidato['trigramas']) / uniao if uniao else 0
+                    if similaridade >= melhor_similaridade:
+                        melhor, melhor_similaridade = (escopo, texto_item), similaridade
+
+                if melhor is not None:
+                    self._itens.move_to_end(melhor)
+                    self.acertos_fuzzy += 1
+                    return self._itens[melhor]['resposta']
+
+            self.falhas += 1
+            return None
+
+    def _candidatos(self, escopo, numeros, tamanho):
+        balde = self._baldes.get((escopo, numeros))
+        if not balde:
+            return []
+        tamanhos = range(math.ceil(tamanho * self.limiar_fuzzy), int(tamanho / self.limiar_fuzzy) + 1)
+        candidatos = []
+        for n in tamanhos:
+            for texto_item in reversed(balde.get(n, {})):
+                if len(candidatos) >= self.max_candidatos_fuzzy:
+                    return candidatos
+                candidatos.append(texto_item)
+        return candidatos
+
+    def _remover(self, chave):
+        item = self._itens.pop(chave)
+        escopo, texto = chave
+        balde = self._baldes[(escopo, item['numeros'])]
+        tamanho = len(item['trigramas'])
+        del balde[tamanho][texto]
+        if not balde[tamanho]:
+            del balde[tamanho]
+            if not balde:
+                del self._baldes[(escopo, item['numeros'])]
+
+    def guardar(self, escopo, texto, resposta):
+        with self._trava:
+            if (escopo, texto) in self._itens:
+                self._remover((escopo, texto))
+            item = {
+                'resposta': resposta,
+                'trigramas': _trigramas(texto),
+                'numeros': _numeros_da_pergunta(texto),
+                'criado_em': time.time(),
+            }
+            self._itens[(escopo, texto)] = item
+            balde = self._baldes.setdefault((escopo, item['numeros']), {})
+            balde.setdefault(len(item['trigramas']), OrderedDict())[texto] = None
+
+            agora = time.time()
+            for chave in list(self._itens):
+                if not self._expirado(self._itens[chave], agora):
+                    break
+                self._remover(chave)
+            while len(self._itens) > self.max_itens:
+                self._remover(next(iter(self._itens)))
+
+    def estatisticas(self):
+        with self._trava:
+            consultas = self.acertos + self.acertos_fuzzy + self.falhas
+            return {
+                'acertos': self.acertos,
+                'acertos_fuzzy': self.acertos_fuzzy,
+                'falhas': self.falhas,
+                'itens': len(self._itens),
+                'taxa_acerto': (self.acertos + self.acertos_fuzzy) / consultas if consultas else 0.0,
+            }
+
+
+cache_respostas = CacheRespostas(CACHE_RESPOSTAS_MAX_ITENS, CACHE_RESPOSTAS_TTL_SEGUNDOS,
+                                 CACHE_RESPOSTAS_FUZZY, CACHE_RESPOSTAS_LIMIAR_FUZZY)
+
+
+def _primeiro_turno(historico):
+    return not any(msg['role'] != 'system' or msg.get('resumo') for msg in historico[:-1])
+
+
+def pergunta_pessoal(pergunta):
+    palavras = set(re.findall(r'\w+', normalizar_texto(pergunta)))
+    return bool(palavras & PALAVRAS_PRIMEIRA_PESSOA) or any(t in TERMOS_PESSOAIS for t in tokenizar(pergunta))
+
+
+def resposta_cita_dados_do_aluno(ra_usuario, texto):
+    """True se a resposta menciona o RA, o curso, o grupo ou alguma nota do aluno"""
+    registro = cache_dados_alunos().obter(ra_usuario)
+    usuario = buscar_usuario(ra_usuario)
+    valores = {ra_usuario}
+    # O curso vai no prompt de sistema: uma resposta geral que o cite foi
+    # adaptada ao aluno e não serve para alunos de outros cursos
+    if usuario:
+        valores.add(usuario['curso'])
+    if registro:
+        valores.add(registro['curso'])
+        if registro['grupo'] and registro['grupo'] != 'Não atribuído':
+            valores.add(registro['grupo'])
+        for item in registro['notas'] + registro['historico']:
+            if isinstance(item['nota'], float) and item['nota']:
+                for casas in (1, 2):
+                    valor = f"{item['nota']:.{casas}f}"
+                    valores.update((valor, valor.replace('.', ',')))
+    # Nomes de componentes também aparecem nas respostas gerais da base e não contam
+    normalizado = normalizar_texto(texto)
+    return any(re.search(rf'(?<![\w.,]){re.escape(normalizar_texto(v))}(?![\w]|[.,]\d)', normalizado)
+               for v in valores if v)
+
+
+def chaves_cache_resposta(ra_usuario, pergunta, historico):
+    """
+    (chave pessoal, chave compartilhada ou None) da pergunta, cada uma no
+    formato (escopo, texto normalizado), ou None se ela não deve usar o cache
+    """
+    if not _primeiro_turno(historico):
+        return None
+
+    tokens = tokenizar(pergunta)
+    if not tokens:
+        return None
+
+    versao_base = versao_base_conhecimento()
+    texto = ' '.join(tokens)
+    pessoal = ((versao_base, ra_usuario, cache_dados_alunos().versao(ra_usuario),
+                repositorio_usuarios().versao(ra_usuario)), texto)
+    compartilhada = None if pergunta_pessoal(pergunta) else (versao_base, texto)
+    return pessoal, compartilhada
+
+
+def resposta_e_erro(texto):
+    return texto.startswith("ERRO:") or texto.startswith("Erro ao conectar")
+
+
+def _anonimizar(texto, nome):
+    if not nome:
+        return texto
+    texto = texto.replace(nome, _MARCADOR_NOME)
+    primeiro_nome = nome.split()[0]
+    return re.sub(rf'\b{re.escape(primeiro_nome)}\b', _MARCADOR_NOME, texto)
+
+
+def _personalizar(texto, nome):
+    return texto.replace(_MARCADOR_NOME, nome.split()[0] if nome else "Aluno")
+
+
+def _buscar_por_chaves(chaves, nome_usuario):
+    encontrada = None
+    for chave in chaves:
+        if chave is not None:
+            encontrada = cache_respostas.buscar(*chave)
+            if encontrada is not None:
+                break
+    if encontrada is None:
+        return None
+
+    texto, texto_html = encontrada
+    return _personalizar(texto, nome_usuario), _personalizar(texto_html, nome_usuario)
+
+
+def guardar_resposta_em_cache(ra_usuario, nome_usuario, pergunta, historico, texto, texto_html):
+    if resposta_e_erro(texto):
+        return
+
+    chaves = chaves_cache_resposta(ra_usuario, pergunta, historico)
+    if chaves is None:
+        return
+
+    pessoal, compartilhada = chaves
+    chave = compartilhada
+    if chave is None or resposta_cita_dados_do_aluno(ra_usuario, texto):
+        chave = pessoal
+    cache_respostas.guardar(*chave, (_anonimizar(texto, nome_usuario), _anonimizar(texto_html, nome_usuario)))
+
+
+# Perguntas iguais ao mesmo tempo (ex.: a turma toda perguntando do prazo):
+# a primeira chama o modelo e as outras esperam a resposta dela no cache.
+# Vale só para o que o cache de respostas aceita (primeiro turno da conversa),
+# com a mesma chave do cache: gerais entre todos os alunos, pessoais só entre
+# pedidos do mesmo RA. Continuações da conversa nunca são coalescidas, porque
+# a resposta depende dos turnos anteriores de cada uma.
+_perguntas_em_andamento = {}
+_trava_perguntas_em_andamento = threading.Lock()
+
+
+def buscar_ou_reservar_resposta(ra_usuario, nome_usuario, pergunta, historico):
+    """
+    (resposta em cache ou None, reserva). Sem resposta, quem recebe a reserva
+    chama o modelo e depois chama liberar_reserva(reserva), mesmo com erro; se a
+    mesma pergunta já está sendo respondida, espera por ela e busca no cache.
+    """
+    chaves = chaves_cache_resposta(ra_usuario, pergunta, historico)
+    if chaves is None:
+        return None, None
+
+    # Perguntas gerais esperam pela mesma pergunta de qualquer aluno; se a
+    # resposta citar dados do registro, ela fica só com ele e a espera não acha nada
+    chave = chaves[1] or chaves[0]
+    limite = time.monotonic() + MODELO_PRAZO_SEGUNDOS
+    esperou = False
+    while True:
+        encontrada = _buscar_por_chaves(chaves, nome_usuario)
+        if encontrada is not None:
+            if esperou:
+                metricas.incrementar('unihelp_modelo_coalescidas_total')
+            return encontrada, None
+
+        with _trava_perguntas_em_andamento:
+            em_andamento = _perguntas_em_andamento.get(chave)
+            if em_andamento is None:
+                _perguntas_em_andamento[chave] = threading.Event()
+                return None, chave
+
+        # Se a outra requisição falhar, a próxima volta do laço assume a reserva
+        esperou = True
+        restante = limite - time.monotonic()
+        if restante <= 0 or not em_andamento.wait(restante):
+            return None, None
+
+
+def liberar_reserva(reserva):
+    if reserva is None:
+        return
+    with _trava_perguntas_em_andamento:
+        em_andamento = _perguntas_em_andamento.pop(reserva, None)
+    if em_andamento is not None:
+        em_andamento.set()
+
+
+# ============================================================================
+# MEDIÇÃO DAS REQUISIÇÕES E ENDPOINT /metrics
+# ============================================================================
+
+@app.before_request
+def _iniciar_medicao():
+    g.inicio_requisicao = time.perf_counter()
+
+
+@app.after_request
+def _registrar_requisicao(resposta):
+    inicio = g.get('inicio_requisicao')
+    if inicio is None:
+        return resposta
+
+    rota = request.url_rule.rule if request.url_rule else 'desconhecida'
+    duracao = time.perf_counter() - inicio
+    metricas.incrementar('unihelp_requisicoes_total', rota=rota, status=resposta.status_code)
+    metricas.observar('unihelp_requisicao_segundos', duracao, rota=rota)
+    registrar_evento('requisicao', logging.DEBUG, rota=rota, metodo=request.method,
+                     status=resposta.status_code, duracao_ms=round(duracao * 1000, 2))
+
+    if _inicializacao['primeira_requisicao'] is None:
+        _inicializacao['primeira_requisicao'] = duracao
+        registrar_evento('primeira_requisicao', rota=rota, duracao_ms=round(duracao * 1000, 2))
+    return resposta
+
+
+def _registrar_turno_chat(ra_usuario, origem):
+    """Resumo de um turno de chat: tempo de cada etapa e tamanhos do prompt e da resposta"""
+    registrar_evento('turno_chat', ra=ra_usuario, rota=request.path, origem=origem,
+                     duracao_ms=round((time.perf_counter() - g.inicio_requisicao) * 1000, 2),
+                     etapas_ms={k: round(v, 2) for k, v in g.get('etapas_ms', {}).items()},
+                     **g.get('tamanhos', {}))
+
+
+def _coletar_estatisticas():
+    amostras = []
+    for nome, cache in (('respostas', cache_respostas), ('prompt_sistema', cache_prompt_sistema)):
+        estatisticas = cache.estatisticas()
+        amostras.append(('unihelp_cache_acertos_total', 'counter', "Acertos dos caches em memória",
+                         {'cache': nome}, estatisticas['acertos'] + estatisticas.get('acertos_fuzzy', 0)))
+        amostras.append(('unihelp_cache_falhas_total', 'counter', "Falhas dos caches em memória",
+                         {'cache': nome}, estatisticas['falhas']))
+        amostras.append(('unihelp_cache_itens', 'gauge', "Itens guardados nos caches em memória",
+                         {'cache': nome}, estatisticas['itens']))
+
+    # O journal só existe no backend de texto, depois da primeira necessidade
+    escritor = _escritor_arquivos['atual']
+    if escritor is not None:
+        escritas = escritor.estatisticas()
+        amostras.append(('unihelp_escrita_lotes_total', 'counter', "Lotes gravados pelo escritor de arquivos",
+                         {}, escritas['lotes']))
+        amostras.append(('unihelp_escrita_registros_total', 'counter', "Registros gravados pelo escritor de arquivos",
+                         {}, escritas['registros']))
+        amostras.append(('unihelp_escrita_fsyncs_total', 'counter', "Fsyncs do journal de escritas",
+                         {}, escritas['fsyncs']))
+    amostras.append(('unihelp_modelo_fila', 'gauge', "Pedidos esperando vaga para chamar o modelo",
+                     {}, fila_chamadas_modelo.aguardando()))
+    base = base_conhecimento.atual()
+    amostras.append(('unihelp_base_conhecimento_versao', 'gauge',
+                     "Versão da base de conhecimento em uso (cresce a cada troca)", {}, base.numero))
+    amostras.append(('unihelp_base_conhecimento_bytes', 'gauge',
+                     "Tamanho da versão em uso da base de conhecimento", {}, base.tamanho))
+    for etapa, segundos in _inicializacao.items():
+        if segundos is not None:
+            amostras.append(('unihelp_inicializacao_segundos', 'gauge',
+                             "Importação do app, pré-aquecimento e primeira requisição deste processo",
+                             {'etapa': etapa}, segundos))
+    return amostras
+
+
+metricas.registrar_coletor(_coletar_estatisticas)
+
+
+@app.route('/metrics')
+def exportar_metricas():
+    if METRICAS_TOKEN and request.headers.get('Authorization') != f'Bearer {METRICAS_TOKEN}':
+        return '', 401
+    return Response(metricas.exportar(), mimetype='text/plain; version=0.0.4')
+
+
+@app.route('/admin/importar_alunos', methods=['POST'])
+def importar_alunos():
+    """
+    Importa a planilha da secretaria (campo "arquivo" do formulário ou o
+    próprio corpo em text/csv); ?validar=1 só confere as linhas
+    """
+    if not ADMIN_TOKEN:
+        return '', 404
+    if request.headers.get('Authorization') != f'Bearer {ADMIN_TOKEN}':
+        return '', 401
+
+    enviado = request.files.get('arquivo')
+    arquivo = io.TextIOWrapper(enviado.stream if enviado else request.stream, encoding='utf-8-sig', newline='')
+    try:
+        resumo = importar_planilha_alunos(arquivo, cache_dados_alunos(),
+                                          apenas_validar=request.args.get('validar') == '1')
+    except (ErroImportacao, UnicodeDecodeError) as e:
+        return jsonify({'erro': str(e), 'sucesso': False}), 400
+
+    return jsonify({'sucesso': True, **resumo})
 
 
 # ============================================================================
@@ -369,10 +4215,11 @@ def login():
         valido, usuario = validar_login(ra, senha)
 
         if valido:
+            session.pop('id_conversa', None)
             session['usuario_logado'] = ra
             session['nome_usuario'] = usuario['nome']
             session['curso_usuario'] = usuario['curso']
-            print(f"✅ Login realizado: {usuario['nome']} (RA: {ra})")
+            registrar_evento('login', ra=ra)
             return redirect(url_for('chat'))
         else:
             return render_template('login.html', erro='RA ou senha incorretos.')
@@ -406,6 +4253,12 @@ def cadastro():
         if buscar_usuario(dados['ra']):
             return render_template('cadastro.html', erro='RA já cadastrado no sistema!')
 
+        if repositorio_usuarios().buscar_por_email(dados['email']):
+            return render_template('cadastro.html', erro='E-mail já cadastrado no sistema!')
+
+        if repositorio_usuarios().buscar_por_cpf(dados['cpf']):
+            return render_template('cadastro.html', erro='CPF já cadastrado no sistema!')
+
         dados['senha_hash'] = hash_senha(dados['senha'])
         dados['data_cadastro'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
 
@@ -427,21 +4280,76 @@ def chat():
 
     ra_usuario = session['usuario_logado']
 
-    if 'historico' not in session:
-        prompt_sistema = construir_prompt_sistema(ra_usuario)
-        session['historico'] = [{"role": "system", "content": prompt_sistema}]
+    _, historico = _carregar_historico_conversa(ra_usuario)
 
     if request.method == 'POST':
         return redirect(url_for('chat'))
 
-    historico_para_exibir = [msg for msg in session.get('historico', []) if msg['role'] != 'system']
+    historico_para_exibir = [_mensagem_para_exibir(msg) for msg in historico if msg['role'] != 'system']
 
     return render_template('index.html', historico=historico_para_exibir)
 
 
+def _mensagem_para_exibir(msg):
+    """HTML da mensagem: respostas guardam o seu em 'html'; perguntas são escapadas"""
+    if msg['role'] == 'user':
+        conteudo = f"<p>{html.escape(msg['content'])}</p>"
+    else:
+        # Históricos antigos guardavam o HTML no próprio 'content'
+        conteudo = msg.get('html', msg['content'])
+    return {'role': msg['role'], 'content': conteudo}
+
+
+def _novo_historico(ra_usuario):
+    prompt_sistema = construir_prompt_sistema(ra_usuario)
+    return [{"role": "system", "content": prompt_sistema}]
+
+
+def _carregar_historico_conversa(ra_usuario):
+    """Busca o histórico da conversa atual no armazenamento, criando um novo se preciso"""
+    id_conversa = session.get('id_conversa')
+    historico = armazenamento_conversas().obter(id_conversa) if id_conversa else None
+
+    if historico is None:
+        id_conversa = uuid.uuid4().hex
+        session['id_conversa'] = id_conversa
+        historico = _novo_historico(ra_usuario)
+        armazenamento_conversas().salvar(id_conversa, historico)
+
+    return id_conversa, historico
+
+
+def _limitar_historico(ra_usuario, historico):
+    return ajustar_janela_historico(historico, lambda: construir_prompt_sistema(ra_usuario))
+
+
+def _concluir_turno(id_conversa, ra_usuario, historico):
+    """Corta o histórico, salva no armazenamento e alinha o objeto de chat do modelo"""
+    historico = _limitar_historico(ra_usuario, historico)
+    armazenamento_conversas().salvar(id_conversa, historico)
+    gerenciador_sessoes_chat.sincronizar(id_conversa, historico)
+
+
+def _resposta_pronta(ra_usuario, nome_usuario, pergunta, historico):
+    """
+    (resposta, origem, reserva): resposta direta das tabelas ou do cache, ou
+    None com a reserva para chamar o modelo (ver buscar_ou_reservar_resposta)
+    """
+    direta = responder_diretamente(ra_usuario, nome_usuario, pergunta)
+    if direta is not None:
+        return direta, 'direta', None
+
+    em_cache, reserva = buscar_ou_reservar_resposta(ra_usuario, nome_usuario, pergunta, historico)
+    return em_cache, 'cache' if em_cache else 'modelo', reserva
+
+
+def _evento_sse(dados):
+    return f"data: {json.dumps(dados, ensure_ascii=False)}\n\n"
+
+
 @app.route('/enviar_mensagem', methods=['POST'])
 def enviar_mensagem():
-    """Rota que processa mensagens com efeito de streaming"""
+    """Rota que processa mensagens e devolve a resposta completa em JSON"""
     if 'usuario_logado' not in session:
         return jsonify({'erro': 'Não autorizado'}), 401
 
@@ -452,100 +4360,261 @@ def enviar_mensagem():
     if not pergunta:
         return jsonify({'erro': 'Pergunta vazia'}), 400
 
-    if 'historico' not in session:
-        prompt_sistema = construir_prompt_sistema(ra_usuario)
-        session['historico'] = [{"role": "system", "content": prompt_sistema}]
+    id_conversa, historico = _carregar_historico_conversa(ra_usuario)
+    nome_usuario = session.get('nome_usuario', '')
 
     # Adiciona pergunta ao histórico
-    session['historico'].append({"role": "user", "content": pergunta})
+    historico.append({"role": "user", "content": pergunta})
 
-    # Obtém resposta COMPLETA (sem streaming no backend por enquanto)
-    resposta_texto = obter_resposta_gemini(session['historico'])
-
-    # Formata a resposta
-    resposta_formatada = formatar_resposta(resposta_texto)
+    pronta, origem, reserva = _resposta_pronta(ra_usuario, nome_usuario, pergunta, historico)
+    try:
+        if pronta:
+            resposta_texto, resposta_formatada = pronta
+            gerenciador_sessoes_chat.registrar_turno(id_conversa, historico, resposta_texto)
+        else:
+            # Obtém resposta COMPLETA; erro do modelo não vira resposta nem entra no histórico
+            try:
+                resposta_texto = obter_resposta_gemini(mensagens_com_contexto(historico), id_conversa, ra_usuario)
+            except ErroModelo as e:
+                return jsonify({'erro': e.mensagem, 'sucesso': False}), 503
+
+            # Formata a resposta
+            resposta_formatada = formatar_resposta(resposta_texto)
+            guardar_resposta_em_cache(ra_usuario, nome_usuario, pergunta, historico, resposta_texto,
+                                      resposta_formatada)
+    finally:
+        liberar_reserva(reserva)
 
     # Adiciona ao histórico
-    session['historico'].append({"role": "assistant", "content": resposta_formatada})
+    historico.append({"role": "assistant", "content": resposta_texto, "html": resposta_formatada})
 
     # Salva a conversa
     salvar_conversa(ra_usuario, pergunta, resposta_formatada)
 
     # Limita histórico
-    if len(session['historico']) > 9:
-        prompt_sistema = construir_prompt_sistema(ra_usuario)
-        session['historico'] = [{"role": "system", "content": prompt_sistema}] + session['historico'][-8:]
+    _concluir_turno(id_conversa, ra_usuario, historico)
+    _registrar_turno_chat(ra_usuario, origem)
 
-    session.modified = True
-
-    # Retorna a resposta completa para o JavaScript simular o streaming
     return jsonify({
         'resposta': resposta_formatada,
         'sucesso': True
     })
 
 
+@app.route('/enviar_mensagem_stream', methods=['POST'])
+def enviar_mensagem_stream():
+    """Rota que envia a resposta via Server-Sent Events, linha a linha, conforme o modelo gera"""
+    if 'usuario_logado' not in session:
+        return jsonify({'erro': 'Não autorizado'}), 401
+
+    ra_usuario = session['usuario_logado']
+    data = request.get_json()
+    pergunta = data.get('pergunta', '').strip()
+
+    if not pergunta:
+        return jsonify({'erro': 'Pergunta vazia'}), 400
+
+    id_conversa, historico = _carregar_historico_conversa(ra_usuario)
+    nome_usuario = session.get('nome_usuario', '')
+    historico.append({"role": "user", "content": pergunta})
+
+    def gerar():
+        partes_texto = []
+        partes_html = []
+
+        pronta, origem, reserva = _resposta_pronta(ra_usuario, nome_usuario, pergunta, historico)
+        try:
+            if pronta:
+                resposta_texto, resposta_formatada = pronta
+                for linha_html in resposta_formatada.split('\n'):
+                    yield _evento_sse({'html': linha_html})
+                gerenciador_sessoes_chat.registrar_turno(id_conversa, historico, resposta_texto)
+            else:
+                pedacos = obter_resposta_gemini_stream(mensagens_com_contexto(historico), id_conversa, ra_usuario)
+                try:
+                    for texto, linha_html in formatar_resposta_incremental(pedacos):
+                        partes_texto.append(texto)
+                        if linha_html:
+                            partes_html.append(linha_html)
+                            yield _evento_sse({'html': linha_html})
+                except ErroModelo as e:
+                    # Mostra o erro ao aluno, mas a resposta (parcial) não entra no histórico
+                    yield _evento_sse({'html': f'<p class="erro">❌ {html.escape(e.mensagem)}</p>'})
+                    yield _evento_sse({'fim': True})
+                    return
+
+                resposta_texto = ''.join(partes_texto)
+                resposta_formatada = '\n'.join(partes_html)
+                guardar_resposta_em_cache(ra_usuario, nome_usuario, pergunta, historico, resposta_texto,
+                                          resposta_formatada)
+        finally:
+            liberar_reserva(reserva)
+
+        # Stream concluído: registra a resposta completa uma única vez
+        historico.append({"role": "assistant", "content": resposta_texto, "html": resposta_formatada})
+        salvar_conversa(ra_usuario, pergunta, resposta_formatada)
+        _concluir_turno(id_conversa, ra_usuario, historico)
+        _registrar_turno_chat(ra_usuario, origem)
+
+        yield _evento_sse({'fim': True})
+
+    # stream_with_context mantém `g` durante o stream, para o log do turno
+    return Response(stream_with_context(gerar()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
 @app.route('/historico')
 def historico():
     if 'usuario_logado' not in session:
         return redirect(url_for('login'))
 
     ra_usuario = session['usuario_logado']
-    conversas = carregar_historico_aluno(ra_usuario, limite=50)
+    busca = request.args.get('busca', '').strip()
+    try:
+        conversas, proximo = pagina_historico(ra_usuario, request.args.get('antes'), busca)
+    except ValueError:
+        return redirect(url_for('historico', busca=busca or None))
 
-    return render_template('historico.html', conversas=conversas)
+    return render_template('historico.html', conversas=conversas, proximo=proximo, busca=busca)
+
+
+@app.route('/historico/pagina')
+def historico_pagina():
+    """Página seguinte do histórico já renderizada, para o carregamento sob demanda"""
+    if 'usuario_logado' not in session:
+        return jsonify({'erro': 'Não autorizado'}), 401
+
+    ra_usuario = session['usuario_logado']
+    busca = request.args.get('busca', '').strip()
+    try:
+        conversas, proximo = pagina_historico(ra_usuario, request.args.get('antes'), busca)
+    except ValueError:
+        return jsonify({'erro': 'Cursor inválido'}), 400
+
+    return jsonify({'html': render_template('_conversas.html', conversas=conversas), 'proximo': proximo})
 
 
 @app.route('/limpar', methods=['POST'])
 def limpar_historico():
     ra_usuario = session.get('usuario_logado')
-    session.pop('historico', None)
+    id_conversa = session.pop('id_conversa', None)
+
+    if id_conversa:
+        armazenamento_conversas().remover(id_conversa)
+        gerenciador_sessoes_chat.remover(id_conversa)
 
     if ra_usuario:
-        prompt_sistema = construir_prompt_sistema(ra_usuario)
-        session['historico'] = [{"role": "system", "content": prompt_sistema}]
+        _carregar_historico_conversa(ra_usuario)
 
-    print("INFO: Histórico limpo pelo usuário")
+    registrar_evento('historico_limpo', ra=ra_usuario)
     return '', 204
 
 
 @app.route('/logout')
 def logout():
-    nome = session.get('nome_usuario', 'Usuário')
-    print(f"👋 Logout: {nome}")
+    id_conversa = session.get('id_conversa')
+    if id_conversa:
+        armazenamento_conversas().remover(id_conversa)
+        gerenciador_sessoes_chat.remover(id_conversa)
+
+    registrar_evento('logout', ra=session.get('usuario_logado'))
     session.clear()
     return redirect(url_for('login'))
 
 
 # ============================================================================
-# INICIALIZAÇÃO DO SERVIDOR
+# INICIALIZAÇÃO: FÁBRICA DO APP, PRÉ-AQUECIMENTO E FORK
 # ============================================================================
+# Importar o app não lê a base de conhecimento, não carrega o cliente do modelo
+# e não toca nos arquivos de dados (chave secreta, journal, repositórios,
+# migração do histórico antigo). criar_app() faz isso uma única vez. No gunicorn com preload_app ela roda no
+# processo mestre, antes do fork, e os workers herdam a base já analisada, os
+# índices de usuários e do histórico e o cliente do modelo (copy-on-write);
+# reiniciar_apos_fork() recria em cada worker só o que não pode ser herdado.
+
+_inicializacao = {'importacao': time.perf_counter() - _INICIO_IMPORTACAO, 'preaquecimento': None,
+                  'primeira_requisicao': None}
+
+
+def preaquecer():
+    """Lê e analisa a base de conhecimento (texto, índice BM25, tabelas) e carrega o cliente do modelo"""
+    inicio = time.perf_counter()
+    base = base_conhecimento.atual()
+    cliente_gemini()
+    _inicializacao['preaquecimento'] = time.perf_counter() - inicio
+    return base
+
+
+def criar_app(preaquecer_agora=True):
+    """Ponto de entrada do servidor (wsgi.py e modo de desenvolvimento)"""
+    app.secret_key = _carregar_chave_secreta()
+    # Journal (com a recuperação), repositórios e migração do histórico antigo
+    usuarios, _, historico, _ = _repositorios_atuais()
+    migrar_historico_antigo()
+    armazenamento_conversas()
+
+    campos = {}
+    if preaquecer_agora:
+        base = preaquecer()
+        campos = {'preaquecimento_ms': round(_inicializacao['preaquecimento'] * 1000, 2),
+                  'base_versao': base.numero, 'base_bytes': base.tamanho,
+                  'base_secoes': len(base.secoes), 'base_trechos': len(base.indice.trechos)}
+        # O que já foi carregado sai da coleta de lixo: o GC dos workers não
+        # mexe nesses objetos e as páginas continuam compartilhadas com o mestre
+        gc.freeze()
+
+    registrar_evento('inicializacao', importacao_ms=round(_inicializacao['importacao'] * 1000, 2),
+                     usuarios=usuarios.total(), conversas=historico.total_registros(), **campos)
+    return app
+
+
+def reiniciar_apos_fork():
+    """Chamado em cada worker logo depois do fork (hook post_fork do gunicorn)"""
+    global log
+    # A thread de log, o descritor do journal (flock) e as conexões SQLite não sobrevivem ao fork
+    log = _configurar_log()
+    # Só o que já foi criado no mestre; o resto é criado no próprio worker
+    if _escritor_arquivos['atual'] is not None:
+        _escritor_arquivos['atual'].reabrir()
+    if hasattr(_armazenamento_conversas['atual'], 'reabrir'):
+        _armazenamento_conversas['atual'].reabrir()
+    for repositorio in (_repositorios['atuais'] or ())[:3]:
+        pool = getattr(repositorio, 'pool', None)
+        if pool is not None:
+            pool.reabrir()
+
 
 if __name__ == '__main__':
     print("=" * 70)
     print("🎓 SISTEMA UNIHELP - ASSISTENTE PERSONALIZADA")
     print("=" * 70)
-    print(f"✅ Modelo IA: {modelo_gemini.model_name}")
+    print(f"✅ Modelo IA: {NOME_MODELO_GEMINI}")
     print(f"✅ Base de conhecimento: {NOME_ARQUIVO_CONTEXTO}")
-    print(f"✅ Banco de usuários: {NOME_ARQUIVO_USUARIOS}")
-    print(f"✅ Dados personalizados: {NOME_ARQUIVO_DADOS_ALUNOS}")
-    print(f"✅ Histórico de conversas: {NOME_ARQUIVO_HISTORICO}")
-
-    contexto = carregar_contexto()
-    print(f"✅ Contexto carregado: {len(contexto)} caracteres")
-
-    if os.path.exists(NOME_ARQUIVO_USUARIOS):
-        with open(NOME_ARQUIVO_USUARIOS, 'r', encoding='utf-8') as f:
-            usuarios = [l for l in f if not l.startswith('#') and l.strip()]
-            print(f"✅ Usuários cadastrados: {len(usuarios)}")
+    if ARMAZENAMENTO_BACKEND == 'sqlite':
+        print(f"✅ Usuários, dados e histórico: {ARMAZENAMENTO_ARQUIVO_SQLITE} (SQLite)")
+    else:
+        print(f"✅ Banco de usuários: {NOME_ARQUIVO_USUARIOS}")
+        print(f"✅ Dados personalizados: {NOME_ARQUIVO_DADOS_ALUNOS}")
+        print(f"✅ Histórico de conversas: {NOME_DIRETORIO_HISTORICO}/")
+    print(f"✅ Conversas no histórico: {log_conversas().total_registros()}")
+
+    criar_app()
+    base = base_conhecimento.atual()
+    print(f"✅ Contexto carregado: {base.tamanho} bytes, {len(base.secoes)} seções, {len(base.indice.trechos)} trechos "
+          f"(importação {_inicializacao['importacao']:.2f}s, pré-aquecimento {_inicializacao['preaquecimento']:.2f}s)")
+
+    total_usuarios = repositorio_usuarios().total()
+    if total_usuarios:
+        print(f"✅ Usuários cadastrados: {total_usuarios}")
     else:
         print("⚠️  Nenhum usuário cadastrado ainda")
 
     print("\n🌐 Servidor iniciado em: http://localhost:5000")
     print("   • /login     → Tela de login")
     print("   • /cadastro  → Tela de cadastro")
-    print("   • /chat      → Chat com efeito de digitação")
+    print("   • /chat      → Chat com respostas em streaming")
     print("   • /historico → Ver histórico de conversas")
+    print("   (modo de desenvolvimento; em produção use: gunicorn -c gunicorn.conf.py wsgi:app)")
     print("=" * 70)
 
     app.run(debug=True)
\ No newline at end of file
@@ -0,0 +1,430 @@
+# ============================================================================
+# TESTE DE CARGA / BENCHMARK DAS ROTAS - UNIHELP
+# ============================================================================
+# Gera usuários, dados dos alunos e histórico sintéticos (10^3 a 10^6
+# registros) em um diretório temporário, troca o Gemini por um modelo falso
+# local (latência e tokens por segundo configuráveis) e dispara alunos
+# virtuais em paralelo contra /login, /enviar_mensagem, /enviar_mensagem_stream
+# e /historico (com e sem busca). Mostra p50/p95/p99 e requisições por segundo de cada rota e
+# salva o resultado em JSON para comparar com execuções anteriores.
+#
+# Uso:
+#   python benchmark_carga.py --registros 10000 --concorrencia 16
+#   python benchmark_carga.py --escalas 1000,10000,100000,1000000
+#   python benchmark_carga.py --registros 10000 --comparar resultados_benchmark/carga_....json
+
+import os
+import sys
+import json
+import time
+import atexit
+import random
+import shutil
+import hashlib
+import argparse
+import platform
+import tempfile
+import threading
+import subprocess
+from datetime import datetime
+
+DIRETORIO_PROJETO = os.path.dirname(os.path.abspath(__file__))
+DIRETORIO_RESULTADOS = os.path.join(DIRETORIO_PROJETO, 'resultados_benchmark')
+SENHA_PADRAO = 'senha123'
+
+PERGUNTAS = [
+    "Quais são as minhas notas?",
+    "Qual é o meu grupo?",
+    "Como está o meu histórico?",
+    "Quais os materiais da semana {n}?",
+    "O que vai cair na prova do ciclo {c}?",
+    "Quando é a entrega do projeto integrador?",
+    "Me explique o conteúdo da semana {n}",
+    "Qual a diferença entre AFE e VRAU?",
+    "Tem vídeo sobre o tema da semana {n}?",
+    "Como funciona a avaliação 360?",
+]
+
+
+# ============================================================================
+# MODELO FALSO (SUBSTITUI O GEMINI)
+# ============================================================================
+
+class _TextoFalso:
+    def __init__(self, text):
+        self.text = text
+
+
+class ErroCotaFalso(Exception):
+    """Imita o 429 da API (mesmo atributo `code` das exceções do google.api_core)"""
+    code = 429
+
+
+class ChatFalso:
+    def __init__(self, modelo, history):
+        self.modelo = modelo
+        self.history = list(history or [])
+
+    def send_message(self, mensagem, stream=False, request_options=None):
+        if self.modelo.aleatorio.random() < self.modelo.taxa_erro:
+            time.sleep(self.modelo.latencia)
+            raise ErroCotaFalso("429 Resource has been exhausted (e.g. check quota).")
+
+        self.history.append({'role': 'user', 'parts': [mensagem]})
+        pedacos = self.modelo.gerar_pedacos()
+
+        if not stream:
+            texto = ''.join(pedacos)
+            time.sleep(self.modelo.latencia + self.modelo.tokens_resposta / self.modelo.tokens_por_segundo)
+            self.history.append({'role': 'model', 'parts': [texto]})
+            return _TextoFalso(texto)
+
+        return self._stream(pedacos)
+
+    def _stream(self, pedacos):
+        time.sleep(self.modelo.latencia)
+        espera = self.modelo.tokens_por_pedaco / self.modelo.tokens_por_segundo
+        for pedaco in pedacos:
+            time.sleep(espera)
+            yield _TextoFalso(pedaco)
+        self.history.append({'role': 'model', 'parts': [''.join(pedacos)]})
+
+
+class ModeloFalso:
+    """Mesma interface usada do genai.GenerativeModel: start_chat() e send_message()"""
+
+    def __init__(self, instrucao_sistema, latencia, tokens_por_segundo, tokens_resposta, tokens_por_pedaco=20,
+                 taxa_erro=0.0):
+        self.instrucao_sistema = instrucao_sistema
+        self.taxa_erro = taxa_erro
+        self.aleatorio = random.Random()
+        self.latencia = latencia
+        self.tokens_por_segundo = tokens_por_segundo
+        self.tokens_resposta = tokens_resposta
+        self.tokens_por_pedaco = tokens_por_pedaco
+
+    def start_chat(self, history=None):
+        return ChatFalso(self, history)
+
+    def gerar_pedacos(self):
+        """Resposta no formato do assistente (~4 caracteres por token), em pedaços"""
+        linhas = ["Olá! Aqui está o que encontrei para você:", "[CICLO_1]", "[SEMANA_2] Algoritmos"]
+        i = 0
+        while sum(len(l) + 1 for l in linhas) < self.tokens_resposta * 4:
+            if i % 3 == 0:
+                linhas.append(f"[MAT_VIDEO] Aula {i} - Estruturas de dados e complexidade")
+                linhas.append(f"[LINK] https://drive.google.com/file/d/{i:08d}/view")
+            else:
+                linhas.append(f"Ponto {i}: revise os exemplos resolvidos e os exercícios da lista.")
+            i += 1
+        texto = '\n'.join(linhas)
+        tamanho = self.tokens_por_pedaco * 4
+        return [texto[j:j + tamanho] for j in range(0, len(texto), tamanho)]
+
+
+def fabrica_modelo_falso(latencia, tokens_por_segundo, tokens_resposta, taxa_erro=0.0):
+    return lambda instrucao_sistema: ModeloFalso(instrucao_sistema, latencia, tokens_por_segundo, tokens_resposta,
+                                                 taxa_erro=taxa_erro)
+
+
+# ============================================================================
+# GERADORES DE DADOS SINTÉTICOS
+# ============================================================================
+
+def ra_sintetico(i):
+    return str(100000 + i)
+
+
+def gerar_usuarios(caminho, quantidade):
+    senha_hash = hashlib.sha256(SENHA_PADRAO.encode()).hexdigest()
+    with open(caminho, 'w', encoding='utf-8') as f:
+        f.write("# ============================================\n")
+        f.write("# BANCO DE DADOS DE USUÁRIOS - UNIHELP\n")
+        f.write("# ============================================\n")
+        f.write("# Estrutura: RA|NOME|EMAIL|CPF|CURSO|SENHA_HASH|DATA_CADASTRO\n")
+        f.write("# " + "=" * 80 + "\n\n")
+        for i in range(quantidade):
+            f.write(f"{ra_sintetico(i)}|Aluno Sintético {i}|aluno{i}@exemplo.com|{i:011d}|"
+                    f"Inteligência Artificial|{senha_hash}|2025-01-01 00:00:00\n")
+
+
+def gerar_dados_alunos(caminho, quantidade, aleatorio):
+    with open(caminho, 'w', encoding='utf-8') as f:
+        f.write("# ============================================\n")
+        f.write("# DADOS PERSONALIZADOS DOS ALUNOS - UNIHELP\n")
+        f.write("# ============================================\n\n")
+        for i in range(quantidade):
+            notas = [aleatorio.uniform(0, 10) for _ in range(4)]
+            f.write(f"\n[RA:{ra_sintetico(i)}]\n"
+                    f"NOME: Aluno Sintético {i}\n"
+                    "CURSO: Inteligência Artificial\n"
+                    f"GRUPO: Grupo {i % 50 + 1}\n\n"
+                    "NOTAS:\n"
+                    f"Ciclo 1|AFE - Avaliação Final de entrega|{notas[0]:.2f}\n"
+                    f"Ciclo 1|VRAU - Verificação Regular|{notas[1]:.2f}\n"
+                    f"Ciclo 1|PI - Projeto Integrador|{notas[2]:.2f}\n"
+                    f"Ciclo 1|Avaliação 360°|{notas[3]:.2f}\n\n"
+                    "HISTORICO:\n"
+                    "Cidadania ética e espiritualidade|1|8.5|Aprovado\n"
+                    "Introdução a engenharia de soluções|1|7.0|Aprovado\n"
+                    "Fundamentos de engenharia de dados|2|0.0|Cursando\n"
+                    "[FIM]\n\n")
+
+
+def gerar_historico(caminho, quantidade, alunos, aleatorio):
+    with open(caminho, 'w', encoding='utf-8') as f:
+        for i in range(quantidade):
+            ra = ra_sintetico(aleatorio.randrange(alunos))
+            f.write(f"[RA:{ra}|DATA:2025-01-01 00:00:00]\n"
+                    f"PERGUNTA: {aleatorio.choice(PERGUNTAS).format(n=i % 20 + 1, c=i % 4 + 1)}\n"
+                    f"RESPOSTA: <p>Resposta sintética número {i}.</p>\n"
+                    "[FIM_CONVERSA]\n\n")
+
+
+def preparar_diretorio(diretorio, registros, conversas, semente):
+    aleatorio = random.Random(semente)
+    os.makedirs(diretorio, exist_ok=True)
+    shutil.copy(os.path.join(DIRETORIO_PROJETO, 'banco_dados.txt'), diretorio)
+
+    inicio = time.perf_counter()
+    gerar_usuarios(os.path.join(diretorio, 'usuarios.txt'), registros)
+    gerar_dados_alunos(os.path.join(diretorio, 'dados_alunos.txt'), registros, aleatorio)
+    gerar_historico(os.path.join(diretorio, 'historico_conversas.txt'), conversas, registros, aleatorio)
+    return time.perf_counter() - inicio
+
+
+# ============================================================================
+# EXECUÇÃO DA CARGA
+# ============================================================================
+
+def percentil(valores, p):
+    if not valores:
+        return 0.0
+    ordenados = sorted(valores)
+    indice = min(len(ordenados) - 1, max(0, int(round(p / 100 * len(ordenados) + 0.5)) - 1))
+    return ordenados[indice]
+
+
+def aluno_virtual(app_flask, ra, opcoes, aleatorio, medicoes, trava):
+    cliente = app_flask.test_client()
+
+    def medir(rota, funcao):
+        inicio = time.perf_counter()
+        resposta = funcao()
+        if rota == '/enviar_mensagem_stream':
+            resposta.get_data()  # consome o stream inteiro
+        duracao = time.perf_counter() - inicio
+        with trava:
+            medicoes.append((rota, duracao, resposta.status_code))
+        return resposta
+
+    medir('/login', lambda: cliente.post('/login', data={'ra': ra, 'password': SENHA_PADRAO}))
+
+    for _ in range(opcoes.mensagens):
+        pergunta = aleatorio.choice(PERGUNTAS).format(n=aleatorio.randint(1, 20), c=aleatorio.randint(1, 4))
+        rota = '/enviar_mensagem_stream' if aleatorio.random() < opcoes.fracao_stream else '/enviar_mensagem'
+        medir(rota, lambda: cliente.post(rota, json={'pergunta': pergunta}))
+
+    medir('/historico', lambda: cliente.get('/historico'))
+    medir('/historico?busca', lambda: cliente.get('/historico', query_string={'busca': 'prazo'}))
+
+
+def executar_carga(opcoes):
+    diretorio = opcoes.diretorio or tempfile.mkdtemp(prefix='unihelp_carga_')
+    conversas = opcoes.conversas if opcoes.conversas is not None else opcoes.registros * 5
+    tempo_geracao = preparar_diretorio(diretorio, opcoes.registros, conversas, opcoes.semente)
+
+    os.chdir(diretorio)
+    if not opcoes.diretorio:
+        # Registrado antes de importar o app: roda depois dos atexit dele
+        atexit.register(shutil.rmtree, diretorio, True)
+    os.environ.setdefault('UNIHELP_SECRET_KEY', 'benchmark')
+    os.environ.setdefault('UNIHELP_LOG_NIVEL', 'WARNING')
+    sys.path.insert(0, DIRETORIO_PROJETO)
+
+    saida_original = sys.stdout
+    sys.stdout = open(os.devnull, 'w', encoding='utf-8')  # os prints do app não entram na medição
+    try:
+        inicio = time.perf_counter()
+        import app as modulo_app
+        tempo_importacao = time.perf_counter() - inicio
+
+        if opcoes.backend == 'sqlite':
+            pool = modulo_app.PoolConexoesSQLite(modulo_app.ARMAZENAMENTO_ARQUIVO_SQLITE, 1)
+            modulo_app.importar_para_sqlite(pool, modulo_app.repositorio_usuarios(),
+                                            modulo_app.cache_dados_alunos(), modulo_app.log_conversas())
+            pool.fechar()
+            modulo_app.usar_repositorios(*modulo_app.criar_repositorios('sqlite'))
+
+        modulo_app.criar_app(preaquecer_agora=False)
+
+        modulo_app.gerenciador_sessoes_chat.criar_modelo = fabrica_modelo_falso(
+            opcoes.latencia_modelo, opcoes.tokens_por_segundo, opcoes.tokens_resposta, opcoes.taxa_erro_modelo)
+
+        aleatorio = random.Random(opcoes.semente)
+        ras = [ra_sintetico(aleatorio.randrange(opcoes.registros)) for _ in range(opcoes.alunos)]
+        medicoes = []
+        trava = threading.Lock()
+        fila = list(enumerate(ras))
+        trava_fila = threading.Lock()
+
+        def trabalhador():
+            while True:
+                with trava_fila:
+                    if not fila:
+                        return
+                    i, ra = fila.pop()
+                aluno_virtual(modulo_app.app, ra, opcoes, random.Random(opcoes.semente + i), medicoes, trava)
+
+        inicio = time.perf_counter()
+        threads = [threading.Thread(target=trabalhador) for _ in range(opcoes.concorrencia)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        duracao = time.perf_counter() - inicio
+
+        estatisticas_cache = modulo_app.cache_respostas.estatisticas()
+    finally:
+        sys.stdout.close()
+        sys.stdout = saida_original
+
+    rotas = {}
+    for rota in sorted({m[0] for m in medicoes}):
+        tempos = [m[1] for m in medicoes if m[0] == rota]
+        erros = sum(1 for m in medicoes if m[0] == rota and m[2] >= 400)
+        rotas[rota] = {
+            'requisicoes': len(tempos),
+            'erros': erros,
+            'p50_ms': percentil(tempos, 50) * 1e3,
+            'p95_ms': percentil(tempos, 95) * 1e3,
+            'p99_ms': percentil(tempos, 99) * 1e3,
+            'media_ms': sum(tempos) / len(tempos) * 1e3,
+            'rps': len(tempos) / duracao,
+        }
+
+    return {
+        'data': datetime.now().isoformat(timespec='seconds'),
+        'ambiente': {'python': platform.python_version(), 'plataforma': platform.platform()},
+        'parametros': {
+            'registros': opcoes.registros, 'conversas': conversas, 'backend': opcoes.backend,
+            'alunos': opcoes.alunos, 'mensagens': opcoes.mensagens, 'concorrencia': opcoes.concorrencia,
+            'fracao_stream': opcoes.fracao_stream, 'latencia_modelo': opcoes.latencia_modelo,
+            'tokens_por_segundo': opcoes.tokens_por_segundo, 'tokens_resposta': opcoes.tokens_resposta,
+            'taxa_erro_modelo': opcoes.taxa_erro_modelo, 'semente': opcoes.semente,
+        },
+        'tempo_geracao_dados_s': tempo_geracao,
+        'tempo_importacao_app_s': tempo_importacao,
+        'duracao_s': duracao,
+        'rps_total': len(medicoes) / duracao,
+        'cache_respostas': estatisticas_cache,
+        'rotas': rotas,
+    }
+
+
+# ============================================================================
+# RELATÓRIO E COMPARAÇÃO
+# ============================================================================
+
+def imprimir_resultado(resultado):
+    p = resultado['parametros']
+    print("=" * 86)
+    print(f"Registros: {p['registros']} | conversas: {p['conversas']} | backend: {p['backend']} | "
+          f"concorrência: {p['concorrencia']} | modelo falso: {p['latencia_modelo']}s + "
+          f"{p['tokens_resposta']} tokens a {p['tokens_por_segundo']}/s")
+    print(f"Importação do app: {resultado['tempo_importacao_app_s']:.2f}s | "
+          f"carga: {resultado['duracao_s']:.2f}s | {resultado['rps_total']:.1f} req/s no total")
+    print("=" * 86)
+    print(f"{'rota':<26}{'req':>7}{'erros':>7}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'req/s':>10}")
+    for rota, r in resultado['rotas'].items():
+        print(f"{rota:<26}{r['requisicoes']:>7}{r['erros']:>7}{r['p50_ms']:>10.1f}{r['p95_ms']:>10.1f}"
+              f"{r['p99_ms']:>10.1f}{r['rps']:>10.1f}")
+
+
+def comparar(resultado, caminho_anterior, tolerancia):
+    with open(caminho_anterior, 'r', encoding='utf-8') as f:
+        anterior = json.load(f)
+
+    print(f"\nComparação com {caminho_anterior} (p95; tolerância {tolerancia:.0%}):")
+    regressoes = 0
+    for rota, r in resultado['rotas'].items():
+        antes = anterior.get('rotas', {}).get(rota)
+        if not antes or not antes['p95_ms']:
+            print(f"  {rota:<26} sem referência")
+            continue
+        variacao = r['p95_ms'] / antes['p95_ms'] - 1
+        marca = "⚠️  regressão" if variacao > tolerancia else "ok"
+        regressoes += variacao > tolerancia
+        print(f"  {rota:<26}{antes['p95_ms']:>10.1f} → {r['p95_ms']:>8.1f} ms ({variacao:+.0%})  {marca}")
+    return regressoes
+
+
+def salvar_resultado(resultado, destino=None):
+    if destino is None:
+        os.makedirs(DIRETORIO_RESULTADOS, exist_ok=True)
+        nome = f"carga_{resultado['parametros']['registros']}_{datetime.now():%Y%m%d_%H%M%S}.json"
+        destino = os.path.join(DIRETORIO_RESULTADOS, nome)
+    with open(destino, 'w', encoding='utf-8') as f:
+        json.dump(resultado, f, ensure_ascii=False, indent=2)
+    return destino
+
+
+def executar_escalas(opcoes, argumentos):
+    """Roda cada escala em um processo novo (o app carrega os dados na importação)"""
+    base = []
+    pular = False
+    for i, argumento in enumerate(argumentos):
+        if pular:
+            pular = False
+            continue
+        if argumento in ('--escalas', '--registros', '--conversas', '--comparar'):
+            pular = True
+            continue
+        if argumento.startswith(('--escalas=', '--registros=', '--conversas=', '--comparar=')):
+            continue
+        base.append(argumento)
+
+    for registros in [int(e) for e in opcoes.escalas.split(',')]:
+        print(f"\n▶ Escala: {registros} registros")
+        comando = [sys.executable, os.path.abspath(__file__), '--registros', str(registros)] + base
+        if subprocess.call(comando) != 0:
+            print(f"❌ Escala {registros} falhou")
+
+
+def main(argumentos):
+    parser = argparse.ArgumentParser(description="Teste de carga das rotas do UniHelp com modelo falso")
+    parser.add_argument('--registros', type=int, default=1000, help="usuários/alunos sintéticos")
+    parser.add_argument('--conversas', type=int, default=None, help="conversas no histórico (padrão: 5x registros)")
+    parser.add_argument('--escalas', help="lista de registros, ex.: 1000,10000,100000,1000000")
+    parser.add_argument('--backend', choices=['texto', 'sqlite'], default='texto')
+    parser.add_argument('--alunos', type=int, default=100, help="alunos virtuais (sessões)")
+    parser.add_argument('--mensagens', type=int, default=3, help="mensagens por aluno virtual")
+    parser.add_argument('--concorrencia', type=int, default=16)
+    parser.add_argument('--fracao-stream', type=float, default=0.5, help="fração das mensagens via streaming")
+    parser.add_argument('--latencia-modelo', type=float, default=0.2, help="segundos até o primeiro token")
+    parser.add_argument('--tokens-por-segundo', type=float, default=400)
+    parser.add_argument('--tokens-resposta', type=int, default=200)
+    parser.add_argument('--taxa-erro-modelo', type=float, default=0.0,
+                        help="fração das chamadas em que o modelo falso devolve 429")
+    parser.add_argument('--semente', type=int, default=42)
+    parser.add_argument('--diretorio', help="onde gerar os dados (mantido depois); padrão: temporário")
+    parser.add_argument('--saida', help="arquivo JSON do resultado (padrão: resultados_benchmark/)")
+    parser.add_argument('--comparar', help="JSON de uma execução anterior para comparar")
+    parser.add_argument('--tolerancia', type=float, default=0.2, help="piora de p95 aceita na comparação")
+    opcoes = parser.parse_args(argumentos)
+
+    if opcoes.escalas:
+        executar_escalas(opcoes, argumentos)
+        return 0
+
+    resultado = executar_carga(opcoes)
+    imprimir_resultado(resultado)
+    print(f"\n💾 Resultado salvo em: {salvar_resultado(resultado, opcoes.saida)}")
+
+    if opcoes.comparar:
+        return 1 if comparar(resultado, opcoes.comparar, opcoes.tolerancia) else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,123 @@
+# ============================================================================
+# MICRO-BENCHMARK DO FORMATADOR DE RESPOSTAS - UNIHELP
+# ============================================================================
+# Compara o formatar_resposta atual (passada única, padrão compilado) com a
+# versão anterior (vários replace/re.sub sobre o texto inteiro) em respostas
+# grandes, cheias de materiais, e também o modo incremental usado no streaming
+# (que antes rodava o formatador inteiro em cada linha).
+#
+# Uso: python benchmark_formatador.py [--materiais 300] [--repeticoes 200]
+
+import re
+import sys
+import timeit
+import argparse
+
+from app import formatar_resposta, formatar_resposta_incremental
+
+
+def formatar_resposta_original(texto):
+    """Versão anterior do formatador, mantida aqui só para comparação"""
+    import re
+
+    texto = texto.replace('***', '').replace('**', '').replace('*', '')
+
+    texto = re.sub(r'\[CICLO_(\d+)\]', r'<div class="ciclo-header">📚 CICLO \1</div>', texto)
+    texto = re.sub(r'\[SEMANA_(\d+)\]\s*([^\n]+)', r'<div class="semana-header">📌 SEMANA \1: \2</div>', texto)
+    texto = re.sub(r'\[MAT_VIDEO\]\s*([^\n]+)',
+                   r'<div class="material-item"><span class="material-tipo">🎥 Vídeo:</span> \1</div>', texto)
+    texto = re.sub(r'\[MAT_SLIDE\]\s*([^\n]+)',
+                   r'<div class="material-item"><span class="material-tipo">📄 Slide:</span> \1</div>', texto)
+    texto = re.sub(r'\[LINK\]\s*(https?://[^\s<]+)',
+                   r'<div class="material-link">🔗 <a href="\1" target="_blank">\1</a></div>', texto)
+    texto = re.sub(r'\[SEPARADOR\]', r'<div class="separador"></div>', texto)
+
+    linhas = texto.split('\n')
+    resultado = []
+
+    for linha in linhas:
+        linha = linha.strip()
+        if linha and not any(tag in linha for tag in ['<div', '</div>']):
+            resultado.append(f'<p>{linha}</p>')
+        elif linha:
+            resultado.append(linha)
+
+    return '\n'.join(resultado)
+
+
+def formatar_resposta_incremental_original(pedacos):
+    """Versão anterior do modo incremental: formatar_resposta completo a cada linha"""
+    buffer = ''
+
+    for pedaco in pedacos:
+        buffer += pedaco
+        while '\n' in buffer:
+            linha, buffer = buffer.split('\n', 1)
+            yield linha + '\n', formatar_resposta_original(linha)
+
+    if buffer:
+        yield buffer, formatar_resposta_original(buffer)
+
+
+def gerar_resposta(materiais):
+    """Resposta sintética no formato que o modelo usa para listar conteúdos"""
+    linhas = ["Olá! Aqui estão os **materiais** que encontrei para você:", ""]
+    for i in range(materiais):
+        if i % 4 == 0:
+            linhas += [f"[CICLO_{i // 16 + 1}]", f"[SEMANA_{i // 4 + 1}] Conteúdo da semana {i // 4 + 1}", ""]
+        tipo = "[MAT_VIDEO]" if i % 2 == 0 else "[MAT_SLIDE]"
+        linhas += [
+            f"{tipo} Material {i} - Introdução a engenharia de soluções",
+            f"[LINK] https://drive.google.com/file/d/{i:08d}abcdef/view?usp=drive_link",
+            "",
+        ]
+        if i % 4 == 3:
+            linhas.append("[SEPARADOR]")
+    linhas.append("Bons estudos! Qualquer dúvida é só perguntar.")
+    return '\n'.join(linhas)
+
+
+def dividir_em_pedacos(texto, tamanho):
+    return [texto[i:i + tamanho] for i in range(0, len(texto), tamanho)]
+
+
+def medir(funcao, repeticoes):
+    return min(timeit.repeat(funcao, number=repeticoes, repeat=5)) / repeticoes
+
+
+def normalizar_html(texto):
+    """Remove diferenças esperadas (o formatador novo escapa o texto) para comparar a estrutura"""
+    return re.sub(r'\s+', ' ', texto.replace('&amp;', '&'))
+
+
+def main(argumentos):
+    parser = argparse.ArgumentParser(description="Micro-benchmark do formatador de respostas")
+    parser.add_argument('--materiais', type=int, default=300)
+    parser.add_argument('--repeticoes', type=int, default=200)
+    opcoes = parser.parse_args(argumentos)
+
+    texto = gerar_resposta(opcoes.materiais)
+    pedacos = dividir_em_pedacos(texto, 40)
+
+    if normalizar_html(formatar_resposta(texto)) != normalizar_html(formatar_resposta_original(texto)):
+        print("⚠️  As duas versões geraram HTML diferente para esta entrada")
+
+    tempo_original = medir(lambda: formatar_resposta_original(texto), opcoes.repeticoes)
+    tempo_atual = medir(lambda: formatar_resposta(texto), opcoes.repeticoes)
+    tempo_incremental_original = medir(lambda: list(formatar_resposta_incremental_original(pedacos)),
+                                       opcoes.repeticoes)
+    tempo_incremental = medir(lambda: list(formatar_resposta_incremental(pedacos)), opcoes.repeticoes)
+
+    print("=" * 70)
+    print(f"Resposta: {opcoes.materiais} materiais, {len(texto)} caracteres, {texto.count(chr(10)) + 1} linhas")
+    print("=" * 70)
+    print(f"formatar_resposta (anterior)     : {tempo_original * 1e3:8.3f} ms")
+    print(f"formatar_resposta (passada única): {tempo_atual * 1e3:8.3f} ms "
+          f"({tempo_original / tempo_atual:.2f}x)")
+    print(f"incremental, pedaços de 40 chars (anterior): {tempo_incremental_original * 1e3:8.3f} ms")
+    print(f"incremental, pedaços de 40 chars (atual)   : {tempo_incremental * 1e3:8.3f} ms "
+          f"({tempo_incremental_original / tempo_incremental:.2f}x)")
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
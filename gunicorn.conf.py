@@ -0,0 +1,37 @@
+# ============================================================================
+# CONFIGURAÇÃO DO GUNICORN - UNIHELP (PRODUÇÃO)
+# ============================================================================
+# Uso: gunicorn -c gunicorn.conf.py wsgi:app
+# Todos os valores podem ser ajustados por variáveis de ambiente.
+
+import os
+import multiprocessing
+
+bind = os.environ.get('UNIHELP_BIND', '0.0.0.0:5000')
+
+# Workers gevent: cada um atende muitas conversas ao mesmo tempo
+worker_class = 'gevent'
+workers = int(os.environ.get('UNIHELP_WORKERS', min(4, multiprocessing.cpu_count())))
+# O app divide a cota da API do Gemini entre os workers
+os.environ['UNIHELP_WORKERS'] = str(workers)
+worker_connections = int(os.environ.get('UNIHELP_CONEXOES_POR_WORKER', 500))
+
+# O app é importado e pré-aquecido uma vez no mestre (base de conhecimento,
+# índices e cliente do modelo) e os workers herdam tudo pronto no fork, em vez
+# de cada um ler os arquivos a frio na primeira requisição
+preload_app = os.environ.get('UNIHELP_PRELOAD', '1') != '0'
+
+
+def post_fork(server, worker):
+    if preload_app:
+        import app
+        app.reiniciar_apos_fork()
+
+
+# Respostas em streaming podem ficar abertas enquanto o modelo gera
+timeout = int(os.environ.get('UNIHELP_TIMEOUT', 120))
+graceful_timeout = 30
+keepalive = 5
+
+accesslog = '-'
+errorlog = '-'
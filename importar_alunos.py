@@ -0,0 +1,41 @@
+# ============================================================================
+# IMPORTAÇÃO EM LOTE DE NOTAS, HISTÓRICO E GRUPOS - UNIHELP
+# ============================================================================
+# Aplica a planilha exportada pela secretaria (CSV) aos registros dos alunos,
+# no backend configurado (UNIHELP_ARMAZENAMENTO). Pode rodar com o servidor no
+# ar: as gravações passam pelo mesmo journal com trava de arquivo.
+# Colunas aceitas: ver COLUNAS_IMPORTACAO em app.py.
+#
+# Uso: python importar_alunos.py planilha.csv [--validar]
+
+import sys
+import argparse
+
+from app import ErroImportacao, cache_dados_alunos, importar_planilha_alunos
+
+
+def main(argumentos):
+    parser = argparse.ArgumentParser(description="Importa notas, histórico e grupos de uma planilha CSV")
+    parser.add_argument('planilha')
+    parser.add_argument('--validar', action='store_true', help="só confere as linhas, sem gravar")
+    opcoes = parser.parse_args(argumentos)
+
+    try:
+        with open(opcoes.planilha, 'r', encoding='utf-8-sig', newline='') as arquivo:
+            resumo = importar_planilha_alunos(arquivo, cache_dados_alunos(), apenas_validar=opcoes.validar)
+    except (ErroImportacao, UnicodeDecodeError) as e:
+        print(f"❌ {opcoes.planilha}: {e}")
+        return 1
+
+    for erro in resumo['erros']:
+        print(f"⚠️  Linha {erro['linha']}: {erro['erro']}")
+
+    acao = "Validadas" if opcoes.validar else "Importadas"
+    print(f"✅ {acao} {resumo['validas']} de {resumo['linhas']} linhas: {resumo['alunos']} alunos "
+          f"({resumo['novos']} sem registro anterior), {resumo['invalidas']} linhas inválidas, "
+          f"{resumo['duracao_s']}s")
+    return 1 if resumo['invalidas'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
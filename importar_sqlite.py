@@ -0,0 +1,40 @@
+# ============================================================================
+# IMPORTAÇÃO DOS ARQUIVOS DE TEXTO PARA O SQLITE - UNIHELP
+# ============================================================================
+# Copia usuarios.txt, dados_alunos.txt (com as atualizações pendentes) e o log
+# de conversas para o banco SQLite. Depois de importar, rode o servidor com
+# UNIHELP_ARMAZENAMENTO=sqlite.
+#
+# Uso: python importar_sqlite.py [--destino unihelp.db]
+
+import sys
+import argparse
+
+import app
+from app import ARMAZENAMENTO_ARQUIVO_SQLITE, ARMAZENAMENTO_BACKEND, PoolConexoesSQLite, importar_para_sqlite
+
+
+def main(argumentos):
+    parser = argparse.ArgumentParser(description="Importa os arquivos de texto para o banco SQLite")
+    parser.add_argument('--destino', default=ARMAZENAMENTO_ARQUIVO_SQLITE)
+    opcoes = parser.parse_args(argumentos)
+
+    if ARMAZENAMENTO_BACKEND != 'texto':
+        print("❌ Rode a importação com UNIHELP_ARMAZENAMENTO=texto (o padrão)")
+        return 1
+
+    # Os repositórios de texto do app (um único log de conversas), com o histórico antigo já migrado
+    app.migrar_historico_antigo()
+    pool = PoolConexoesSQLite(opcoes.destino, 1)
+    try:
+        totais = importar_para_sqlite(pool, app.repositorio_usuarios(), app.cache_dados_alunos(), app.log_conversas())
+    finally:
+        pool.fechar()
+
+    print(f"✅ Importado para {opcoes.destino}: {totais['usuarios']} usuários, "
+          f"{totais['alunos']} alunos, {totais['historico']} conversas")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
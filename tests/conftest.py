@@ -0,0 +1,19 @@
+import os
+import sys
+import shutil
+
+import pytest
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+
+
+@pytest.fixture(scope='session')
+def app_modulo(tmp_path_factory):
+    """O módulo app importado num diretório temporário (os arquivos de dados são relativos)"""
+    diretorio = tmp_path_factory.mktemp('unihelp')
+    shutil.copy(os.path.join(RAIZ, 'banco_dados.txt'), diretorio)
+    os.chdir(diretorio)
+    import app
+    app.criar_app(preaquecer_agora=False)
+    return app
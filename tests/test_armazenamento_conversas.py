@@ -0,0 +1,41 @@
+import sqlite3
+
+import pytest
+
+
+def _historico(tamanho):
+    return [{'role': 'system', 'content': 's'}, {'role': 'user', 'content': 'x' * (tamanho - 1)}]
+
+
+@pytest.mark.parametrize('backend', ['memoria', 'sqlite'])
+def test_limite_de_bytes_despeja_as_conversas_menos_recentes(app_modulo, tmp_path, backend):
+    if backend == 'sqlite':
+        armazenamento = app_modulo.ArmazenamentoConversasSQLite(str(tmp_path / 'conversas.db'), 3600, 100, 250)
+    else:
+        armazenamento = app_modulo.ArmazenamentoConversasMemoria(3600, 100, 250)
+
+    for id_conversa in ('a', 'b', 'c'):
+        armazenamento.salvar(id_conversa, _historico(100))
+
+    assert armazenamento.obter('a') is None
+    assert armazenamento.obter('b') == _historico(100)
+    assert armazenamento.obter('c') == _historico(100)
+
+    # Uma conversa que sozinha passa do limite não fica
+    armazenamento.salvar('grande', _historico(300))
+    assert armazenamento.obter('grande') is None
+
+def test_sqlite_criado_antes_do_limite_de_bytes_ganha_a_coluna(app_modulo, tmp_path):
+    caminho = str(tmp_path / 'conversas.db')
+    conexao = sqlite3.connect(caminho)
+    conexao.execute("CREATE TABLE conversas (id TEXT PRIMARY KEY, historico TEXT NOT NULL, "
+                    "atualizado_em REAL NOT NULL)")
+    conexao.execute("INSERT INTO conversas VALUES ('antiga', '[]', ?)", (app_modulo.time.time(),))
+    conexao.commit()
+    conexao.close()
+
+    armazenamento = app_modulo.ArmazenamentoConversasSQLite(caminho, 3600, 100, 250)
+    armazenamento.salvar('nova', _historico(100))
+
+    assert armazenamento.obter('antiga') == []
+    assert armazenamento.obter('nova') == _historico(100)
@@ -0,0 +1,39 @@
+BASE = '''# HORÁRIO ACADÊMICO
+# Estrutura: DIA_SEMANA; DISCIPLINA; HORARIO_INICIO; HORARIO_FIM
+
+SEGUNDA-FEIRA; Cálculo; 19:00; 22:40
+--------------------------------------------------------------------------------
+
+>CONTEÚDO DE CADA COMPONENTE INTEGRADO
+
+#COMPONENTE: Cálculo
+
+---
+
+##CICLO: 01
+
+###SEMANA 01
+[MAT_VIDEO] Limites
+>PROFESSOR: HENRIQUE
+'''
+
+
+def test_trechos_sao_as_secoes_com_texto_proprio(app_modulo):
+    versao = app_modulo.VersaoBaseConhecimento(1, None, BASE.encode('utf-8'))
+
+    assert versao.indice.trechos == [
+        ('HORÁRIO ACADÊMICO',
+         '[HORÁRIO ACADÊMICO]\n# Estrutura: DIA_SEMANA; DISCIPLINA; HORARIO_INICIO; HORARIO_FIM\n'
+         'SEGUNDA-FEIRA; Cálculo; 19:00; 22:40\n>CONTEÚDO DE CADA COMPONENTE INTEGRADO'),
+        ('Cálculo > CICLO 01 > SEMANA 01',
+         '[Cálculo > CICLO 01 > SEMANA 01]\n[MAT_VIDEO] Limites\n>PROFESSOR: HENRIQUE'),
+    ]
+
+
+def test_trecho_e_lido_da_fatia_da_secao(app_modulo):
+    versao = app_modulo.VersaoBaseConhecimento(1, None, BASE.encode('utf-8'))
+    semana = versao.secoes[-1]
+
+    assert isinstance(versao.fatia(semana['inicio'], semana['fim']), memoryview)
+    assert versao.texto(versao.fatia(semana['inicio'], semana['fim'])).startswith('###SEMANA 01\n')
+    assert versao.indice.buscar('limites', 1) == [1]
@@ -0,0 +1,185 @@
+import itertools
+import threading
+import time
+
+import pytest
+
+_ras = itertools.count(900001)
+
+
+@pytest.fixture
+def app(app_modulo, monkeypatch):
+    """Cache vazio, sem respostas diretas e com um modelo falso que responde por aluno"""
+    monkeypatch.setattr(app_modulo, 'cache_respostas', app_modulo.CacheRespostas(100, 3600, True, 0.85))
+    monkeypatch.setattr(app_modulo, 'responder_diretamente', lambda *args, **kwargs: None)
+    app_modulo.app.config['TESTING'] = True
+    return app_modulo
+
+
+class ModeloFalso:
+    def __init__(self, responder):
+        self.responder = responder
+        self.chamadas = []
+
+    def __call__(self, historico, id_conversa=None, ra_usuario=None):
+        self.chamadas.append((ra_usuario, historico[-1]['content']))
+        return self.responder(ra_usuario, historico[-1]['content'], len(self.chamadas))
+
+
+def _aluno(app, curso, nota):
+    ra = str(next(_ras))
+    app.salvar_usuario({'ra': ra, 'nome_completo': f'Aluno {ra}', 'email': f'{ra}@exemplo.com',
+                        'cpf': ra.zfill(11), 'curso': curso, 'senha_hash': app.hash_senha('segredo'),
+                        'data_cadastro': '2025-08-01 10:00:00'})
+    app.cache_dados_alunos().atualizar([{'ra': ra, 'notas': [
+        {'ciclo': 'Ciclo 1', 'descricao': 'PI - Projeto Integrador', 'nota': nota}]}])
+
+    cliente = app.app.test_client()
+    with cliente.session_transaction() as sessao:
+        sessao['usuario_logado'] = ra
+        sessao['nome_usuario'] = f'Aluno {ra}'
+    return ra, cliente
+
+
+def _perguntar(cliente, pergunta):
+    resposta = cliente.post('/enviar_mensagem', json={'pergunta': pergunta})
+    assert resposta.status_code == 200
+    return resposta.get_json()['resposta']
+
+
+def test_continuacao_da_conversa_nao_usa_resposta_de_outro_aluno(app, monkeypatch):
+    modelo = ModeloFalso(lambda ra, pergunta, n: f"Resposta {n} preparada só para esta conversa")
+    monkeypatch.setattr(app, 'obter_resposta_gemini', modelo)
+    _, cliente_a = _aluno(app, 'Inteligência Artificial', 7.25)
+    ra_b, cliente_b = _aluno(app, 'Inteligência Artificial', 6.75)
+
+    _perguntar(cliente_a, 'o que é o projeto integrador?')
+    resposta_a = _perguntar(cliente_a, 'explique melhor')
+    _perguntar(cliente_b, 'o que é o projeto integrador?')
+    resposta_b = _perguntar(cliente_b, 'explique melhor')
+
+    assert resposta_b != resposta_a
+    assert len(modelo.chamadas) == 3  # a primeira pergunta de B vem do cache
+    assert modelo.chamadas[-1][0] == ra_b and modelo.chamadas[-1][1].endswith('explique melhor')
+
+
+@pytest.mark.parametrize('pergunta, outra_forma', [
+    ('qual meu curso', 'qual é o meu curso?'),
+    ('quais disciplinas estou cursando?', 'quais disciplinas eu estou cursando'),
+])
+def test_pergunta_pessoal_fica_restrita_ao_aluno(app, monkeypatch, pergunta, outra_forma):
+    cursos = {}
+    modelo = ModeloFalso(lambda ra, p, n: f"Você está em {cursos[ra]}")
+    monkeypatch.setattr(app, 'obter_resposta_gemini', modelo)
+    ra_a, cliente_a = _aluno(app, 'Inteligência Artificial', 7.25)
+    ra_b, cliente_b = _aluno(app, 'Ciência de Dados', 6.75)
+    cursos.update({ra_a: 'Inteligência Artificial', ra_b: 'Ciência de Dados'})
+
+    assert 'Inteligência Artificial' in _perguntar(cliente_a, pergunta)
+    assert 'Ciência de Dados' in _perguntar(cliente_b, pergunta)
+    assert len(modelo.chamadas) == 2
+
+    # Uma forma parecida da pergunta (busca aproximada) também não cruza alunos
+    cliente_b.post('/limpar')
+    assert 'Ciência de Dados' in _perguntar(cliente_b, outra_forma)
+
+
+def test_resposta_que_cita_nota_do_aluno_nao_e_compartilhada(app, monkeypatch):
+    notas = {}
+    modelo = ModeloFalso(lambda ra, p, n: f"No projeto integrador você tirou {notas[ra]:.2f}.")
+    monkeypatch.setattr(app, 'obter_resposta_gemini', modelo)
+    ra_a, cliente_a = _aluno(app, 'Inteligência Artificial', 8.75)
+    ra_b, cliente_b = _aluno(app, 'Inteligência Artificial', 5.25)
+    notas.update({ra_a: 8.75, ra_b: 5.25})
+
+    assert '8.75' in _perguntar(cliente_a, 'como foi o projeto integrador')
+    resposta_b = _perguntar(cliente_b, 'como foi o projeto integrador')
+
+    assert '5.25' in resposta_b and '8.75' not in resposta_b
+    assert len(modelo.chamadas) == 2
+
+
+def test_pergunta_geral_continua_compartilhada(app, monkeypatch):
+    modelo = ModeloFalso(lambda ra, p, n: "A entrega do projeto integrador é no fim do ciclo.")
+    monkeypatch.setattr(app, 'obter_resposta_gemini', modelo)
+    _, cliente_a = _aluno(app, 'Inteligência Artificial', 7.25)
+    _, cliente_b = _aluno(app, 'Ciência de Dados', 6.75)
+
+    resposta_a = _perguntar(cliente_a, 'qual o prazo do projeto integrador?')
+    resposta_b = _perguntar(cliente_b, 'qual o prazo do projeto integrador?')
+
+    assert resposta_a == resposta_b
+    assert len(modelo.chamadas) == 1
+
+
+def test_resposta_geral_que_cita_o_curso_nao_vai_para_outro_curso(app, monkeypatch):
+    cursos = {}
+    modelo = ModeloFalso(lambda ra, p, n: f"No curso de {cursos[ra]}, o projeto integrador vale metade da nota.")
+    monkeypatch.setattr(app, 'obter_resposta_gemini', modelo)
+    ra_a, cliente_a = _aluno(app, 'Inteligência Artificial', 7.25)
+    ra_b, cliente_b = _aluno(app, 'Ciência de Dados', 6.75)
+    cursos.update({ra_a: 'Inteligência Artificial', ra_b: 'Ciência de Dados'})
+
+    assert 'Inteligência Artificial' in _perguntar(cliente_a, 'como funciona o projeto integrador?')
+    resposta_b = _perguntar(cliente_b, 'como funciona o projeto integrador?')
+
+    assert 'Ciência de Dados' in resposta_b and 'Inteligência Artificial' not in resposta_b
+    assert len(modelo.chamadas) == 2
+
+
+def test_busca_aproximada_so_compara_o_balde_do_escopo_e_dos_numeros(app_modulo):
+    cache = app_modulo.CacheRespostas(5000, 3600, True, 0.85)
+    for i in range(2000):
+        cache.guardar('geral', f'pergunta numero {i} sobre assunto {i}', f'resposta {i}')
+        cache.guardar(('pessoal', str(i)), 'qual o prazo do projeto integrador', 'de outro aluno')
+    cache.guardar('geral', 'qual o prazo do projeto integrador', 'no fim do ciclo')
+
+    tamanho = len(app_modulo._trigramas('qual o prazo do projeto integrador'))
+    assert cache._candidatos('geral', frozenset(), tamanho) == ['qual o prazo do projeto integrador']
+    assert cache.buscar('geral', 'qual e o prazo do projeto integrador') == 'no fim do ciclo'
+    assert cache.buscar('geral', 'qual o prazo do projeto integrador 2') is None
+
+
+def test_busca_aproximada_compara_no_maximo_o_limite_de_candidatos(app_modulo):
+    cache = app_modulo.CacheRespostas(5000, 3600, True, 0.85, max_candidatos_fuzzy=10)
+    for i in range(500):
+        cache.guardar('geral', f'pergunta sobre o assunto {chr(97 + i % 26)}{i:04x}', i)
+
+    tamanho = len(app_modulo._trigramas('pergunta sobre o assunto x0000'))
+    assert len(cache._candidatos('geral', frozenset(), tamanho)) == 10
+
+
+def test_itens_despejados_saem_dos_baldes(app_modulo):
+    cache = app_modulo.CacheRespostas(2, 3600, True, 0.85)
+    cache.guardar('geral', 'qual o prazo do projeto integrador', 'a')
+    cache.guardar('geral', 'qual o prazo do projeto integrador', 'b')
+    cache.guardar('geral', 'onde fica a biblioteca', 'c')
+    cache.guardar('geral', 'quando comecam as aulas', 'd')
+
+    assert cache.buscar('geral', 'qual e o prazo do projeto integrador') is None
+    assert sum(len(t) for balde in cache._baldes.values() for t in balde.values()) == 2
+
+
+def _coalescidas(app):
+    return app.metricas._valores['unihelp_modelo_coalescidas_total'].get((), 0)
+
+
+def test_perguntas_iguais_simultaneas_chamam_o_modelo_uma_vez(app, monkeypatch):
+    def responder(ra, pergunta, n):
+        time.sleep(0.2)
+        return "A entrega do projeto integrador é no fim do ciclo."
+
+    modelo = ModeloFalso(responder)
+    monkeypatch.setattr(app, 'obter_resposta_gemini', modelo)
+    clientes = [_aluno(app, 'Inteligência Artificial', 7.0)[1] for _ in range(5)]
+    antes = _coalescidas(app)
+
+    threads = [threading.Thread(target=_perguntar, args=(cliente, 'qual o prazo do projeto integrador?'))
+               for cliente in clientes]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(modelo.chamadas) == 1
+    assert _coalescidas(app) == antes + 4
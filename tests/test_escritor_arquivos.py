@@ -0,0 +1,108 @@
+import json
+import time
+import threading
+
+import pytest
+
+
+def _journal(caminho, *lotes, commit_no_ultimo=True):
+    """Escreve lotes no formato do journal; o último pode ficar sem a linha de commit"""
+    with open(caminho, 'w', encoding='utf-8') as f:
+        for i, entradas in enumerate(lotes):
+            for arquivo, offset, dados in entradas:
+                f.write(json.dumps({'caminho': str(arquivo), 'offset': offset, 'dados': dados}) + '\n')
+            if commit_no_ultimo or i < len(lotes) - 1:
+                f.write(json.dumps({'commit': len(entradas)}) + '\n')
+
+
+def test_recuperacao_reaplica_lote_confirmado_pela_metade(app_modulo, tmp_path):
+    usuarios, dados = tmp_path / 'usuarios.txt', tmp_path / 'dados.txt'
+    usuarios.write_text('cabecalho\nlinha 1\n')
+    # O lote chegou inteiro em usuarios.txt, mas só a metade em dados.txt
+    dados.write_text('[RA:1]\nNOME: A')
+    journal = tmp_path / 'escritas.journal'
+    _journal(journal,
+             [(usuarios, len('cabecalho\n'), 'linha 1\n'), (dados, 0, '[RA:1]\nNOME: Ana\n[FIM]\n')],
+             [(usuarios, len('cabecalho\nlinha 1\n'), 'linha 2 sem commit\n')],
+             commit_no_ultimo=False)
+
+    escritor = app_modulo.EscritorArquivos(str(journal), 'nunca')
+
+    assert usuarios.read_text() == 'cabecalho\nlinha 1\n'  # lote sem commit não é aplicado
+    assert dados.read_text() == '[RA:1]\nNOME: Ana\n[FIM]\n'
+    assert journal.stat().st_size == 0
+
+    assert escritor.escrever(str(dados), b'[RA:2]\n[FIM]\n')
+    assert dados.read_text().endswith('[FIM]\n[RA:2]\n[FIM]\n')
+
+
+def test_recuperacao_ignora_arquivo_alterado_depois_do_lote(app_modulo, tmp_path):
+    dados = tmp_path / 'dados.txt'
+    dados.write_text('outro conteudo')
+    journal = tmp_path / 'escritas.journal'
+    _journal(journal, [(dados, 0, 'conteudo do lote\n')])
+
+    app_modulo.EscritorArquivos(str(journal), 'nunca')
+
+    assert dados.read_text() == 'outro conteudo'
+
+
+@pytest.mark.parametrize('rodada', range(5))
+def test_cadastro_simultaneo_do_mesmo_ra_grava_uma_vez(app_modulo, tmp_path, rodada):
+    caminho, journal = str(tmp_path / 'usuarios.txt'), str(tmp_path / 'escritas.journal')
+    # Dois "workers": cada um com o seu escritor (descritor e flock próprios) e o seu índice
+    repositorios = [app_modulo.RepositorioUsuarios(caminho, app_modulo.EscritorArquivos(journal, 'nunca'))
+                    for _ in range(2)]
+    # Alarga a janela entre conferir o RA e gravar a linha: sem a trava de
+    # arquivo, os dois conferem antes de qualquer um gravar
+    for repositorio in repositorios:
+        def atualizar_devagar(original=repositorio._atualizar):
+            original()
+            time.sleep(0.02)
+        repositorio._atualizar = atualizar_devagar
+    largada = threading.Barrier(len(repositorios))
+    resultados = []
+
+    def cadastrar(repositorio, email):
+        largada.wait()
+        resultados.append(repositorio.adicionar({
+            'ra': '424242', 'nome_completo': 'Aluno Repetido', 'email': email, 'cpf': email[:11],
+            'curso': 'IA', 'senha_hash': 'x', 'data_cadastro': '2025-08-01 10:00:00'}))
+
+    threads = [threading.Thread(target=cadastrar, args=(r, f'{i}@exemplo.com'))
+               for i, r in enumerate(repositorios)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert sorted(resultados) == [False, True]
+    with open(caminho, encoding='utf-8') as f:
+        assert sum(1 for linha in f if linha.startswith('424242|')) == 1
+    for repositorio in repositorios:
+        assert repositorio.buscar_por_ra('424242') is not None
+
+
+def test_registro_inicial_do_mesmo_ra_no_mesmo_lote_grava_uma_vez(app_modulo, tmp_path):
+    # Com a janela do lote, os dois pedidos entram no mesmo lote do escritor
+    escritor = app_modulo.EscritorArquivos(str(tmp_path / 'escritas.journal'), 'nunca', janela_segundos=0.2)
+    dados = app_modulo.CacheDadosAlunos(str(tmp_path / 'dados_alunos.txt'),
+                                        str(tmp_path / 'dados_alunos.atualizacoes'), escritor)
+    largada = threading.Barrier(2)
+    resultados = []
+
+    def criar(nome):
+        largada.wait()
+        resultados.append(dados.adicionar_inicial('515151', nome, 'IA'))
+
+    threads = [threading.Thread(target=criar, args=(nome,)) for nome in ('Aluno Um', 'Aluno Dois')]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert sorted(resultados) == [False, True]
+    assert escritor.estatisticas()['lotes'] == 1
+    with open(tmp_path / 'dados_alunos.txt', encoding='utf-8') as f:
+        assert f.read().count('[RA:515151]') == 1
+    assert dados.existe('515151') and not dados._reservados
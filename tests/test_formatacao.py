@@ -0,0 +1,23 @@
+def _amostras_formatacao(app_modulo):
+    serie = app_modulo.metricas._valores['unihelp_etapa_segundos'].get((('etapa', 'formatacao'),))
+    return serie[2] if serie else 0
+
+
+def test_streaming_registra_uma_amostra_de_formatacao_por_resposta(app_modulo):
+    pedacos = ["Olá!\n[MAT_VIDEO] Aula", " 1\n[LINK] https://exemplo.com/a\n", "Bons ", "estudos"]
+    antes = _amostras_formatacao(app_modulo)
+
+    linhas = list(app_modulo.formatar_resposta_incremental(pedacos))
+
+    assert ''.join(bruto for bruto, _ in linhas) == ''.join(pedacos)
+    assert _amostras_formatacao(app_modulo) == antes + 1
+
+
+def test_streaming_interrompido_tambem_registra_a_amostra(app_modulo):
+    antes = _amostras_formatacao(app_modulo)
+    gerador = app_modulo.formatar_resposta_incremental(["linha 1\n", "linha 2\n", "linha 3"])
+
+    next(gerador)
+    gerador.close()
+
+    assert _amostras_formatacao(app_modulo) == antes + 1
@@ -0,0 +1,116 @@
+import io
+import json
+
+import pytest
+
+
+@pytest.fixture
+def dados_alunos(app_modulo, tmp_path):
+    escritor = app_modulo.EscritorArquivos(str(tmp_path / 'journal'), 'nunca')
+    dados = app_modulo.CacheDadosAlunos(str(tmp_path / 'dados_alunos.txt'),
+                                        str(tmp_path / 'dados_alunos.atualizacoes'), escritor)
+    dados.atualizar([{'ra': '100', 'nome': 'Ana Souza', 'curso': 'IA', 'grupo': 'Grupo 1'}])
+    return dados
+
+
+def _importar(app_modulo, dados_alunos, texto, apenas_validar=False):
+    return app_modulo.importar_planilha_alunos(io.StringIO(texto), dados_alunos, apenas_validar=apenas_validar)
+
+
+def test_validar_linha_normaliza_grupo_e_ciclo(app_modulo):
+    assert app_modulo.validar_linha_importacao(
+        {'ra': ' 100 ', 'grupo': '2', 'ciclo': '1', 'descricao': 'AFE', 'nota': '7,5'}
+    ) == {'ra': '100', 'grupo': 'Grupo 2',
+          'notas': [{'ciclo': 'Ciclo 1', 'descricao': 'AFE', 'nota': 7.5}]}
+
+
+def test_validar_linha_de_historico(app_modulo):
+    assert app_modulo.validar_linha_importacao(
+        {'ra': '100', 'componente': 'Cálculo', 'semestre': '1', 'nota': '8', 'situacao': 'Aprovado'}
+    ) == {'ra': '100', 'historico': [{'componente': 'Cálculo', 'semestre': '1', 'nota': 8.0,
+                                      'situacao': 'Aprovado'}]}
+
+
+@pytest.mark.parametrize('linha, motivo', [
+    ({'ra': ''}, "RA vazio"),
+    ({'ra': '10 0', 'nome': 'Ana'}, "RA inválido"),
+    ({'ra': '100', 'nome': 'Ana|Souza'}, "'nome' não pode ter"),
+    ({'ra': '100'}, "linha sem dados"),
+    ({'ra': '100', 'ciclo': '1', 'nota': '5'}, "precisa de 'ciclo' e 'descricao'"),
+    ({'ra': '100', 'ciclo': '1', 'descricao': 'AFE', 'nota': 'dez'}, "nota inválida"),
+    ({'ra': '100', 'componente': 'Cálculo', 'nota': '5'}, "precisa de 'semestre' e 'situacao'"),
+])
+def test_validar_linha_rejeita(app_modulo, linha, motivo):
+    with pytest.raises(ValueError, match=motivo):
+        app_modulo.validar_linha_importacao(linha)
+
+
+def test_importacao_mescla_nas_notas_e_no_historico(app_modulo, dados_alunos):
+    planilha = ("ra;grupo;ciclo;descricao;componente;semestre;nota;situacao\n"
+                "100;3;1;AFE;;;6,0;\n"
+                "100;;1;AFE;;;9,5;\n"
+                "100;;;;Cálculo;1;8;Aprovado\n")
+
+    resumo = _importar(app_modulo, dados_alunos, planilha)
+    resumo = _importar(app_modulo, dados_alunos, planilha)
+
+    assert (resumo['validas'], resumo['invalidas'], resumo['alunos'], resumo['novos']) == (3, 0, 1, 0)
+    registro = dados_alunos.obter('100')
+    assert (registro['nome'], registro['curso'], registro['grupo']) == ('Ana Souza', 'IA', 'Grupo 3')
+    assert registro['notas'] == [{'ciclo': 'Ciclo 1', 'descricao': 'AFE', 'nota': 9.5}]
+    assert registro['historico'] == [{'componente': 'Cálculo', 'semestre': '1', 'nota': 8.0,
+                                      'situacao': 'Aprovado'}]
+
+
+def test_ra_desconhecido_sem_nome_e_rejeitado(app_modulo, dados_alunos):
+    planilha = ("ra,nome,curso,ciclo,descricao,nota\n"
+                "999,,,1,AFE,7\n"
+                "200,Bruno Lima,IA,1,AFE,8\n"
+                "200,,,2,AFE,9\n"
+                "10 0,Carla,IA,1,AFE,5\n")
+
+    resumo = _importar(app_modulo, dados_alunos, planilha)
+
+    assert (resumo['validas'], resumo['invalidas'], resumo['alunos'], resumo['novos']) == (2, 2, 1, 1)
+    assert [e['linha'] for e in resumo['erros']] == [2, 5]
+    assert "precisa de 'nome'" in resumo['erros'][0]['erro']
+    assert "RA inválido" in resumo['erros'][1]['erro']
+    assert not dados_alunos.existe('999')
+    assert dados_alunos.obter('200')['nome'] == 'Bruno Lima'
+    assert len(dados_alunos.obter('200')['notas']) == 2
+
+
+def test_apenas_validar_nao_grava(app_modulo, dados_alunos):
+    resumo = _importar(app_modulo, dados_alunos, "ra,nome\n300,Davi Rocha\n", apenas_validar=True)
+
+    assert (resumo['validas'], resumo['novos']) == (1, 1)
+    assert not dados_alunos.existe('300')
+
+
+def test_consolidar_nao_bloqueia_escritas_durante_a_copia(app_modulo, dados_alunos, monkeypatch):
+    dados_alunos.adicionar_inicial('100', 'Ana Souza', 'IA')
+    dados_alunos.adicionar_inicial('101', 'Bia Lima', 'IA')
+    dados_alunos.atualizar([{'ra': '100', 'notas': [{'ciclo': 'Ciclo 1', 'descricao': 'AFE', 'nota': 6.0}]}])
+    copiar = app_modulo._copiar_trecho
+    durante_a_copia = []
+
+    def copiar_e_escrever(origem, destino, fim, *args):
+        if not durante_a_copia:
+            # Sem a trava exclusiva: essas escritas terminam no meio da cópia
+            durante_a_copia.append(dados_alunos.adicionar_inicial('102', 'Caio Reis', 'IA'))
+            dados_alunos.atualizar([{'ra': '101', 'grupo': 'Grupo 4'}])
+        copiar(origem, destino, fim, *args)
+
+    monkeypatch.setattr(app_modulo, '_copiar_trecho', copiar_e_escrever)
+    dados_alunos.consolidar()
+
+    assert durante_a_copia == [True]
+    assert dados_alunos.obter('100')['notas'] == [{'ciclo': 'Ciclo 1', 'descricao': 'AFE', 'nota': 6.0}]
+    assert dados_alunos.obter('101')['grupo'] == 'Grupo 4'
+    assert dados_alunos.obter('102')['nome'] == 'Caio Reis'
+    with open(dados_alunos.caminho, encoding='utf-8') as f:
+        conteudo = f.read()
+    assert conteudo.count('[RA:100]') == conteudo.count('[RA:102]') == 1
+    assert 'AFE' in conteudo and 'Grupo 4' not in conteudo
+    with open(dados_alunos.caminho_atualizacoes, encoding='utf-8') as f:
+        assert [json.loads(linha)['ra'] for linha in f] == ['101']
@@ -0,0 +1,52 @@
+import os
+import shutil
+import subprocess
+import sys
+
+import pytest
+
+from conftest import RAIZ
+
+HISTORICO_ANTIGO = ("[RA:445|DATA:2025-11-05 21:19:20]\n"
+                    "PERGUNTA: oi\n"
+                    "RESPOSTA: <p>Olá!</p>\n"
+                    "[FIM_CONVERSA]\n\n")
+
+
+@pytest.fixture
+def diretorio(tmp_path):
+    shutil.copy(os.path.join(RAIZ, 'banco_dados.txt'), tmp_path)
+    (tmp_path / 'historico_conversas.txt').write_text(HISTORICO_ANTIGO, encoding='utf-8')
+    return tmp_path
+
+
+def _rodar(diretorio, *argumentos):
+    ambiente = {**os.environ, 'PYTHONPATH': RAIZ, 'UNIHELP_SECRET_KEY': ''}
+    return subprocess.run([sys.executable, *argumentos], cwd=diretorio, env=ambiente, check=True,
+                          capture_output=True, text=True)
+
+
+def test_importar_o_app_nao_toca_nos_arquivos_de_dados(diretorio):
+    antes = sorted(os.listdir(diretorio))
+
+    _rodar(diretorio, '-c', 'import app')
+
+    assert sorted(os.listdir(diretorio)) == antes
+
+
+def test_validar_planilha_nao_migra_o_historico_nem_cria_a_chave(diretorio):
+    (diretorio / 'notas.csv').write_text("ra,nome,curso,ciclo,descricao,nota\n"
+                                         "445,Eduardo,Engenharia de Software,Ciclo 1,PI,7.5\n", encoding='utf-8')
+
+    _rodar(diretorio, os.path.join(RAIZ, 'importar_alunos.py'), 'notas.csv', '--validar')
+
+    assert not os.path.exists(diretorio / '.chave_secreta')
+    assert not [nome for nome in os.listdir(diretorio / 'historico_conversas') if nome.startswith('segmento')]
+
+
+def test_criar_app_abre_os_repositorios_e_migra_o_historico(diretorio):
+    saida = _rodar(diretorio, '-c', 'import app; app.criar_app(preaquecer_agora=False); '
+                                    'print(app.log_conversas().total_registros())')
+
+    assert saida.stdout.strip() == '1'
+    assert {'.chave_secreta', 'escritas.journal'} <= set(os.listdir(diretorio))
@@ -0,0 +1,81 @@
+import pytest
+
+
+@pytest.fixture
+def app(app_modulo, monkeypatch):
+    monkeypatch.setattr(app_modulo, 'HISTORICO_ORCAMENTO_TOKENS', 200)
+    return app_modulo
+
+
+def _conversa(inicio, turnos, resumo=None):
+    sistema = {'role': 'system', 'content': 'prompt antigo'}
+    if resumo:
+        sistema['resumo'] = resumo
+    mensagens = [sistema]
+    for i in range(inicio, inicio + turnos):
+        mensagens.append({'role': 'user', 'content': f'pergunta {i} ' + 'p' * 150})
+        mensagens.append({'role': 'assistant', 'content': f'resposta {i} ' + 'r' * 150, 'html': '<p>r</p>'})
+    return mensagens
+
+
+def test_dentro_do_orcamento_nada_muda(app):
+    historico = _conversa(0, 2)
+    assert app.ajustar_janela_historico(historico, lambda: 'prompt novo') is historico
+
+
+def test_turnos_antigos_viram_resumo_ate_a_fracao_do_orcamento(app):
+    historico = _conversa(0, 4)  # 8 mensagens de ~40 tokens: passa de 200
+
+    ajustado = app.ajustar_janela_historico(historico, lambda: 'prompt novo')
+
+    sistema, turnos = ajustado[0], ajustado[1:]
+    assert sistema['content'] == 'prompt novo'
+    assert turnos == historico[-len(turnos):]
+    assert turnos[0]['role'] == 'user'
+    assert app.tokens_da_janela(turnos) <= app.HISTORICO_ORCAMENTO_TOKENS * app.HISTORICO_FRACAO_APOS_RESUMO
+    assert sistema['resumo'].split('\n')[0].startswith('- Aluno: pergunta 0 ')
+    assert sistema['resumo'].split('\n')[1].startswith('  UniHelp: resposta 0 ')
+    assert f"pergunta {len(historico) // 2 - len(turnos) // 2 - 1}" in sistema['resumo']
+
+
+def test_novo_resumo_continua_o_anterior(app, monkeypatch):
+    monkeypatch.setattr(app, 'RESUMO_MAX_TOKENS', 10000)
+    primeiro = app.ajustar_janela_historico(_conversa(0, 4), lambda: 'prompt novo')
+    resumo_anterior = primeiro[0]['resumo']
+
+    segundo = app.ajustar_janela_historico(primeiro + _conversa(4, 3)[1:], lambda: 'prompt novo')
+
+    assert segundo[0]['resumo'].startswith(resumo_anterior + '\n')
+    assert 'pergunta 4 ' in segundo[0]['resumo']
+
+
+def test_mensagens_recentes_ficam_mesmo_acima_do_orcamento(app, monkeypatch):
+    monkeypatch.setattr(app, 'HISTORICO_ORCAMENTO_TOKENS', 10)
+    historico = _conversa(0, 3)
+
+    ajustado = app.ajustar_janela_historico(historico, lambda: 'prompt novo')
+
+    assert ajustado[1:] == historico[-app.HISTORICO_MIN_MENSAGENS_RECENTES:]
+
+
+def test_resumo_esquece_as_linhas_mais_antigas_acima_do_limite(app_modulo):
+    mensagens = [{'role': 'user' if i % 2 == 0 else 'assistant', 'content': f'mensagem {i} ' + 'x' * 150}
+                 for i in range(200)]
+
+    resumo = app_modulo.resumir_turnos('- Aluno: linha do resumo anterior', mensagens)
+
+    assert app_modulo.estimar_tokens(resumo) <= app_modulo.RESUMO_MAX_TOKENS
+    assert 'linha do resumo anterior' not in resumo
+    assert resumo.split('\n')[-1].startswith('  UniHelp: mensagem 199 ')
+
+
+def test_resumo_tira_marcacoes_e_corta_mensagens_longas(app_modulo):
+    resumo = app_modulo.resumir_turnos('', [
+        {'role': 'assistant', 'content': '[MAT_VIDEO] Aula 1\n[LINK] https://exemplo.com/aula <b>ok</b>'},
+        {'role': 'user', 'content': 'palavra ' * 100},
+    ])
+
+    linhas = resumo.split('\n')
+    assert linhas[0] == '  UniHelp: Aula 1 ok'
+    assert linhas[1].endswith('…')
+    assert len(linhas[1]) <= len('- Aluno: ') + app_modulo.RESUMO_MAX_CARACTERES_MENSAGEM + 1
@@ -0,0 +1,84 @@
+
+import pytest
+
+
+class Pedaco:
+    def __init__(self, text):
+        self.text = text
+
+
+class ChatFalso:
+    def __init__(self, modelo):
+        self.modelo = modelo
+
+    def send_message(self, mensagem, stream=False, request_options=None):
+        self.modelo.chamadas += 1
+        if stream:
+            return iter([Pedaco('primeiro '), Pedaco('segundo '), Pedaco('terceiro')])
+        return Pedaco('resposta')
+
+
+class ModeloFalso:
+    def __init__(self):
+        self.chamadas = 0
+
+    def __call__(self, instrucao_sistema):
+        return self
+
+    def start_chat(self, history=None):
+        return ChatFalso(self)
+
+
+@pytest.fixture
+def app(app_modulo, monkeypatch):
+    monkeypatch.setattr(app_modulo, 'fila_chamadas_modelo', app_modulo.FilaJustaChamadas(1))
+    monkeypatch.setattr(app_modulo.gerenciador_sessoes_chat, 'criar_modelo', ModeloFalso())
+    return app_modulo
+
+
+HISTORICO = [{'role': 'system', 'content': 's'}, {'role': 'user', 'content': 'oi'}]
+
+
+def test_stream_libera_vaga_e_sessao_sem_esperar_o_cliente(app):
+    gerador = app.obter_resposta_gemini_stream(HISTORICO, 'conversa-lenta', '111')
+    assert next(gerador) == 'primeiro '
+
+    # O cliente parou de ler, mas o modelo já terminou: a vaga e a trava voltam
+    assert app.fila_chamadas_modelo.entrar('222', 2)
+    app.fila_chamadas_modelo.sair()
+    sessao = app.gerenciador_sessoes_chat._sessoes['conversa-lenta']
+    assert sessao['trava'].acquire(timeout=2)
+    sessao['trava'].release()
+
+    assert ''.join(gerador) == 'segundo terceiro'
+    assert sessao['turnos'] == 2
+
+
+def test_cota_e_esperada_antes_de_ocupar_a_vaga(app, monkeypatch):
+    vagas_na_espera = []
+
+    def respeitar_cota(tokens, prazo):
+        livre = app.fila_chamadas_modelo.entrar('sonda', 0.01)
+        if livre:
+            app.fila_chamadas_modelo.sair()
+        vagas_na_espera.append(livre)
+
+    monkeypatch.setattr(app, '_respeitar_cota', respeitar_cota)
+
+    assert app.obter_resposta_gemini(HISTORICO, 'conversa-cota', '111') == 'resposta'
+    assert ''.join(app.obter_resposta_gemini_stream(HISTORICO, 'conversa-cota-stream', '111')) \
+        == 'primeiro segundo terceiro'
+    assert vagas_na_espera == [True, True]
+
+
+def test_cota_de_tokens_negada_devolve_a_ficha_da_requisicao(app, monkeypatch):
+    requisicoes = app.LimitadorTaxa(60)
+    tokens = app.LimitadorTaxa(600)
+    monkeypatch.setattr(app, 'limite_requisicoes_modelo', requisicoes)
+    monkeypatch.setattr(app, 'limite_tokens_modelo', tokens)
+    assert tokens.consumir(tokens.capacidade, app.time.monotonic() + 1)
+
+    with pytest.raises(app.ErroModelo):
+        app._respeitar_cota(50, app.time.monotonic() + 0.01)
+
+    assert requisicoes._fichas == pytest.approx(requisicoes.capacidade)
@@ -0,0 +1,76 @@
+from datetime import datetime
+
+import pytest
+
+TERCA = datetime(2025, 9, 9, 10, 0)
+
+
+def _responder(app_modulo, pergunta, hoje=TERCA):
+    resposta = app_modulo.responder_diretamente('445', 'Eduardo Ambrósio Silva', pergunta, hoje)
+    return resposta[0] if resposta else None
+
+
+@pytest.mark.parametrize('pergunta', [
+    'o que vai cair na prova?',
+    'quando é a prova de cálculo e o que estudar?',
+    'e amanhã?',
+    'horário de quarta e qual a sala?',
+])
+def test_perguntas_com_algo_a_mais_vao_para_o_modelo(app_modulo, pergunta):
+    assert _responder(app_modulo, pergunta) is None
+
+
+def test_horario_de_um_dia(app_modulo):
+    texto = _responder(app_modulo, 'horário de quarta')
+
+    assert texto.split('\n') == ["Aqui está:",
+                                 "Quarta-feira: Fundamentos matemáticos para computação, das 19:00 às 22:40"]
+
+
+def test_amanha_e_o_dia_seguinte_ao_de_hoje(app_modulo):
+    assert 'Quarta-feira' in _responder(app_modulo, 'aula amanhã')
+    assert _responder(app_modulo, 'aula amanhã', hoje=datetime(2025, 9, 12)) == \
+        "Você não tem aulas presenciais em: sábado."
+    assert 'Segunda-feira' in _responder(app_modulo, 'aula amanhã', hoje=datetime(2025, 9, 14))
+
+
+@pytest.mark.parametrize('hoje, esperado', [
+    (datetime(2025, 9, 1), '15 a 20 de setembro: 1ª Verificação de Aprendizagem 1ª VA'),
+    (datetime(2025, 9, 18, 21, 0), '15 a 20 de setembro: 1ª Verificação de Aprendizagem 1ª VA'),
+    (datetime(2025, 9, 21), '27 a 31 de outubro: 2ª Verificação de Aprendizagem 2ª VA'),
+])
+def test_proxima_prova_a_partir_de_hoje(app_modulo, hoje, esperado):
+    texto = _responder(app_modulo, 'próxima prova', hoje)
+
+    assert texto.split('\n') == ["Pelo calendário acadêmico:", f"{esperado} (Avaliação)"]
+
+
+def test_calendario_vira_o_ano_depois_de_dezembro(app_modulo):
+    eventos = app_modulo.obter_tabelas_base()['calendario']
+
+    assert {e['inicio'].year for e in eventos if e['mes'] == 12} == {2025}
+    assert {e['inicio'].year for e in eventos if e['mes'] == 1} == {2026}
+
+
+def test_rota_responde_horario_direto_e_manda_o_resto_ao_modelo(app_modulo, monkeypatch):
+    chamadas = []
+
+    def modelo(historico, id_conversa=None, ra_usuario=None):
+        chamadas.append(historico[-1]['content'])
+        return "Resposta do modelo"
+
+    monkeypatch.setattr(app_modulo, 'obter_resposta_gemini', modelo)
+    monkeypatch.setattr(app_modulo, 'cache_respostas', app_modulo.CacheRespostas(100, 3600, True, 0.85))
+    cliente = app_modulo.app.test_client()
+    with cliente.session_transaction() as sessao:
+        sessao['usuario_logado'] = '445'
+        sessao['nome_usuario'] = 'Eduardo Ambrósio Silva'
+
+    direta = cliente.post('/enviar_mensagem', json={'pergunta': 'horário de quarta'}).get_json()
+    assert 'Fundamentos matemáticos para computação' in direta['resposta']
+    assert chamadas == []
+
+    cliente.post('/limpar')
+    pelo_modelo = cliente.post('/enviar_mensagem', json={'pergunta': 'o que vai cair na prova?'}).get_json()
+    assert 'Resposta do modelo' in pelo_modelo['resposta']
+    assert len(chamadas) == 1 and chamadas[0].endswith('o que vai cair na prova?')
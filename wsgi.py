@@ -0,0 +1,27 @@
+# ============================================================================
+# PONTO DE ENTRADA DE PRODUÇÃO - UNIHELP
+# ============================================================================
+# Uso: gunicorn -c gunicorn.conf.py wsgi:app
+#
+# Cada worker roda com gevent: enquanto uma chamada ao Gemini espera a
+# resposta (vários segundos), o mesmo worker atende outras conversas. Por
+# isso o monkey patch precisa acontecer antes de importar o app, e o cliente
+# do Gemini usa o transporte REST (o gRPC não coopera com o gevent).
+# A base de conhecimento e o cliente do modelo são carregados por criar_app().
+
+from gevent import monkey
+
+monkey.patch_all()
+
+import os
+
+os.environ.setdefault('UNIHELP_GEMINI_TRANSPORTE', 'rest')
+# Com vários workers o histórico das conversas precisa ser compartilhado
+os.environ.setdefault('UNIHELP_CONVERSAS_BACKEND', 'sqlite')
+
+from app import criar_app  # noqa: E402
+
+# Com preload_app (gunicorn.conf.py) isto roda uma vez no mestre, antes do fork
+app = criar_app()
+
+__all__ = ['app']